@@ -0,0 +1,397 @@
+# Microbenchmarks for the weightdamleven extension on synthetic Latin-like words and typo queries.
+# Nothing is downloaded and the server isn't needed, e.g.
+#   python tools/benchmark_weightdamleven.py --words 200000 --threads 1,2,4,0 --output before.json
+#   (change weightdamleven_cpp/module.cpp, pip install it again)
+#   python tools/benchmark_weightdamleven.py --words 200000 --threads 1,2,4,0 --output after.json --compare before.json
+# Every run first checks each engine setup it times against a naive Python implementation on a small corpus,
+# and exits with 1 before timing anything on a mismatch.
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import numpy as np
+
+import weightdamleven
+
+# the server's keyboard layout and cost profiles, see Latin.calc_char_char_cost() and cost_profiles in wiktionary_latin.py
+KEY_LAYOUT = [
+    "`1234567890-=",
+    "qwertyuiop[]\\",
+    "asdfghjkl;'",
+    "zxcvbnm,./"]
+KEY_ROW_OFFSETS = [0.0, 1.5, 2.0, 2.5]
+CASE_COST = 0.1
+NEIGHBOUR_DISTANCE = 1.2  # keys this close are typos of each other
+COST_PROFILES = {  # name -> (replace_cost, insert_cost, append_cost, delete_cost, transpose_cost)
+    'perquire': (10.0, 3.0, 3.0, 3.0, 2.0),
+    'suggestions': (10.0, 3.0, 0.1, 3.0, 2.0),  # 'sentio_felix' has the costs of 'perquire'
+}
+DELETION_INDEX_FOLD_COST = 0.5
+SINGLE_THREAD_MODES = ('topk', 'batch', 'single')
+SINGLE_RESULT_MODES = ('single', 'single_multithread')  # the best word only, whatever --num-results
+LONG_VOWELS = {'ā': 'a', 'ē': 'e', 'ī': 'i', 'ō': 'o', 'ū': 'u',
+               'Ā': 'A', 'Ē': 'E', 'Ī': 'I', 'Ō': 'O', 'Ū': 'U'}
+
+ONSETS = ['', 'b', 'c', 'd', 'f', 'g', 'l', 'm', 'n', 'p', 'qu', 'r', 's', 't', 'v', 'pr', 'tr', 'st', 'sc', 'cr', 'gr']
+VOWELS = ['a', 'e', 'i', 'o', 'u', 'ae', 'au']
+CODAS = ['', '', '', 'n', 'r', 's', 't', 'm', 'l', 'x']
+ENDINGS = ['us', 'a', 'um', 'ī', 'ae', 'ō', 'is', 'em', 'ēs', 'ibus', 'ōrum', 'ārum', 'ere', 'āre', 'īre', 'at', 'ant',
+           'unt', 'it', 'or', 'ātur', 'ēbat', 'ābunt', 'issimus', 'tiō', 'tiōnem']
+
+
+def make_key_positions() -> dict[str, complex]:
+    """ char -> row + 1j * column of its key, both cases. """
+    positions = {}
+    for row, keys in enumerate(KEY_LAYOUT):
+        for column, key in enumerate(keys):
+            positions[key] = row + 1j * (column + KEY_ROW_OFFSETS[row])
+            positions.setdefault(key.upper(), positions[key])
+    return positions
+
+
+def make_words(count: int, length_mean: float, length_stddev: float, max_length: int, seed: int) -> list[str]:
+    """ count distinct words, sorted: syllable stems and Latin endings, a few capitalized or of two words. """
+    rng = random.Random(seed)
+    words = set()
+    for _ in range(count * 20):
+        if len(words) >= count:
+            break
+        length = min(max(1, round(rng.gauss(length_mean, length_stddev))), max_length)
+        ending = rng.choice(ENDINGS) if length > 3 else ''
+        stem = ''
+        while len(stem) + len(ending) < length:
+            stem += rng.choice(ONSETS) + rng.choice(VOWELS) + rng.choice(CODAS)
+        word = (stem + ending)[:max_length]
+        if rng.random() < 0.05:
+            word = word.capitalize()
+        if rng.random() < 0.02 and len(word) + 4 <= max_length:
+            word += ' ' + rng.choice(ONSETS[1:]) + rng.choice(VOWELS) + rng.choice(['', 's', 'm'])
+        words.add(word)
+    return sorted(words)
+
+
+def make_queries(words: list[str], count: int, prefix_fraction: float, seed: int) -> list[str]:
+    """ Corpus words with up to two typos (nearby keys, missing, extra or swapped letters, no macrons, case), some cut short. """
+    rng = random.Random(seed)
+    positions = make_key_positions()
+    neighbours = {key: [other for other in positions if other != key and other.islower() == key.islower()
+                        and abs(positions[key] - positions[other]) <= NEIGHBOUR_DISTANCE]
+                  for key in positions}
+    queries = []
+    for _ in range(count):
+        query = list(rng.choice(words))
+        if rng.random() < 0.7:
+            query = [LONG_VOWELS.get(char, char) for char in query]  # typed without macrons
+        for _ in range(rng.choice([0, 1, 1, 2])):
+            p = rng.randrange(len(query)) if query else 0
+            edit = rng.randrange(5)
+            if edit == 0 and query and neighbours.get(query[p]):
+                query[p] = rng.choice(neighbours[query[p]])
+            elif edit == 1 and len(query) > 1:
+                del query[p]
+            elif edit == 2:
+                query.insert(p, rng.choice(neighbours.get(query[p], ['e']) or ['e']) if query else 'e')
+            elif edit == 3 and p + 1 < len(query):
+                query[p], query[p + 1] = query[p + 1], query[p]
+            elif edit == 4 and query:
+                query[p] = query[p].swapcase()
+        if rng.random() < prefix_fraction and len(query) > 2:
+            query = query[:rng.randint(2, len(query) - 1)]  # still typing
+        queries.append(''.join(query))
+    return queries
+
+
+def make_chars(words: list[str]) -> list[str]:
+    """ chars[code]: the keyboard first, so the cost table covers it, then the rest of the words' chars. """
+    chars = list(make_key_positions()) + [' ']
+    known = set(chars)
+    for char in sorted(set(itertools.chain.from_iterable(words)) - known):
+        chars.append(char)
+    return chars
+
+
+def make_cost_matrix(chars: list[str]) -> np.ndarray:
+    """ Key distance plus CASE_COST between the keyboard's chars, replace_cost applies to every other char. """
+    positions = make_key_positions()
+    keys = [char for char in chars if char in positions]
+    cost_matrix = np.zeros((len(keys), len(keys)), dtype=np.float64)
+    for i, a in enumerate(keys):
+        for j, b in enumerate(keys):
+            if a != b:
+                cost_matrix[i, j] = abs(positions[a] - positions[b]) + (CASE_COST if a.islower() != b.islower() else 0.0)
+    return cost_matrix
+
+
+def reference_distance(target: list[int], word: list[int], cost_matrix: np.ndarray, costs: tuple) -> float:
+    """ The distance to turn target into word, the plain DP the kernels must agree with, operation for operation. """
+    replace_cost, insert_cost, append_cost, delete_cost, transpose_cost = costs
+    size = cost_matrix.shape[0]
+    rows = [[0.0] * (len(word) + 1) for _ in range(len(target) + 1)]
+    for j in range(1, len(word) + 1):
+        rows[0][j] = rows[0][j - 1] + (append_cost if j > len(target) else insert_cost)
+    for i in range(1, len(target) + 1):
+        rows[i][0] = i * delete_cost
+        for j in range(1, len(word) + 1):
+            a, b = target[i - 1], word[j - 1]
+            if a == b:
+                replace = 0.0
+            else:
+                replace = float(cost_matrix[a, b]) if a < size and b < size else replace_cost
+            value = min(rows[i - 1][j] + delete_cost, rows[i][j - 1] + (append_cost if j > len(target) else insert_cost))
+            value = min(value, rows[i - 1][j - 1] + replace)
+            if i > 1 and j > 1 and a == word[j - 2] and target[i - 2] == b:
+                value = min(value, rows[i - 2][j - 2] + transpose_cost)
+            rows[i][j] = value
+    return rows[len(target)][len(word)]
+
+
+def build_engine(words: list[str], chars: list[str], cost_matrix: np.ndarray, thread_count: int,
+                 corpus: weightdamleven.Corpus | None = None) -> tuple[weightdamleven.WeightDamLeven, weightdamleven.Corpus]:
+    """ An engine set up like the server's, over a new corpus or one shared with other engines. """
+    if corpus is None:
+        char_codes = {char: code for code, char in enumerate(chars)}
+        codes = np.fromiter((char_codes[char] for word in words for char in word), dtype=np.uint16)
+        offsets = np.zeros(len(words) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(word) for word in words])
+        words_utf8 = np.frombuffer(''.join(word + '\n' for word in words).encode('utf-8'), dtype=np.uint8)
+        corpus = weightdamleven.Corpus(codes, offsets, words_utf8=words_utf8)
+    wdl = weightdamleven.WeightDamLeven(corpus, thread_count)
+    cost_table = weightdamleven.CostTable(cost_matrix)
+    for name, costs in COST_PROFILES.items():
+        wdl.set_cost_profile(name, cost_table, True, *costs)
+    wdl.set_char_table(weightdamleven.CharTable(chars, LONG_VOWELS))
+    return wdl, corpus
+
+
+def set_up_engine(wdl: weightdamleven.WeightDamLeven, search_mode: str, kernel_mode: str, deletion_radius: int) -> None:
+    """ The search mode, kernel mode and deletion index (radius -1 = none) of one timed configuration. """
+    wdl.set_search_mode(getattr(weightdamleven.SearchMode, search_mode))
+    wdl.set_kernel_mode(getattr(weightdamleven.KernelMode, kernel_mode))
+    if deletion_radius >= 0:
+        wdl.build_deletion_index(deletion_radius, fold_cost=DELETION_INDEX_FOLD_COST, profile='perquire')
+
+
+def check_against_reference(args: argparse.Namespace) -> dict:
+    """
+    Every search method the benchmark times, in every search mode, kernel mode and deletion index setting it times,
+    against sorted reference distances on a corpus small enough for Python.
+    """
+    words = make_words(args.check_words, args.length_mean, args.length_stddev, args.max_length, args.seed + 1)
+    queries = make_queries(words, args.check_queries, args.prefix_fraction, args.seed + 2)
+    chars = make_chars(words)
+    cost_matrix = make_cost_matrix(chars)
+    char_table = weightdamleven.CharTable(chars, LONG_VOWELS)
+    char_codes = {char: code for code, char in enumerate(chars)}
+    words_encoded = [[char_codes[char] for char in word] for word in words]
+    num_results = max(args.num_results)
+    expected = {}  # profile -> the expected results of every query
+    for profile, costs in COST_PROFILES.items():
+        expected[profile] = []
+        for query in queries:
+            target = char_table.encode(query)
+            scores = sorted((reference_distance(target, word_encoded, cost_matrix, costs), word)
+                            for word, word_encoded in zip(words, words_encoded))
+            expected[profile].append([(word, score) for score, word in scores[:num_results]])
+
+    mismatches = []
+    configurations = list(itertools.product(args.search_modes, args.kernel_modes))
+    for search_mode, kernel_mode in configurations:
+        wdl, _corpus = build_engine(words, chars, cost_matrix, 2)
+        set_up_engine(wdl, search_mode, kernel_mode, args.deletion_radius)
+        for profile in COST_PROFILES:
+            batches = {
+                'batch': wdl.weighted_damerau_levenshtein_words_batch(queries, num_results, profile=profile),
+                'batch_multithread': wdl.weighted_damerau_levenshtein_words_batch_multithread(queries, num_results, profile=profile),
+            }
+            for i, query in enumerate(queries):
+                got = {
+                    'topk': wdl.weighted_damerau_levenshtein_words(query, num_results, profile=profile),
+                    'topk_multithread': wdl.weighted_damerau_levenshtein_words_multithread(query, num_results, profile=profile),
+                    **{mode: results[i] for mode, results in batches.items()},
+                }
+                for mode in SINGLE_RESULT_MODES:  # the best word only, as its codes
+                    codes, score = getattr(wdl, 'weighted_damerau_levenshtein_' + mode)(query, profile=profile)
+                    got[mode] = [(''.join(chars[code] for code in codes), score)]
+                for mode, results in got.items():
+                    if results != expected[profile][i][:len(results)]:
+                        mismatches.append({'search_mode': search_mode, 'kernel_mode': kernel_mode,
+                                           'deletion_radius': args.deletion_radius, 'profile': profile, 'mode': mode,
+                                           'query': query, 'expected': expected[profile][i][:3], 'got': results[:3]})
+    return {'words': len(words), 'queries': len(queries), 'num_results': num_results,
+            'configurations': len(configurations), 'mismatches': mismatches}
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def time_calls(calls: list, repeat: int) -> list[float]:
+    """ Seconds per call, every call run repeat times. """
+    seconds = []
+    for _ in range(repeat):
+        for call in calls:
+            start = time.perf_counter()
+            call()
+            seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def measure(wdl: weightdamleven.WeightDamLeven, mode: str, queries: list[str], profile: str, num_results: int,
+            batch_size: int, repeat: int) -> dict:
+    if mode in ('topk', 'topk_multithread'):
+        search = getattr(wdl, 'weighted_damerau_levenshtein_words' + ('_multithread' if mode == 'topk_multithread' else ''))
+        calls = [lambda query=query: search(query, num_results, profile=profile) for query in queries]
+        queries_per_call = 1
+    elif mode in SINGLE_RESULT_MODES:
+        search = getattr(wdl, 'weighted_damerau_levenshtein_' + mode)
+        calls = [lambda query=query: search(query, profile=profile) for query in queries]
+        queries_per_call = 1
+    else:
+        search = getattr(wdl, 'weighted_damerau_levenshtein_words_' + mode)
+        batches = [queries[i:i + batch_size] for i in range(0, len(queries), batch_size)]
+        calls = [lambda batch=batch: search(batch, num_results, profile=profile) for batch in batches]
+        queries_per_call = len(queries) / len(batches)
+    for call in calls[:max(1, len(calls) // 10)]:  # warm-up
+        call()
+    wdl.reset_search_stats()
+    seconds = time_calls(calls, repeat)
+    _full, _prefix, _deletion, words_scored, rows_computed = wdl.get_search_stats()
+    searches = len(seconds) * queries_per_call
+    seconds_sorted = sorted(seconds)
+    return {
+        'calls': len(seconds),
+        'queries_per_call': queries_per_call,
+        'queries_per_second': len(seconds) * queries_per_call / sum(seconds),
+        'mean_ms': 1000 * statistics.fmean(seconds),
+        'p50_ms': 1000 * percentile(seconds_sorted, 0.50),
+        'p99_ms': 1000 * percentile(seconds_sorted, 0.99),
+        'words_scored_per_query': words_scored / searches,
+        'rows_per_query': rows_computed / searches,
+    }
+
+
+def run(args: argparse.Namespace) -> dict:
+    words = make_words(args.words, args.length_mean, args.length_stddev, args.max_length, args.seed)
+    queries = make_queries(words, args.queries, args.prefix_fraction, args.seed)
+    chars = make_chars(words)
+    cost_matrix = make_cost_matrix(chars)
+    _wdl, corpus = build_engine(words, chars, cost_matrix, 1)
+    lengths = [len(word) for word in words]
+    report = {
+        'settings': vars(args),
+        'environment': {
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'weightdamleven': weightdamleven.__file__,
+        },
+        'corpus': {'words': len(words), 'mean_length': statistics.fmean(lengths), 'max_length': max(lengths),
+                   'queries': len(queries)},
+        'results': [],
+    }
+    for search_mode, kernel_mode in itertools.product(args.search_modes, args.kernel_modes):
+        engines = {}  # thread count -> engine, all over the same corpus
+        for thread_count in args.threads:
+            wdl, _corpus = build_engine(words, chars, cost_matrix, thread_count, corpus)
+            set_up_engine(wdl, search_mode, kernel_mode, args.deletion_radius)
+            engines.setdefault(wdl.get_thread_count(), wdl)
+        for (thread_count, wdl), profile, num_results in itertools.product(
+                engines.items(), args.profiles, args.num_results):
+            for mode in args.modes:
+                if mode in SINGLE_THREAD_MODES and thread_count != min(engines):
+                    continue  # one thread whatever the pool, measured once
+                if mode in SINGLE_RESULT_MODES and num_results != args.num_results[0]:
+                    continue  # always k=1, measured once
+                result = {'mode': mode, 'threads': 1 if mode in SINGLE_THREAD_MODES else thread_count,
+                          'profile': profile, 'num_results': 1 if mode in SINGLE_RESULT_MODES else num_results,
+                          'search_mode': search_mode, 'kernel_mode': kernel_mode,
+                          **measure(wdl, mode, queries, profile, num_results, args.batch_size, args.repeat)}
+                report['results'].append(result)
+                print_result(result)
+    return report
+
+
+# settings that change what is measured, --compare warns when they differ between the runs
+COMPARED_SETTINGS = ['words', 'length_mean', 'length_stddev', 'max_length', 'queries', 'prefix_fraction', 'seed',
+                     'batch_size', 'deletion_radius']
+
+
+def result_key(result: dict) -> tuple:
+    return tuple(result[name] for name in ('mode', 'threads', 'profile', 'num_results', 'search_mode', 'kernel_mode'))
+
+
+def print_result(result: dict, baseline: dict | None = None) -> None:
+    line = (f"{result['mode']:>17} {result['threads']:>3}t {result['profile']:>11} k={result['num_results']:<4}"
+            f" {result['search_mode']}/{result['kernel_mode']:<7}"
+            f" {result['queries_per_second']:>10.1f} q/s  p50 {result['p50_ms']:>8.3f} ms  p99 {result['p99_ms']:>8.3f} ms"
+            f"  {result['rows_per_query']:>10.0f} rows/q")
+    if baseline is not None:
+        line += f"  x{result['queries_per_second'] / baseline['queries_per_second']:.2f} q/s"
+    print(line)
+
+
+def parse_list(text: str, item_type=str) -> list:
+    return [item_type(item) for item in text.split(',') if item]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="weightdamleven microbenchmarks on synthetic Latin-like words")
+    parser.add_argument('--words', type=int, default=100000, help="synthetic corpus size")
+    parser.add_argument('--length-mean', type=float, default=8.0)
+    parser.add_argument('--length-stddev', type=float, default=3.0)
+    parser.add_argument('--max-length', type=int, default=24)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--prefix-fraction', type=float, default=0.3, help="queries cut short as if still being typed")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--threads', type=lambda text: parse_list(text, int), default=[1, 2, 4, 0],
+                        help="engine pool sizes, 0 = hardware concurrency")
+    parser.add_argument('--num-results', type=lambda text: parse_list(text, int), default=[1, 10, 100])
+    parser.add_argument('--profiles', type=parse_list, default=list(COST_PROFILES))
+    parser.add_argument('--modes', type=parse_list, default=['topk', 'topk_multithread', 'batch', 'batch_multithread',
+                                                             'single', 'single_multithread'])
+    parser.add_argument('--search-modes', type=parse_list, default=['SCAN'])
+    parser.add_argument('--kernel-modes', type=parse_list, default=['SIMD'])
+    parser.add_argument('--deletion-radius', type=int, default=-1, help="build a deletion index of this radius, -1 = none")
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--check-words', type=int, default=2000)
+    parser.add_argument('--check-queries', type=int, default=20)
+    parser.add_argument('--output', help="JSON file for the results")
+    parser.add_argument('--compare', help="JSON file of an earlier run to print speedups against")
+    args = parser.parse_args()
+
+    check = check_against_reference(args)
+    print(f"reference check: {len(check['mismatches'])} mismatches over {check['queries']} queries"
+          f" x {len(COST_PROFILES)} profiles x {check['configurations']} engine setups on {check['words']} words")
+    for mismatch in check['mismatches'][:5]:
+        print(f"  {mismatch}")
+    if check['mismatches']:
+        return 1  # timing wrong answers tells nothing
+
+    report = run(args)
+    report['check'] = check
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline_report = json.load(f)
+        baselines = {result_key(result): result for result in baseline_report['results']}
+        print(f"compared with {args.compare}:")
+        for name in COMPARED_SETTINGS:
+            if baseline_report['settings'].get(name) != report['settings'][name]:
+                print(f"  note: {name} was {baseline_report['settings'].get(name)}, not {report['settings'][name]}")
+        for result in report['results']:
+            if result_key(result) in baselines:
+                print_result(result, baselines[result_key(result)])
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=1, ensure_ascii=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
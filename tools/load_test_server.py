@@ -0,0 +1,324 @@
+# End-to-end load test of the Socket.IO search server: starts wiktionary_latin.py on a loopback port with a fixture word
+# list (nothing is downloaded), then N simulated users type typo'd words one keystroke at a time ('query_update')
+# and sometimes submit them ('perquire'), e.g.
+#   python tools/load_test_server.py --clients 50 --seconds 60 --output load.json
+# It reports the round-trip latency of every answered update, of the last keystroke of each word and of 'perquire',
+# how many updates the server coalesced (it says so when a later keystroke supersedes one) or left unanswered,
+# and the server's CPU time.
+
+import argparse
+import itertools
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+import socketio
+
+from benchmark_weightdamleven import make_words, make_queries
+
+SERVER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "wiktionary_latin_py", "wiktionary_latin.py")
+
+
+class SimulatedUser:
+    """ One Socket.IO client typing words at a human pace, on a thread of its own. """
+
+    def __init__(self, url: str, queries: list[str], args: argparse.Namespace, seed: int):
+        self._args = args
+        self._queries = queries
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._query_ids = itertools.count()  # every query_update carries an id the server echoes
+        self._sent_times: dict[int, float] = {}  # query id -> time.perf_counter() it was sent, until answered
+        self._final_id: int | None = None  # the whole word's query id, once its last keystroke is sent
+        self._final_answered = threading.Event()
+        self._perquire_answered = threading.Event()
+        self.updates_sent = 0
+        self.updates_answered = 0
+        self.updates_superseded = 0  # the server dropped them for a later keystroke's query
+        self.update_latencies: list[float] = []
+        self.finals_sent = 0
+        self.final_latencies: list[float] = []  # last keystroke -> its suggestions, what the user waits for
+        self.perquire_sent = 0
+        self.perquire_latencies: list[float] = []
+        self.errors: list[str] = []
+
+        self._client = socketio.Client(reconnection=False)
+        self._client.on('on_query_update_done', self._on_query_update_done)
+        self._client.on('on_query_update_superseded', self._on_query_update_superseded)
+        self._client.on('on_perquire_done', lambda _data: self._perquire_answered.set())
+        self._client.connect(url, wait_timeout=args.timeout_seconds)
+
+    def get_transport(self) -> str:
+        return self._client.transport()
+
+    def run(self, deadline: float) -> None:
+        try:
+            while time.perf_counter() < deadline:
+                self._type_word(self._rng.choice(self._queries), deadline)
+        except Exception as e:
+            self.errors.append(repr(e))
+
+    def disconnect(self) -> None:
+        self._client.disconnect()
+
+    def _type_word(self, word: str, deadline: float) -> None:
+        for length in range(1, len(word) + 1):
+            prefix = word[:length]
+            query_id = next(self._query_ids)
+            with self._lock:
+                if length == len(word):
+                    self._final_id = query_id
+                    self._final_answered.clear()
+                start = time.perf_counter()
+                self._sent_times[query_id] = start
+            self._client.emit('query_update', {'query': prefix, 'id': query_id})
+            self.updates_sent += 1
+            if length < len(word):
+                self._pause(self._args.keystroke_ms, self._args.keystroke_jitter_ms)
+        self.finals_sent += 1
+        if self._final_answered.wait(self._args.timeout_seconds):
+            self.final_latencies.append(time.perf_counter() - start)
+        if time.perf_counter() < deadline and self._rng.random() < self._args.perquire_fraction:
+            self._perquire_answered.clear()
+            start = time.perf_counter()
+            self._client.emit('perquire', {'query': word})
+            self.perquire_sent += 1
+            if self._perquire_answered.wait(self._args.timeout_seconds):
+                self.perquire_latencies.append(time.perf_counter() - start)
+        self._pause(self._args.think_ms, self._args.think_ms / 2)
+
+    def _on_query_update_done(self, data: dict) -> None:
+        now = time.perf_counter()
+        query_id = data.get('id')
+        with self._lock:
+            start = self._sent_times.pop(query_id, None)
+            if start is None:
+                return
+            self.updates_answered += 1
+            self.update_latencies.append(now - start)
+            if query_id == self._final_id:
+                self._final_answered.set()
+
+    def _on_query_update_superseded(self, data: dict) -> None:
+        with self._lock:
+            if self._sent_times.pop(data.get('id'), None) is not None:
+                self.updates_superseded += 1
+
+    def _pause(self, mean_ms: float, jitter_ms: float) -> None:
+        time.sleep(max(0.0, self._rng.gauss(mean_ms, jitter_ms)) / 1000)
+
+
+def find_free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(words_path: str, port: int, log_path: str) -> subprocess.Popen:
+    """ Flask-SocketIO only runs the Werkzeug server from a terminal, so without one the server gets a pseudo-terminal. """
+    env = dict(os.environ, WIKTIONARY_LATIN_WORDS=words_path, WIKTIONARY_LATIN_HOST='127.0.0.1',
+               WIKTIONARY_LATIN_PORT=str(port), PYTHONUNBUFFERED='1')
+    terminal_fd, server_terminal_fd = None, None
+    if not sys.stdin or not sys.stdin.isatty():
+        import pty  # POSIX only, run the load test from a terminal elsewhere
+        terminal_fd, server_terminal_fd = pty.openpty()
+    try:
+        with open(log_path, 'w') as log:
+            process = subprocess.Popen([sys.executable, SERVER], cwd=os.path.dirname(SERVER), env=env,
+                                       stdin=server_terminal_fd, stdout=log, stderr=subprocess.STDOUT)
+    finally:
+        if server_terminal_fd is not None:
+            os.close(server_terminal_fd)  # the server has its own copy
+    process.terminal_fd = terminal_fd  # kept open while the server runs, stop_server() closes it
+    return process
+
+
+def stop_server(process: subprocess.Popen) -> None:
+    process.terminate()
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+    if process.terminal_fd is not None:
+        os.close(process.terminal_fd)
+
+
+def get_json(url: str) -> dict:
+    with urllib.request.urlopen(url, timeout=5) as response:
+        return json.loads(response.read())
+
+
+def wait_for_server(process: subprocess.Popen, url: str, timeout_seconds: float) -> None:
+    deadline = time.monotonic() + timeout_seconds
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"the server exited with {process.returncode}")
+        try:
+            get_json(f"{url}/query_stats")
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"the server didn't start within {timeout_seconds} s")
+
+
+def get_cpu_seconds(pid: int) -> float | None:
+    """ User + system CPU time of a process from /proc, None where there's no /proc. """
+    try:
+        with open(f"/proc/{pid}/stat", 'r') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def summarize(seconds: list[float]) -> dict:
+    if not seconds:
+        return {'count': 0}
+    seconds = sorted(seconds)
+    def percentile(fraction: float) -> float:
+        return 1000 * seconds[min(len(seconds) - 1, int(fraction * len(seconds)))]
+    return {'count': len(seconds), 'mean_ms': 1000 * statistics.fmean(seconds), 'p50_ms': percentile(0.50),
+            'p90_ms': percentile(0.90), 'p99_ms': percentile(0.99), 'max_ms': 1000 * seconds[-1]}
+
+
+def run(args: argparse.Namespace, directory: str) -> dict:
+    words_path = os.path.join(directory, "latin_words.txt")
+    if args.words_file:
+        with open(args.words_file, 'r', encoding='utf-8') as f:
+            words = sorted(set(word.strip() for word in f if word.strip()))
+    else:
+        words = make_words(args.words, 8.0, 3.0, 24, args.seed)
+    with open(words_path, 'w', encoding='utf-8') as f:
+        f.write(''.join(word + '\n' for word in words))
+    queries = [query for query in make_queries(words, 1000, 0.0, args.seed) if query.strip()]
+
+    port = args.port or find_free_port()
+    url = f"http://127.0.0.1:{port}"
+    log_path = os.path.join(directory, "server.log")
+    process = start_server(words_path, port, log_path)
+    try:
+        start = time.monotonic()
+        wait_for_server(process, url, args.startup_seconds)
+        startup_seconds = time.monotonic() - start
+        users = [SimulatedUser(url, queries, args, args.seed + i) for i in range(args.clients)]
+        cpu_start = get_cpu_seconds(process.pid)
+        wall_start = time.perf_counter()
+        deadline = wall_start + args.seconds
+        threads = [threading.Thread(target=user.run, args=(deadline,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall_seconds = time.perf_counter() - wall_start
+        cpu_end = get_cpu_seconds(process.pid)
+        query_stats = get_json(f"{url}/query_stats")
+        cache_stats = get_json(f"{url}/cache_stats")
+        transport = users[0].get_transport() if users else None
+        for user in users:
+            user.disconnect()
+    except Exception:
+        with open(log_path, 'r', errors='replace') as log:
+            print(log.read()[-4000:], file=sys.stderr)
+        raise
+    finally:
+        stop_server(process)
+
+    updates_sent = sum(user.updates_sent for user in users)
+    updates_answered = sum(user.updates_answered for user in users)
+    updates_superseded = sum(user.updates_superseded for user in users)
+    finals_sent = sum(user.finals_sent for user in users)
+    finals_answered = sum(len(user.final_latencies) for user in users)
+    cpu_seconds = cpu_end - cpu_start if cpu_start is not None and cpu_end is not None else None
+    return {
+        'settings': {**vars(args), 'words': len(words)},
+        'transport': transport,
+        'server': {
+            'startup_seconds': startup_seconds,
+            'cpu_seconds': cpu_seconds,
+            'cpu_utilization': cpu_seconds / wall_seconds if cpu_seconds is not None else None,  # 1.0 = one core busy
+            'query_stats': query_stats,
+            'cache_stats': cache_stats,
+        },
+        'wall_seconds': wall_seconds,
+        'updates': {
+            'sent': updates_sent,
+            'answered': updates_answered,
+            'coalesced': updates_superseded,  # superseded by a later keystroke before they were answered
+            'unanswered': updates_sent - updates_answered - updates_superseded,  # neither, e.g. still running at the end
+            'per_second': updates_sent / wall_seconds,
+            'latency': summarize([seconds for user in users for seconds in user.update_latencies]),
+        },
+        'final_keystrokes': {
+            'sent': finals_sent,
+            'answered': finals_answered,
+            'dropped': finals_sent - finals_answered,  # no suggestions for the whole word within timeout_seconds
+            'latency': summarize([seconds for user in users for seconds in user.final_latencies]),
+        },
+        'perquire': {
+            'sent': sum(user.perquire_sent for user in users),
+            'latency': summarize([seconds for user in users for seconds in user.perquire_latencies]),
+        },
+        'errors': [error for user in users for error in user.errors],
+    }
+
+
+def print_report(report: dict) -> None:
+    def latency(summary: dict) -> str:
+        if not summary['count']:
+            return "none answered"
+        return (f"p50 {summary['p50_ms']:.1f} ms  p90 {summary['p90_ms']:.1f} ms  p99 {summary['p99_ms']:.1f} ms"
+                f"  max {summary['max_ms']:.1f} ms")
+
+    server = report['server']
+    updates = report['updates']
+    finals = report['final_keystrokes']
+    print(f"{report['settings']['clients']} clients over {report['settings']['words']} words for {report['wall_seconds']:.1f} s"
+          f" ({report['transport']}), server started in {server['startup_seconds']:.1f} s")
+    print(f"query_update:     {updates['sent']} sent ({updates['per_second']:.1f}/s), {updates['answered']} answered,"
+          f" {updates['coalesced']} coalesced, {updates['unanswered']} unanswered  {latency(updates['latency'])}")
+    print(f"  last keystroke: {finals['sent']} sent, {finals['dropped']} dropped  {latency(finals['latency'])}")
+    print(f"perquire:         {report['perquire']['sent']} sent  {latency(report['perquire']['latency'])}")
+    if server['cpu_seconds'] is not None:
+        print(f"server CPU:       {server['cpu_seconds']:.1f} s, {100 * server['cpu_utilization']:.0f}% of one core")
+    print(f"server queue:     {server['query_stats']}")
+    for error in report['errors'][:5]:
+        print(f"client error: {error}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Socket.IO load test of wiktionary_latin.py on a fixture word list")
+    parser.add_argument('--clients', type=int, default=20)
+    parser.add_argument('--seconds', type=float, default=30.0, help="how long the users keep typing")
+    parser.add_argument('--words', type=int, default=50000, help="synthetic fixture word list size")
+    parser.add_argument('--words-file', help="a word list to use instead, one word per line")
+    parser.add_argument('--keystroke-ms', type=float, default=120.0)
+    parser.add_argument('--keystroke-jitter-ms', type=float, default=60.0)
+    parser.add_argument('--think-ms', type=float, default=1000.0, help="pause between words")
+    parser.add_argument('--perquire-fraction', type=float, default=0.3, help="words submitted once typed")
+    parser.add_argument('--timeout-seconds', type=float, default=10.0, help="a later answer counts as dropped")
+    parser.add_argument('--startup-seconds', type=float, default=300.0)
+    parser.add_argument('--port', type=int, default=0, help="0 = any free port")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="JSON file for the report")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        report = run(args, directory)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=1, ensure_ascii=False)
+    return 1 if report['errors'] or report['final_keystrokes']['dropped'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
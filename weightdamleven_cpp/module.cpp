@@ -1,315 +1,4107 @@
 //#include <Windows.h>
 #include <pybind11/pybind11.h>
 #include <pybind11/stl.h>
+#include <pybind11/buffer_info.h>
 #include <iostream>
 #include <tuple>
 #include <thread>
 #include <queue>
 #include <algorithm>
+#include <cmath>
+#include <atomic>
+#include <mutex>
+#include <condition_variable>
+#include <functional>
+#include <memory>
+#include <limits>
+#include <cstdint>
+#include <string>
+#include <string_view>
+#include <unordered_set>
+#include <map>
+#include <optional>
+#include <variant>
+#include <type_traits>
+#include <stdexcept>
+#include <cstring>
 
 namespace py = pybind11;
 
+// encoded characters are stored as small integers, the whole corpus lives in one contiguous buffer
+using Code = uint16_t;
+
 struct WordScore
 {
     int index{};
     double score{};
+    int rank{}; // lexical rank of the word, breaks score ties deterministically
 
     bool operator<(const WordScore& rhs) const
     {
-        return score < rhs.score;
+        if (score != rhs.score)
+        {
+            return score < rhs.score;
+        }
+        return rank < rhs.rank;
     }
 };
 
-class WeightDamLeven
+struct SearchCounters
+{
+    // tallied by the kernels of each thread without synchronization, WeightDamLeven::CountScope collects them
+    long long words_scored{ 0 };
+    long long rows_computed{ 0 }; // DP rows: one per target character of a scanned word, one per trie node walked
+};
+
+static thread_local SearchCounters search_counters;
+
+class WorkerPool
 {
+    // threads live as long as the pool, run() hands the same task to every thread and waits for all of them
 
 private:
-    std::vector<std::vector<int>> m_keys_encoded;
-    std::vector<std::vector<double>> m_cost_matrix;
-    bool m_is_key_cost;
-    double m_replace_cost;
-    double m_insert_cost;
-    double m_append_cost;
-    double m_delete_cost;
-    double m_transpose_cost;
+    std::vector<std::thread> m_threads;
+    std::mutex m_run_mutex; // one run() at a time
+    std::mutex m_mutex;
+    std::condition_variable m_cv_start;
+    std::condition_variable m_cv_done;
+    const std::function<void(int)>* m_task{ nullptr };
+    unsigned long long m_generation{ 0 };
+    int m_busy{ 0 };
+    bool m_stop{ false };
+
+    void worker_loop(int worker_index)
+    {
+        unsigned long long generation_seen = 0;
+        while (true)
+        {
+            const std::function<void(int)>* task;
+            {
+                std::unique_lock<std::mutex> lock(m_mutex);
+                m_cv_start.wait(lock, [&] { return m_stop || m_generation != generation_seen; });
+                if (m_stop)
+                {
+                    return;
+                }
+                generation_seen = m_generation;
+                task = m_task;
+            }
+
+            (*task)(worker_index);
+
+            {
+                std::lock_guard<std::mutex> lock(m_mutex);
+                --m_busy;
+            }
+            m_cv_done.notify_one();
+        }
+    }
 
 public:
-    WeightDamLeven(
-        std::vector<std::vector<int>>& keys_encoded,
-        std::vector<std::vector<double>>& cost_matrix,
-        bool is_key_cost,
-        double replace_cost, /* if is_key_cost, then this value is used when a key is out of cost_matrix */
-        double insert_cost,
-        double append_cost,
-        double delete_cost,
-        double transpose_cost)
+    explicit WorkerPool(int thread_count)
+    {
+        thread_count = std::max(thread_count, 1);
+        m_threads.reserve(thread_count);
+        for (int i = 0; i < thread_count; ++i)
+        {
+            m_threads.emplace_back(&WorkerPool::worker_loop, this, i);
+        }
+    }
+
+    ~WorkerPool()
     {
-        m_keys_encoded = std::move(keys_encoded);
-        m_cost_matrix = std::move(cost_matrix);
-        m_is_key_cost = is_key_cost;
-        m_replace_cost = replace_cost;
-        m_insert_cost = insert_cost;
-        m_append_cost = append_cost;
-        m_delete_cost = delete_cost;
-        m_transpose_cost = transpose_cost;
+        {
+            std::lock_guard<std::mutex> lock(m_mutex);
+            m_stop = true;
+        }
+        m_cv_start.notify_all();
+        for (auto& thread : m_threads)
+        {
+            thread.join();
+        }
     }
 
-    double key_weighted_damerau_levenshtein(
-        const std::vector<int>& str1,
-        const std::vector<int>& str2,
-        const double score_to_beat)
+    WorkerPool(const WorkerPool&) = delete;
+    WorkerPool& operator=(const WorkerPool&) = delete;
+
+    int size() const
     {
-        int len1 = (int)str1.size();
-        int len2 = (int)str2.size();
+        return (int)m_threads.size();
+    }
 
-        // 3-row dynamic programming - only rows i, i-1, i-2 are needed
-        // thread_local buffers - reused across calls, eliminates heap allocation in steady state
-        thread_local std::vector<double> row0, row1, row2;
-        std::vector<double>* rows[3] = { &row0, &row1, &row2 };
-        for (auto* r : rows)
+    void run(const std::function<void(int)>& task)
+    {
+        std::lock_guard<std::mutex> run_lock(m_run_mutex);
         {
-            if ((int)r->size() < len2 + 1)
+            std::lock_guard<std::mutex> lock(m_mutex);
+            m_task = &task;
+            m_busy = (int)m_threads.size();
+            ++m_generation;
+        }
+        m_cv_start.notify_all();
+
+        std::unique_lock<std::mutex> lock(m_mutex);
+        m_cv_done.wait(lock, [&] { return m_busy == 0; });
+        m_task = nullptr;
+    }
+};
+
+// max-heap of capacity num_results: top() is the worst (highest) accepted score
+using WordScoreHeap = std::priority_queue<WordScore, std::vector<WordScore>>;
+
+struct ScanChunk
+{
+    int len{}; // which length bucket
+    int begin{}; // [begin, end) positions within m_length_buckets[len]
+    int end{};
+};
+
+enum class SearchMode
+{
+    SCAN, // score every word that survives the length buckets
+    TRIE, // walk a prefix trie, one DP row per node, shared by every word below it
+};
+
+enum class KernelMode
+{
+    SCALAR, // one word at a time in double precision
+    SIMD, // several same-length words per SIMD register, double precision, bit-identical to SCALAR
+    SIMD_FLOAT32, // twice the lanes, float32 scores only filter words, which are then rescored in double precision
+    SIMD_FIXED_POINT, // same, with int32 costs in units of 1 / FIXED_POINT_SCALE
+};
+
+template <typename T>
+struct LaneProfile
+{
+    // the costs of one target converted to T, with one replace cost row per target character that is padded
+    // to every code in the corpus, so the lookup needs neither a bounds check nor the m_is_key_cost branch
+    int code_limit{};
+    std::vector<T> replace_costs; // replace_costs[i * code_limit + code] = replace_cost(target[i], code)
+    T insert_cost{};
+    T append_cost{};
+    T delete_cost{};
+    T transpose_cost{};
+    double scale{ 1.0 }; // score = T value / scale
+    double error_per_edit{ 0.0 }; // how far each edit's T cost may be from the double cost, relative to the score for float32
+    double max_cost{ 0.0 }; // the largest single edit cost
+};
+
+struct QueryProfile
+{
+    const std::vector<int>* target{ nullptr };
+    KernelMode mode{ KernelMode::SCALAR };
+    LaneProfile<double> lanes_f64;
+    LaneProfile<float> lanes_f32;
+    LaneProfile<int32_t> lanes_fixed;
+};
+
+struct TrieNode
+{
+    int parent{ -1 };
+    int subtree_end{}; // nodes are stored in preorder, the subtree of node n is [n, subtree_end)
+    int words_begin{}; // words ending at this node are m_trie_words[words_begin:words_end]
+    int words_end{};
+    Code code{}; // the code on the edge from the parent
+    uint16_t depth{};
+    uint16_t min_len{}; // shortest and longest word in the subtree
+    uint16_t max_len{};
+};
+
+struct TrieChunk
+{
+    int node{};
+    bool descend{}; // score the whole subtree, or only the words ending at node
+};
+
+struct TrieIndex
+{
+    // prefix trie over the encoded words of one corpus version
+    std::vector<TrieNode> nodes;
+    std::vector<int> words; // word indices sorted by codes
+    std::vector<TrieChunk> chunks; // work items, subtrees rooted at TRIE_SPLIT_DEPTH plus shallower words
+    int max_depth{ 0 };
+
+    static constexpr int TRIE_SPLIT_DEPTH = 2; // trie subtrees below this depth are the work items
+};
+
+struct PrefixIndex
+{
+    // live word indices by encoded length, each length in code order (ties in lexical order), so the words
+    // of one length that start with a given prefix are one contiguous range
+    std::vector<std::vector<int>> buckets;
+};
+
+static std::shared_ptr<void> hold_buffer(py::buffer_info&& info)
+{
+    // keeps the exporting Python object (and so the data pointer) alive, releasing it needs the GIL
+    return std::shared_ptr<void>(
+        new py::buffer_info(std::move(info)),
+        [](void* held)
+        {
+            py::gil_scoped_acquire gil;
+            delete static_cast<py::buffer_info*>(held);
+        });
+}
+
+template <typename T>
+static void check_buffer(const py::buffer_info& info, const char* name, const std::string& formats, int ndim)
+{
+    // accept any C-contiguous buffer of the right item type, e.g. a NumPy array, without copying it
+    std::string format = info.format;
+    if (!format.empty() && std::string("@=<>!").find(format[0]) != std::string::npos)
+    {
+        format = format.substr(1);
+    }
+    if (info.itemsize != (py::ssize_t)sizeof(T) || format.size() != 1 || formats.find(format[0]) == std::string::npos)
+    {
+        throw std::invalid_argument(std::string(name) + ": expected " + std::to_string(sizeof(T)) + "-byte items of format '" + formats + "', got '" + info.format + "'");
+    }
+    if (info.ndim != ndim)
+    {
+        throw std::invalid_argument(std::string(name) + ": expected " + std::to_string(ndim) + " dimension(s)");
+    }
+    py::ssize_t stride = info.itemsize;
+    for (int dim = ndim - 1; dim >= 0; --dim)
+    {
+        if (info.shape[dim] > 1 && info.strides[dim] != stride)
+        {
+            throw std::invalid_argument(std::string(name) + ": expected a C-contiguous buffer");
+        }
+        stride *= info.shape[dim];
+    }
+}
+
+struct WordStore
+{
+    // flat words: word i is codes[offsets[i]] ... codes[offsets[i + 1] - 1]
+    // the pointers either refer to the _owned vectors or into Python buffers kept alive by the _buffer members
+    const Code* codes{ nullptr };
+    const int64_t* offsets{ nullptr };
+    int count{ 0 };
+    std::vector<Code> codes_owned;
+    std::vector<int64_t> offsets_owned{ 0 };
+    std::shared_ptr<void> codes_buffer;
+    std::shared_ptr<void> offsets_buffer;
+
+    // optional original UTF-8 words, each followed by '\n': word i is words_utf8[words_offsets[i]] ... words_utf8[words_offsets[i + 1] - 2]
+    // the view refers to words_utf8_owned or into a Python buffer kept alive by words_utf8_buffer
+    std::string_view words_utf8;
+    std::string words_utf8_owned;
+    std::shared_ptr<void> words_utf8_buffer;
+    std::vector<int64_t> words_offsets;
+
+    WordStore() = default;
+    WordStore(const WordStore&) = delete; // the pointers may refer to the owned members
+    WordStore& operator=(const WordStore&) = delete;
+
+    const Code* word_codes(int index) const
+    {
+        return codes + offsets[index];
+    }
+
+    int word_len(int index) const
+    {
+        return (int)(offsets[index + 1] - offsets[index]);
+    }
+
+    bool has_words() const
+    {
+        return !words_offsets.empty();
+    }
+
+    std::string_view word_utf8(int index) const
+    {
+        return words_utf8.substr(
+            (size_t)words_offsets[index],
+            (size_t)(words_offsets[index + 1] - words_offsets[index] - 1));
+    }
+
+    void append_owned(const Code* word, int len)
+    {
+        codes_owned.insert(codes_owned.end(), word, word + len);
+        offsets_owned.push_back((int64_t)codes_owned.size());
+    }
+
+    void append_owned(const std::vector<int>& word)
+    {
+        for (int code : word)
+        {
+            if (code < 0 || code > std::numeric_limits<Code>::max())
             {
-                r->resize(len2 + 1);
+                throw std::invalid_argument("keys_encoded: code " + std::to_string(code) + " is out of range");
             }
+            codes_owned.push_back((Code)code);
         }
+        offsets_owned.push_back((int64_t)codes_owned.size());
+    }
 
-        // p1 = row i-1 index, p2 = row i-2 index, cur = row being written
-        int cur = 2;
-        int p1 = 0;
-        int p2 = 1;
+    void append_owned(std::string_view word)
+    {
+        if (word.find('\n') != std::string_view::npos)
+        {
+            throw std::invalid_argument("words: a word contains a newline");
+        }
+        words_utf8_owned += word;
+        words_utf8_owned += '\n';
+    }
 
-        // initialize row 0 into rows[p1]
-        (*rows[p1])[0] = 0.0;
-        for (int j = 1; j <= len2; ++j)
+    void finish_owned(bool with_words)
+    {
+        // point at the owned vectors once they stop growing
+        codes = codes_owned.data();
+        offsets = offsets_owned.data();
+        count = (int)offsets_owned.size() - 1;
+        if (with_words)
         {
-            double insert_append_cost = j > len1 ? m_append_cost : m_insert_cost;
-            (*rows[p1])[j] = (*rows[p1])[j - 1] + insert_append_cost;
+            index_words_utf8(words_utf8_owned);
+        }
+    }
+
+    void index_words_utf8(std::string_view words_utf8_view)
+    {
+        words_utf8 = words_utf8_view;
+        words_offsets.reserve((size_t)count + 1);
+        words_offsets.push_back(0);
+        for (size_t end = words_utf8.find('\n'); end != std::string_view::npos; end = words_utf8.find('\n', end + 1))
+        {
+            words_offsets.push_back((int64_t)end + 1);
+        }
+        if ((int)words_offsets.size() - 1 != count || (int64_t)words_utf8.size() != words_offsets.back())
+        {
+            throw std::invalid_argument("words: expected one newline-terminated word per encoded word");
+        }
+    }
+
+    void check_offsets() const
+    {
+        for (int index = 0; index < count; ++index)
+        {
+            if (offsets[index + 1] < offsets[index])
+            {
+                throw std::invalid_argument("keys_offsets must be nondecreasing");
+            }
+        }
+    }
+};
+
+class DeletionIndex;
+
+class CorpusVersion
+{
+    // one immutable state of the searchable words: the first words come from m_base, later additions from m_added,
+    // and removed words stay in place as tombstones until compaction, so word indices only change on compaction
+    // an update builds a new version, searches keep the version they started on until they finish
+
+private:
+    std::shared_ptr<const WordStore> m_base;
+    std::shared_ptr<const WordStore> m_added; // index i >= m_base->count is m_added word i - m_base->count
+    std::vector<uint8_t> m_removed; // m_removed[index] != 0 for tombstones, empty when there are none
+    int m_removed_count{ 0 };
+    unsigned long long m_id;
+    std::vector<int> m_lex_order; // live word indices in lexical order
+    std::vector<int> m_lex_rank; // m_lex_rank[index] = position of the word in m_lex_order
+    std::vector<std::vector<int>> m_length_buckets; // m_length_buckets[len] = ascending indices of live words with that encoded length
+    int m_code_limit{ 1 }; // every corpus code is below this
+
+    // built on the first search in SearchMode::TRIE, or before publishing when the engine is already in it
+    mutable std::mutex m_trie_mutex;
+    mutable std::unique_ptr<TrieIndex> m_trie;
+
+    // built before the version is published, the exact and prefix fast path and the first pass of every top-k search use it
+    mutable std::mutex m_prefix_index_mutex;
+    mutable std::unique_ptr<PrefixIndex> m_prefix_index;
+
+    // attached by Corpus, update() passes it on until compaction renumbers the words, it only covers words below
+    // its word_count(): later additions are always candidates
+    mutable std::mutex m_deletion_index_mutex;
+    mutable std::shared_ptr<const DeletionIndex> m_deletion_index;
+
+    static constexpr double COMPACTION_FRACTION = 0.25; // compact once tombstones plus additions exceed this share of the base
+    static constexpr int COMPACTION_MIN_WORDS = 1024;
+
+    static unsigned long long next_version_id()
+    {
+        static std::atomic<unsigned long long> version_counter{ 0 };
+        return ++version_counter;
+    }
+
+    static std::shared_ptr<const WordStore> empty_store(bool with_words)
+    {
+        auto store = std::make_shared<WordStore>();
+        store->finish_owned(with_words);
+        return store;
+    }
+
+    bool lex_less(int a, int b) const
+    {
+        // UTF-8 byte order is code point order, the same as Python's sorted(), fall back to the codes without words
+        if (has_words())
+        {
+            return word_utf8(a) < word_utf8(b);
+        }
+        return std::lexicographical_compare(
+            word_codes(a), word_codes(a) + word_len(a),
+            word_codes(b), word_codes(b) + word_len(b));
+    }
+
+    void init_lex_order(const std::vector<int>& previous_order, int first_new_index)
+    {
+        // the previous version's live order minus the new tombstones, merged with the sorted new words
+        std::vector<int> kept;
+        kept.reserve(previous_order.size());
+        for (int index : previous_order)
+        {
+            if (is_live(index))
+            {
+                kept.push_back(index);
+            }
+        }
+        std::vector<int> fresh;
+        for (int index = first_new_index; index < slot_count(); ++index)
+        {
+            if (is_live(index))
+            {
+                fresh.push_back(index);
+            }
+        }
+        // a corpus stored in sorted order (e.g. a snapshot) needs no sort
+        auto less = [&](int a, int b) { return lex_less(a, b); };
+        if (!std::is_sorted(fresh.begin(), fresh.end(), less))
+        {
+            std::sort(fresh.begin(), fresh.end(), less);
+        }
+        m_lex_order.resize(kept.size() + fresh.size());
+        std::merge(kept.begin(), kept.end(), fresh.begin(), fresh.end(), m_lex_order.begin(), less);
+
+        m_lex_rank.assign(slot_count(), -1);
+        for (int rank = 0; rank < (int)m_lex_order.size(); ++rank)
+        {
+            m_lex_rank[m_lex_order[rank]] = rank;
+        }
+    }
+
+    void init_length_buckets()
+    {
+        for (int index = 0; index < slot_count(); ++index)
+        {
+            if (!is_live(index))
+            {
+                continue;
+            }
+            size_t len = (size_t)word_len(index);
+            if (len >= m_length_buckets.size())
+            {
+                m_length_buckets.resize(len + 1);
+            }
+            m_length_buckets[len].push_back(index);
+            for (const Code* code = word_codes(index); code != word_codes(index) + len; ++code)
+            {
+                m_code_limit = std::max(m_code_limit, (int)*code + 1);
+            }
+        }
+    }
+
+    TrieIndex build_trie() const
+    {
+        std::vector<int> order;
+        order.reserve(m_lex_order.size());
+        for (int index = 0; index < slot_count(); ++index)
+        {
+            if (is_live(index))
+            {
+                order.push_back(index);
+            }
+        }
+        std::sort(order.begin(), order.end(), [&](int a, int b)
+        {
+            return std::lexicographical_compare(
+                word_codes(a), word_codes(a) + word_len(a),
+                word_codes(b), word_codes(b) + word_len(b));
+        });
+
+        // sorted words share a prefix with their predecessor: pop the path back to it and push the rest
+        std::vector<TrieNode> nodes(1);
+        std::vector<int> path = { 0 };
+        int max_depth = 0;
+        nodes[0].min_len = std::numeric_limits<uint16_t>::max();
+        for (int position = 0; position < (int)order.size(); ++position)
+        {
+            int index = order[position];
+            const Code* codes = word_codes(index);
+            int len = word_len(index);
+            if (len > std::numeric_limits<uint16_t>::max())
+            {
+                throw std::length_error("word is too long for the trie");
+            }
+
+            int common = 0;
+            while (common + 1 < (int)path.size() && common < len && nodes[path[common + 1]].code == codes[common])
+            {
+                ++common;
+            }
+            while ((int)path.size() > common + 1)
+            {
+                nodes[path.back()].subtree_end = (int)nodes.size();
+                path.pop_back();
+            }
+            for (int depth = common + 1; depth <= len; ++depth)
+            {
+                TrieNode node;
+                node.parent = path.back();
+                node.code = codes[depth - 1];
+                node.depth = (uint16_t)depth;
+                node.min_len = std::numeric_limits<uint16_t>::max();
+                path.push_back((int)nodes.size());
+                nodes.push_back(node);
+            }
+            max_depth = std::max(max_depth, len);
+
+            TrieNode& terminal = nodes[path[len]];
+            if (terminal.words_begin == terminal.words_end)
+            {
+                terminal.words_begin = position;
+            }
+            terminal.words_end = position + 1;
+            for (int depth = 0; depth <= len; ++depth)
+            {
+                TrieNode& node = nodes[path[depth]];
+                node.min_len = std::min(node.min_len, (uint16_t)len);
+                node.max_len = std::max(node.max_len, (uint16_t)len);
+            }
+        }
+        while (!path.empty())
+        {
+            nodes[path.back()].subtree_end = (int)nodes.size();
+            path.pop_back();
+        }
+
+        std::vector<TrieChunk> chunks;
+        for (int node = 0; node < (int)nodes.size(); ++node)
+        {
+            if (nodes[node].depth == TrieIndex::TRIE_SPLIT_DEPTH)
+            {
+                chunks.push_back({ node, true });
+            }
+            else if (nodes[node].depth < TrieIndex::TRIE_SPLIT_DEPTH && nodes[node].words_begin != nodes[node].words_end)
+            {
+                chunks.push_back({ node, false });
+            }
+        }
+
+        TrieIndex trie;
+        trie.nodes = std::move(nodes);
+        trie.words = std::move(order);
+        trie.chunks = std::move(chunks);
+        trie.max_depth = max_depth;
+        return trie;
+    }
+
+    PrefixIndex build_prefix_index() const
+    {
+        PrefixIndex prefix_index;
+        prefix_index.buckets = m_length_buckets;
+        for (int len = 0; len < (int)prefix_index.buckets.size(); ++len)
+        {
+            std::vector<int>& bucket = prefix_index.buckets[len];
+            auto less = [&](int a, int b)
+            {
+                const Code* codes_a = word_codes(a);
+                auto mismatch = std::mismatch(codes_a, codes_a + len, word_codes(b));
+                if (mismatch.first != codes_a + len)
+                {
+                    return *mismatch.first < *mismatch.second;
+                }
+                return m_lex_rank[a] < m_lex_rank[b];
+            };
+            // a corpus stored by length and then codes (e.g. after compact()) needs no sort
+            if (!std::is_sorted(bucket.begin(), bucket.end(), less))
+            {
+                std::sort(bucket.begin(), bucket.end(), less);
+            }
+        }
+        return prefix_index;
+    }
+
+public:
+    CorpusVersion(
+        std::shared_ptr<const WordStore> base,
+        std::shared_ptr<const WordStore> added = nullptr,
+        std::vector<uint8_t> removed = {},
+        const std::vector<int>& previous_order = {},
+        int first_new_index = 0)
+        : m_base(std::move(base)),
+          m_added(added ? std::move(added) : empty_store(m_base->has_words())),
+          m_removed(std::move(removed)),
+          m_id(next_version_id())
+    {
+        m_removed_count = (int)std::count_if(m_removed.begin(), m_removed.end(), [](uint8_t flag) { return flag != 0; });
+        if (m_removed_count == 0)
+        {
+            m_removed.clear();
+        }
+        init_lex_order(previous_order, first_new_index);
+        init_length_buckets();
+    }
+
+    unsigned long long get_id() const
+    {
+        return m_id;
+    }
+
+    int slot_count() const
+    {
+        return m_base->count + m_added->count;
+    }
+
+    int live_count() const
+    {
+        return slot_count() - m_removed_count;
+    }
+
+    bool is_live(int index) const
+    {
+        return m_removed.empty() || m_removed[index] == 0;
+    }
+
+    const Code* word_codes(int index) const
+    {
+        return index < m_base->count ? m_base->word_codes(index) : m_added->word_codes(index - m_base->count);
+    }
+
+    int word_len(int index) const
+    {
+        return index < m_base->count ? m_base->word_len(index) : m_added->word_len(index - m_base->count);
+    }
+
+    bool has_words() const
+    {
+        return m_base->has_words();
+    }
+
+    std::string_view word_utf8(int index) const
+    {
+        return index < m_base->count ? m_base->word_utf8(index) : m_added->word_utf8(index - m_base->count);
+    }
+
+    int lex_rank(int index) const
+    {
+        return m_lex_rank[index];
+    }
+
+    const std::vector<std::vector<int>>& length_buckets() const
+    {
+        return m_length_buckets;
+    }
+
+    int code_limit() const
+    {
+        return m_code_limit;
+    }
+
+    const TrieIndex& get_trie() const
+    {
+        std::lock_guard<std::mutex> lock(m_trie_mutex);
+        if (!m_trie)
+        {
+            m_trie = std::make_unique<TrieIndex>(build_trie());
+        }
+        return *m_trie;
+    }
+
+    const PrefixIndex& get_prefix_index() const
+    {
+        std::lock_guard<std::mutex> lock(m_prefix_index_mutex);
+        if (!m_prefix_index)
+        {
+            m_prefix_index = std::make_unique<PrefixIndex>(build_prefix_index());
+        }
+        return *m_prefix_index;
+    }
+
+    std::shared_ptr<const DeletionIndex> get_deletion_index() const
+    {
+        std::lock_guard<std::mutex> lock(m_deletion_index_mutex);
+        return m_deletion_index;
+    }
+
+    void set_deletion_index(std::shared_ptr<const DeletionIndex> deletion_index) const
+    {
+        std::lock_guard<std::mutex> lock(m_deletion_index_mutex);
+        m_deletion_index = std::move(deletion_index);
+    }
+
+    std::pair<const int*, const int*> prefix_range(const std::vector<int>& prefix, int len) const
+    {
+        // [first, last) of the words of encoded length len that start with prefix, in code order
+        const PrefixIndex& prefix_index = get_prefix_index();
+        if (len < (int)prefix.size() || len >= (int)prefix_index.buckets.size())
+        {
+            return { nullptr, nullptr };
+        }
+        const std::vector<int>& bucket = prefix_index.buckets[len];
+        auto compare_prefix = [&](int index)
+        {
+            const Code* codes = word_codes(index);
+            for (int i = 0; i < (int)prefix.size(); ++i)
+            {
+                if ((int)codes[i] != prefix[i])
+                {
+                    return (int)codes[i] < prefix[i] ? -1 : 1;
+                }
+            }
+            return 0;
+        };
+        auto first = std::partition_point(bucket.begin(), bucket.end(), [&](int index) { return compare_prefix(index) < 0; });
+        auto last = std::partition_point(first, bucket.end(), [&](int index) { return compare_prefix(index) == 0; });
+        return { bucket.data() + (first - bucket.begin()), bucket.data() + (last - bucket.begin()) };
+    }
+
+    std::pair<const int*, const int*> code_order_neighbours(const std::vector<int>& word, int len, int count) const
+    {
+        // up to count words of encoded length len on either side of where word would be in code order
+        const PrefixIndex& prefix_index = get_prefix_index();
+        if (len < 0 || len >= (int)prefix_index.buckets.size())
+        {
+            return { nullptr, nullptr };
+        }
+        const std::vector<int>& bucket = prefix_index.buckets[len];
+        auto position = std::partition_point(bucket.begin(), bucket.end(), [&](int index)
+        {
+            return std::lexicographical_compare(word_codes(index), word_codes(index) + len, word.begin(), word.end());
+        });
+        int middle = (int)(position - bucket.begin());
+        int first = std::max(middle - count, 0);
+        int last = std::min(middle + count, (int)bucket.size());
+        return { bucket.data() + first, bucket.data() + last };
+    }
+
+    int find_word(std::string_view word) const
+    {
+        // index of a live word, -1 if there is none
+        auto it = std::lower_bound(m_lex_order.begin(), m_lex_order.end(), word, [&](int index, std::string_view value)
+        {
+            return word_utf8(index) < value;
+        });
+        if (it == m_lex_order.end() || word_utf8(*it) != word)
+        {
+            return -1;
+        }
+        return *it;
+    }
+
+    bool needs_compaction() const
+    {
+        return m_removed_count + m_added->count > COMPACTION_FRACTION * std::max(m_base->count, COMPACTION_MIN_WORDS);
+    }
+
+    std::shared_ptr<const CorpusVersion> update(
+        const std::vector<std::vector<int>>& keys_encoded,
+        const std::vector<std::string>& words,
+        const std::vector<std::string>& removed_words,
+        int& added_count,
+        int& removed_count) const
+    {
+        // removals apply first, then additions, words already in the corpus are not added twice
+        if (has_words() ? words.size() != keys_encoded.size() : !words.empty())
+        {
+            throw std::invalid_argument("words: expected one word per encoded word, if and only if the corpus has words");
+        }
+        if (!removed_words.empty() && !has_words())
+        {
+            throw std::logic_error("no words were given to the constructor");
+        }
+
+        std::vector<uint8_t> removed = m_removed;
+        removed_count = 0;
+        for (const auto& word : removed_words)
+        {
+            int index = find_word(word);
+            if (index < 0 || (!removed.empty() && removed[index] != 0))
+            {
+                continue;
+            }
+            if (removed.empty())
+            {
+                removed.assign(slot_count(), 0);
+            }
+            removed[index] = 1;
+            ++removed_count;
+        }
+
+        auto added = std::make_shared<WordStore>();
+        for (int index = 0; index < m_added->count; ++index)
+        {
+            added->append_owned(m_added->word_codes(index), m_added->word_len(index));
+            if (has_words())
+            {
+                added->append_owned(m_added->word_utf8(index));
+            }
+        }
+        added_count = 0;
+        std::unordered_set<std::string_view> seen;
+        for (size_t i = 0; i < keys_encoded.size(); ++i)
+        {
+            if (has_words())
+            {
+                int index = find_word(words[i]);
+                bool is_present = index >= 0 && (removed.empty() || removed[index] == 0);
+                if (is_present || !seen.insert(words[i]).second)
+                {
+                    continue;
+                }
+                added->append_owned(words[i]);
+            }
+            added->append_owned(keys_encoded[i]);
+            ++added_count;
+        }
+        added->finish_owned(has_words());
+        if (!removed.empty())
+        {
+            removed.resize((size_t)m_base->count + added->count, 0);
+        }
+
+        auto version = std::make_shared<const CorpusVersion>(m_base, std::move(added), std::move(removed), m_lex_order, slot_count());
+        version->set_deletion_index(get_deletion_index());
+        if (version->needs_compaction())
+        {
+            return version->compact();
+        }
+        return version;
+    }
+
+    std::shared_ptr<const CorpusVersion> compact() const
+    {
+        // copy the live words into one owned store by length and then codes, so that the scan reads each length
+        // bucket as one block with shared prefixes next to each other, this renumbers them 0 ... live_count() - 1
+        auto store = std::make_shared<WordStore>();
+        std::vector<int> new_index(slot_count(), -1);
+        int next_index = 0;
+        for (const auto& bucket : get_prefix_index().buckets)
+        {
+            for (int index : bucket)
+            {
+                new_index[index] = next_index++;
+                store->append_owned(word_codes(index), word_len(index));
+                if (has_words())
+                {
+                    store->append_owned(word_utf8(index));
+                }
+            }
+        }
+        store->finish_owned(has_words());
+
+        // the lexical order carries over, neither it nor the buckets need sorting again
+        std::vector<int> lex_order;
+        lex_order.reserve(m_lex_order.size());
+        for (int index : m_lex_order)
+        {
+            lex_order.push_back(new_index[index]);
+        }
+        return std::make_shared<const CorpusVersion>(std::move(store), nullptr, std::vector<uint8_t>{}, lex_order, next_index);
+    }
+};
+
+class DeletionIndex
+{
+    // the deletion neighbourhood of one corpus version: every string left after deleting up to radius codes
+    // from a live word, as a 64-bit hash next to the word index, sorted by hash
+    //
+    // two words within radius edits (replace, insert, delete, transpose) of each other share a string reached
+    // by at most radius deletions from each, so the words sharing a hash with the target's deletions are the
+    // only ones that can be that close, hash collisions merely add words to rescore
+    // codes are folded first (fold[code], e.g. both cases of a letter to one code): replacements within a
+    // fold class aren't counted as edits
+    //
+    // the arrays either are owned or point into a Python buffer kept alive by m_buffer, see to_bytes()
+
+private:
+    struct Header
+    {
+        char magic[8];
+        uint32_t version;
+        int32_t radius;
+        int32_t word_count;
+        uint32_t fold_size;
+        uint64_t corpus_key;
+        int64_t max_bytes;
+        int64_t entry_count;
+    };
+
+    static constexpr char MAGIC[8] = { 'W', 'D', 'L', 'D', 'E', 'L', '1', '\0' };
+    static constexpr uint32_t FORMAT_VERSION = 1;
+
+    int m_radius{ -1 }; // -1: not even radius 0 fit into max_bytes, the index is empty and never used
+    int m_word_count{ 0 }; // slot count of the corpus version it was built from, later words aren't in it
+    uint64_t m_corpus_key{ 0 };
+    int64_t m_max_bytes{ 0 };
+    const Code* m_fold{ nullptr };
+    int m_fold_size{ 0 };
+    const uint64_t* m_hashes{ nullptr };
+    const int32_t* m_words{ nullptr };
+    int64_t m_entry_count{ 0 };
+    std::vector<Code> m_fold_owned;
+    std::vector<uint64_t> m_hashes_owned;
+    std::vector<int32_t> m_words_owned;
+    std::shared_ptr<void> m_buffer;
+
+    static uint64_t mix(uint64_t hash)
+    {
+        // splitmix64 finalizer
+        hash ^= hash >> 30;
+        hash *= 0xbf58476d1ce4e5b9ULL;
+        hash ^= hash >> 27;
+        hash *= 0x94d049bb133111ebULL;
+        return hash ^ (hash >> 31);
+    }
+
+    static uint64_t hash_codes(const std::vector<int>& codes)
+    {
+        uint64_t hash = 0xcbf29ce484222325ULL ^ codes.size();
+        for (int code : codes)
+        {
+            hash = (hash ^ (uint64_t)(uint32_t)code) * 0x100000001b3ULL;
+        }
+        return mix(hash);
+    }
+
+    static void collect_variants(std::vector<int>& codes, int first, int deletions, std::vector<uint64_t>& hashes)
+    {
+        // deletes positions in increasing order, so each set of deleted positions is visited once
+        hashes.push_back(hash_codes(codes));
+        if (deletions == 0)
+        {
+            return;
+        }
+        for (int position = first; position < (int)codes.size(); ++position)
+        {
+            int code = codes[position];
+            codes.erase(codes.begin() + position);
+            collect_variants(codes, position, deletions - 1, hashes);
+            codes.insert(codes.begin() + position, code);
+        }
+    }
+
+    static double variant_count(int len, int radius)
+    {
+        // sum of C(len, d) for d <= radius, an upper bound of the distinct variants of a word
+        double count = 0.0;
+        double binomial = 1.0;
+        for (int deletions = 0; deletions <= std::min(radius, len); ++deletions)
+        {
+            count += binomial;
+            binomial = binomial * (len - deletions) / (deletions + 1);
+        }
+        return count;
+    }
+
+    std::vector<int> fold_codes(const Code* codes, int len) const
+    {
+        std::vector<int> folded(codes, codes + len);
+        for (int& code : folded)
+        {
+            code = fold(code);
+        }
+        return folded;
+    }
+
+    void point_at_owned()
+    {
+        m_fold = m_fold_owned.data();
+        m_fold_size = (int)m_fold_owned.size();
+        m_hashes = m_hashes_owned.data();
+        m_words = m_words_owned.data();
+        m_entry_count = (int64_t)m_hashes_owned.size();
+    }
+
+public:
+    static constexpr int MAX_RADIUS = 4;
+
+    DeletionIndex(
+        const CorpusVersion& corpus,
+        int max_radius,
+        int64_t max_bytes, /* the hashes and indices use 12 bytes per variant, the radius is lowered until they fit */
+        std::vector<Code> fold) /* fold[code] = the code it's indexed as, codes past its end stay as they are */
+        : m_word_count(corpus.slot_count()),
+          m_corpus_key(calc_corpus_key(corpus)),
+          m_max_bytes(max_bytes),
+          m_fold_owned(std::move(fold))
+    {
+        if (max_radius < 0 || max_radius > MAX_RADIUS)
+        {
+            throw std::invalid_argument("max_radius: expected 0 ... " + std::to_string(MAX_RADIUS));
+        }
+        point_at_owned();
+
+        std::vector<int> live_lengths;
+        for (int index = 0; index < corpus.slot_count(); ++index)
+        {
+            if (corpus.is_live(index))
+            {
+                live_lengths.push_back(corpus.word_len(index));
+            }
+        }
+        double estimate = 0.0;
+        for (m_radius = max_radius; m_radius >= 0; --m_radius)
+        {
+            estimate = 0.0;
+            for (int len : live_lengths)
+            {
+                estimate += variant_count(len, m_radius);
+            }
+            if (estimate * (sizeof(uint64_t) + sizeof(int32_t)) + m_fold_owned.size() * sizeof(Code) <= (double)max_bytes)
+            {
+                break;
+            }
+        }
+        if (m_radius < 0)
+        {
+            return;
+        }
+
+        std::vector<std::pair<uint64_t, int32_t>> entries;
+        entries.reserve((size_t)estimate);
+        std::vector<uint64_t> hashes;
+        for (int index = 0; index < corpus.slot_count(); ++index)
+        {
+            if (!corpus.is_live(index))
+            {
+                continue;
+            }
+            std::vector<int> folded = fold_codes(corpus.word_codes(index), corpus.word_len(index));
+            hashes.clear();
+            collect_variants(folded, 0, m_radius, hashes);
+            std::sort(hashes.begin(), hashes.end());
+            hashes.erase(std::unique(hashes.begin(), hashes.end()), hashes.end());
+            for (uint64_t hash : hashes)
+            {
+                entries.emplace_back(hash, index);
+            }
+        }
+        std::sort(entries.begin(), entries.end());
+        m_hashes_owned.reserve(entries.size());
+        m_words_owned.reserve(entries.size());
+        for (const auto& entry : entries)
+        {
+            m_hashes_owned.push_back(entry.first);
+            m_words_owned.push_back(entry.second);
+        }
+        point_at_owned();
+    }
+
+    explicit DeletionIndex(py::buffer data) /* 1-D uint8, what to_bytes() returned */
+    {
+        // zero-copy, like the Corpus buffers, unless the buffer isn't aligned for the hashes
+        py::buffer_info info = data.request();
+        check_buffer<uint8_t>(info, "data", "Bbc", 1);
+        const uint8_t* bytes = static_cast<const uint8_t*>(info.ptr);
+        size_t size = (size_t)info.shape[0];
+        Header header;
+        if (size < sizeof(Header))
+        {
+            throw std::invalid_argument("data: too short for a DeletionIndex");
+        }
+        std::memcpy(&header, bytes, sizeof(Header));
+        if (std::memcmp(header.magic, MAGIC, sizeof(MAGIC)) != 0 || header.version != FORMAT_VERSION)
+        {
+            throw std::invalid_argument("data: not a DeletionIndex of this version");
+        }
+        size_t fold_end = sizeof(Header) + header.fold_size * sizeof(Code);
+        size_t hashes_begin = (fold_end + alignof(uint64_t) - 1) / alignof(uint64_t) * alignof(uint64_t);
+        size_t words_begin = hashes_begin + (size_t)header.entry_count * sizeof(uint64_t);
+        if (header.entry_count < 0 || header.radius > MAX_RADIUS || size != words_begin + (size_t)header.entry_count * sizeof(int32_t))
+        {
+            throw std::invalid_argument("data: truncated or corrupt DeletionIndex");
+        }
+        m_radius = header.radius;
+        m_word_count = header.word_count;
+        m_corpus_key = header.corpus_key;
+        m_max_bytes = header.max_bytes;
+        m_entry_count = header.entry_count;
+
+        if (reinterpret_cast<uintptr_t>(bytes) % alignof(uint64_t) == 0)
+        {
+            m_fold = reinterpret_cast<const Code*>(bytes + sizeof(Header));
+            m_fold_size = (int)header.fold_size;
+            m_hashes = reinterpret_cast<const uint64_t*>(bytes + hashes_begin);
+            m_words = reinterpret_cast<const int32_t*>(bytes + words_begin);
+            m_buffer = hold_buffer(std::move(info));
+        }
+        else
+        {
+            m_fold_owned.resize(header.fold_size);
+            m_hashes_owned.resize((size_t)header.entry_count);
+            m_words_owned.resize((size_t)header.entry_count);
+            std::memcpy(m_fold_owned.data(), bytes + sizeof(Header), m_fold_owned.size() * sizeof(Code));
+            std::memcpy(m_hashes_owned.data(), bytes + hashes_begin, m_hashes_owned.size() * sizeof(uint64_t));
+            std::memcpy(m_words_owned.data(), bytes + words_begin, m_words_owned.size() * sizeof(int32_t));
+            point_at_owned();
+        }
+    }
+
+    DeletionIndex(const DeletionIndex&) = delete;
+    DeletionIndex& operator=(const DeletionIndex&) = delete;
+
+    static uint64_t calc_corpus_key(const CorpusVersion& corpus)
+    {
+        // tells a saved index apart from one of another corpus, every slot with its codes and whether it's live
+        uint64_t key = mix((uint64_t)corpus.slot_count());
+        for (int index = 0; index < corpus.slot_count(); ++index)
+        {
+            const Code* codes = corpus.word_codes(index);
+            uint64_t hash = 0xcbf29ce484222325ULL ^ (uint64_t)corpus.word_len(index) ^ ((uint64_t)corpus.is_live(index) << 32);
+            for (int i = 0; i < corpus.word_len(index); ++i)
+            {
+                hash = (hash ^ codes[i]) * 0x100000001b3ULL;
+            }
+            key = mix(key ^ hash);
+        }
+        return key;
+    }
+
+    py::bytes to_bytes() const
+    {
+        // header, fold, padding to 8 bytes, hashes, word indices, all in native byte order
+        Header header{};
+        std::memcpy(header.magic, MAGIC, sizeof(MAGIC));
+        header.version = FORMAT_VERSION;
+        header.radius = m_radius;
+        header.word_count = m_word_count;
+        header.fold_size = (uint32_t)m_fold_size;
+        header.corpus_key = m_corpus_key;
+        header.max_bytes = m_max_bytes;
+        header.entry_count = m_entry_count;
+        size_t fold_end = sizeof(Header) + (size_t)m_fold_size * sizeof(Code);
+        size_t hashes_begin = (fold_end + alignof(uint64_t) - 1) / alignof(uint64_t) * alignof(uint64_t);
+        size_t words_begin = hashes_begin + (size_t)m_entry_count * sizeof(uint64_t);
+        std::string data(words_begin + (size_t)m_entry_count * sizeof(int32_t), '\0');
+        std::memcpy(&data[0], &header, sizeof(Header));
+        std::memcpy(&data[sizeof(Header)], m_fold, (size_t)m_fold_size * sizeof(Code));
+        std::memcpy(&data[hashes_begin], m_hashes, (size_t)m_entry_count * sizeof(uint64_t));
+        std::memcpy(&data[words_begin], m_words, (size_t)m_entry_count * sizeof(int32_t));
+        return py::bytes(data);
+    }
+
+    int radius() const
+    {
+        return m_radius;
+    }
+
+    int word_count() const
+    {
+        return m_word_count;
+    }
+
+    uint64_t corpus_key() const
+    {
+        return m_corpus_key;
+    }
+
+    int64_t max_bytes() const
+    {
+        return m_max_bytes;
+    }
+
+    int64_t entry_count() const
+    {
+        return m_entry_count;
+    }
+
+    std::vector<Code> get_fold() const
+    {
+        return std::vector<Code>(m_fold, m_fold + m_fold_size);
+    }
+
+    int fold(int code) const
+    {
+        return code >= 0 && code < m_fold_size ? (int)m_fold[code] : code;
+    }
+
+    void find_candidates(const std::vector<int>& target_word_int, std::vector<int>& candidates) const
+    {
+        // indices of the indexed words sharing a deletion variant with the target, ascending and unique
+        candidates.clear();
+        if (m_radius < 0)
+        {
+            return;
+        }
+        std::vector<int> folded(target_word_int);
+        for (int& code : folded)
+        {
+            code = fold(code);
+        }
+        std::vector<uint64_t> hashes;
+        collect_variants(folded, 0, m_radius, hashes);
+        std::sort(hashes.begin(), hashes.end());
+        hashes.erase(std::unique(hashes.begin(), hashes.end()), hashes.end());
+        for (uint64_t hash : hashes)
+        {
+            auto range = std::equal_range(m_hashes, m_hashes + m_entry_count, hash);
+            candidates.insert(candidates.end(), m_words + (range.first - m_hashes), m_words + (range.second - m_hashes));
+        }
+        std::sort(candidates.begin(), candidates.end());
+        candidates.erase(std::unique(candidates.begin(), candidates.end()), candidates.end());
+    }
+};
+
+class Corpus
+{
+    // the words, shared by any number of engines: a handle on the current CorpusVersion, which every update
+    // replaces as a whole, so a search holds its own reference and finishes on the version it started on
+
+private:
+    std::shared_ptr<const CorpusVersion> m_version;
+    mutable std::mutex m_version_mutex;
+    std::mutex m_update_mutex; // one update at a time, searches never wait for it
+    std::atomic<bool> m_keep_trie{ false }; // some engine searches in SearchMode::TRIE
+
+    // compaction renumbers the words, the deletion index is then rebuilt with the settings of the last one attached
+    std::optional<std::tuple<int, int64_t, std::vector<Code>>> m_deletion_index_settings;
+
+    std::shared_ptr<const CorpusVersion> publish(std::shared_ptr<const CorpusVersion> version)
+    {
+        // the expensive parts are done before the swap, so searches never see a half-built version;
+        // returns the previous version, for the caller to drop after m_update_mutex: freeing its Python
+        // buffers takes the GIL, which a thread waiting on m_update_mutex may hold
+        version->get_prefix_index();
+        if (m_keep_trie.load())
+        {
+            version->get_trie();
+        }
+        if (m_deletion_index_settings && !version->get_deletion_index())
+        {
+            const auto& [max_radius, max_bytes, fold] = *m_deletion_index_settings;
+            version->set_deletion_index(std::make_shared<const DeletionIndex>(*version, max_radius, max_bytes, fold));
+        }
+        std::lock_guard<std::mutex> lock(m_version_mutex);
+        m_version.swap(version);
+        return version;
+    }
+
+public:
+    Corpus(
+        const std::vector<std::vector<int>>& keys_encoded,
+        const std::vector<std::string>& words = {}) /* optional original words, in the same order as keys_encoded */
+    {
+        // nested lists are flattened into owned buffers
+        if (!words.empty() && words.size() != keys_encoded.size())
+        {
+            throw std::invalid_argument("words: expected one newline-terminated word per encoded word");
+        }
+        auto store = std::make_shared<WordStore>();
+        for (const auto& word : keys_encoded)
+        {
+            store->append_owned(word);
+        }
+        for (const auto& word : words)
+        {
+            store->append_owned(word);
+        }
+        store->finish_owned(!words.empty());
+        publish(std::make_shared<const CorpusVersion>(std::move(store)));
+    }
+
+    Corpus(
+        py::buffer keys_codes, /* 1-D uint16: every word's codes back to back */
+        py::buffer keys_offsets, /* 1-D int64 of length word count + 1: word i is keys_codes[keys_offsets[i]:keys_offsets[i + 1]] */
+        const std::vector<std::string>& words = {},
+        std::optional<py::buffer> words_utf8 = std::nullopt) /* 1-D uint8: the same words as UTF-8, each followed by '\n' */
+    {
+        // zero-copy: the buffers are referenced, not copied, and are kept alive as long as a corpus version uses them
+        py::buffer_info codes_info = keys_codes.request();
+        check_buffer<Code>(codes_info, "keys_codes", "H", 1);
+        py::buffer_info offsets_info = keys_offsets.request();
+        check_buffer<int64_t>(offsets_info, "keys_offsets", "qlLQ", 1);
+        if (offsets_info.shape[0] < 1)
+        {
+            throw std::invalid_argument("keys_offsets: expected at least one offset");
+        }
+
+        auto store = std::make_shared<WordStore>();
+        store->codes = static_cast<const Code*>(codes_info.ptr);
+        store->offsets = static_cast<const int64_t*>(offsets_info.ptr);
+        store->count = (int)offsets_info.shape[0] - 1;
+        if (store->offsets[0] < 0 || store->offsets[store->count] > (int64_t)codes_info.shape[0])
+        {
+            throw std::invalid_argument("keys_offsets: offsets are out of range of keys_codes");
+        }
+        store->check_offsets();
+        store->codes_buffer = hold_buffer(std::move(codes_info));
+        store->offsets_buffer = hold_buffer(std::move(offsets_info));
+
+        if (words_utf8)
+        {
+            if (!words.empty())
+            {
+                throw std::invalid_argument("words_utf8: give either words or words_utf8");
+            }
+            py::buffer_info words_utf8_info = words_utf8->request();
+            check_buffer<uint8_t>(words_utf8_info, "words_utf8", "Bbc", 1);
+            std::string_view words_utf8_view(static_cast<const char*>(words_utf8_info.ptr), (size_t)words_utf8_info.shape[0]);
+            store->words_utf8_buffer = hold_buffer(std::move(words_utf8_info));
+            store->index_words_utf8(words_utf8_view);
+        }
+        else if (!words.empty())
+        {
+            for (const auto& word : words)
+            {
+                store->append_owned(word);
+            }
+            store->index_words_utf8(store->words_utf8_owned);
+        }
+        publish(std::make_shared<const CorpusVersion>(std::move(store)));
+    }
+
+    Corpus(const Corpus&) = delete;
+    Corpus& operator=(const Corpus&) = delete;
+
+    std::shared_ptr<const CorpusVersion> current() const
+    {
+        std::lock_guard<std::mutex> lock(m_version_mutex);
+        return m_version;
+    }
+
+    void keep_trie()
+    {
+        // from now on every version gets its trie before it is published
+        m_keep_trie.store(true);
+        current()->get_trie();
+    }
+
+    std::shared_ptr<const DeletionIndex> build_deletion_index(int max_radius, int64_t max_bytes, const std::vector<Code>& fold)
+    {
+        // indexes the current version, and every version compaction makes from now on
+        std::lock_guard<std::mutex> lock(m_update_mutex);
+        auto version = current();
+        auto deletion_index = std::make_shared<const DeletionIndex>(*version, max_radius, max_bytes, fold);
+        version->set_deletion_index(deletion_index);
+        m_deletion_index_settings.emplace(max_radius, max_bytes, fold);
+        return deletion_index;
+    }
+
+    void set_deletion_index(std::shared_ptr<const DeletionIndex> deletion_index)
+    {
+        // a saved index, it must have been built from this very version
+        if (!deletion_index)
+        {
+            throw std::invalid_argument("deletion_index: expected a DeletionIndex");
+        }
+        std::lock_guard<std::mutex> lock(m_update_mutex);
+        auto version = current();
+        if (deletion_index->word_count() != version->slot_count() || deletion_index->corpus_key() != DeletionIndex::calc_corpus_key(*version))
+        {
+            throw std::invalid_argument("deletion_index: built from a different corpus");
+        }
+        version->set_deletion_index(deletion_index);
+        m_deletion_index_settings.emplace(std::max(deletion_index->radius(), 0), deletion_index->max_bytes(), deletion_index->get_fold());
+    }
+
+    std::shared_ptr<const DeletionIndex> get_deletion_index() const
+    {
+        return current()->get_deletion_index();
+    }
+
+    std::tuple<int, int> update_words(
+        const std::vector<std::vector<int>>& keys_encoded,
+        const std::vector<std::string>& words,
+        const std::vector<std::string>& removed_words)
+    {
+        // returns (words added, words removed), words already present or missing are skipped
+        std::shared_ptr<const CorpusVersion> previous; // destroyed after the lock is released
+        std::lock_guard<std::mutex> lock(m_update_mutex);
+        int added_count = 0;
+        int removed_count = 0;
+        auto version = current()->update(keys_encoded, words, removed_words, added_count, removed_count);
+        if (added_count > 0 || removed_count > 0)
+        {
+            previous = publish(std::move(version));
+        }
+        return { added_count, removed_count };
+    }
+
+    int add_words(
+        const std::vector<std::vector<int>>& keys_encoded,
+        const std::vector<std::string>& words)
+    {
+        return std::get<0>(update_words(keys_encoded, words, {}));
+    }
+
+    int remove_words(const std::vector<std::string>& words)
+    {
+        return std::get<1>(update_words({}, {}, words));
+    }
+
+    void compact()
+    {
+        std::shared_ptr<const CorpusVersion> previous; // destroyed after the lock is released
+        std::lock_guard<std::mutex> lock(m_update_mutex);
+        previous = publish(current()->compact());
+    }
+
+    unsigned long long get_version() const
+    {
+        return current()->get_id();
+    }
+
+    int get_word_count() const
+    {
+        return current()->live_count();
+    }
+
+    std::string get_word(int index) const
+    {
+        auto version = current();
+        if (index < 0 || index >= version->slot_count() || !version->is_live(index))
+        {
+            throw py::index_error("word index out of range");
+        }
+        if (!version->has_words())
+        {
+            throw std::logic_error("no words were given to the constructor");
+        }
+        return std::string(version->word_utf8(index));
+    }
+};
+
+class CostTable
+{
+    // flat dense replace cost table: m_table[str1_idx * m_size + str2_idx], shared by any number of cost profiles
+    // the pointer either refers to m_table_owned or into a Python buffer kept alive by m_table_buffer
+
+private:
+    const double* m_table{ nullptr };
+    int m_size{ 0 };
+    std::vector<double> m_table_owned;
+    std::shared_ptr<void> m_table_buffer;
+
+public:
+    explicit CostTable(const std::vector<std::vector<double>>& cost_matrix)
+    {
+        m_size = (int)cost_matrix.size();
+        m_table_owned.assign((size_t)m_size * m_size, 0.0);
+        for (int i = 0; i < m_size; ++i)
+        {
+            for (int j = 0; j < std::min(m_size, (int)cost_matrix[i].size()); ++j)
+            {
+                m_table_owned[(size_t)i * m_size + j] = cost_matrix[i][j];
+            }
+        }
+        m_table = m_table_owned.data();
+    }
+
+    explicit CostTable(py::buffer cost_table) /* 2-D float64, square */
+    {
+        // zero-copy, like the Corpus buffers
+        py::buffer_info cost_table_info = cost_table.request();
+        check_buffer<double>(cost_table_info, "cost_table", "d", 2);
+        if (cost_table_info.shape[0] != cost_table_info.shape[1])
+        {
+            throw std::invalid_argument("cost_table: expected a square table");
+        }
+        m_table = static_cast<const double*>(cost_table_info.ptr);
+        m_size = (int)cost_table_info.shape[0];
+        m_table_buffer = hold_buffer(std::move(cost_table_info));
+    }
+
+    CostTable(const CostTable&) = delete;
+    CostTable& operator=(const CostTable&) = delete;
+
+    int size() const
+    {
+        return m_size;
+    }
+
+    double get(int str1_idx, int str2_idx) const
+    {
+        return m_table[(size_t)str1_idx * m_size + str2_idx];
+    }
+};
+
+class CharTable
+{
+    // query text -> codes, the way the corpus was encoded: fold characters (e.g. long vowels to short ones),
+    // strip surrounding whitespace like str.strip(), then look every character up, unknown ones get the code of
+    // unknown_char (the space bar)
+
+private:
+    std::unordered_map<char32_t, Code> m_codes;
+    std::unordered_map<char32_t, char32_t> m_folding;
+    Code m_unknown_code{};
+    std::vector<char32_t> m_dense_folding; // m_dense_folding[c] = fold(c) for c < DENSE_LIMIT
+    std::vector<int32_t> m_dense_codes; // m_dense_codes[c] = lookup(c) for c < DENSE_LIMIT
+
+    static constexpr char32_t DENSE_LIMIT = 0x800; // every 1 and 2 byte UTF-8 character, Latin with macrons included
+    static constexpr char32_t INVALID = 0xFFFD;
+
+    static char32_t single_char(const std::string& text, const char* name)
+    {
+        size_t position = 0;
+        char32_t c = decode_utf8(text, position);
+        if (text.empty() || position != text.size())
+        {
+            throw std::invalid_argument(std::string(name) + ": expected single characters, got '" + text + "'");
+        }
+        return c;
+    }
+
+    static bool is_space(char32_t c)
+    {
+        // the characters str.strip() removes
+        return (c >= 0x09 && c <= 0x0D) || (c >= 0x1C && c <= 0x20) || c == 0x85 || c == 0xA0 || c == 0x1680
+            || (c >= 0x2000 && c <= 0x200A) || c == 0x2028 || c == 0x2029 || c == 0x202F || c == 0x205F || c == 0x3000;
+    }
+
+    static char32_t decode_utf8(std::string_view text, size_t& position)
+    {
+        // the character starting at position, which then moves past it, malformed bytes decode to INVALID one by one
+        auto byte = [&](size_t i) { return (unsigned char)text[i]; };
+        unsigned char lead = byte(position);
+        int length = lead < 0x80 ? 1 : (lead >> 5) == 0x6 ? 2 : (lead >> 4) == 0xE ? 3 : (lead >> 3) == 0x1E ? 4 : 0;
+        if (length == 0 || position + length > text.size())
+        {
+            ++position;
+            return INVALID;
+        }
+        char32_t c = length == 1 ? lead : lead & (0x7F >> length);
+        for (int i = 1; i < length; ++i)
+        {
+            if ((byte(position + i) & 0xC0) != 0x80)
+            {
+                ++position;
+                return INVALID;
+            }
+            c = (c << 6) | (byte(position + i) & 0x3F);
+        }
+        position += length;
+        return c;
+    }
+
+    static void encode_utf8(char32_t c, std::string& text)
+    {
+        if (c < 0x80)
+        {
+            text += (char)c;
+        }
+        else if (c < 0x800)
+        {
+            text += (char)(0xC0 | (c >> 6));
+            text += (char)(0x80 | (c & 0x3F));
+        }
+        else if (c < 0x10000)
+        {
+            text += (char)(0xE0 | (c >> 12));
+            text += (char)(0x80 | ((c >> 6) & 0x3F));
+            text += (char)(0x80 | (c & 0x3F));
+        }
+        else
+        {
+            text += (char)(0xF0 | (c >> 18));
+            text += (char)(0x80 | ((c >> 12) & 0x3F));
+            text += (char)(0x80 | ((c >> 6) & 0x3F));
+            text += (char)(0x80 | (c & 0x3F));
+        }
+    }
+
+    char32_t fold(char32_t c) const
+    {
+        if (c < DENSE_LIMIT && !m_dense_folding.empty())
+        {
+            return m_dense_folding[c];
+        }
+        auto it = m_folding.find(c);
+        return it == m_folding.end() ? c : it->second;
+    }
+
+    int lookup(char32_t c) const
+    {
+        // the code of an already folded character
+        if (c < DENSE_LIMIT && !m_dense_codes.empty())
+        {
+            return m_dense_codes[c];
+        }
+        auto it = m_codes.find(c);
+        return it == m_codes.end() ? (int)m_unknown_code : (int)it->second;
+    }
+
+    template <typename F>
+    void for_each_folded(std::string_view text, F f) const
+    {
+        // the folded characters of text without surrounding whitespace
+        std::vector<char32_t> folded;
+        folded.reserve(text.size());
+        for (size_t position = 0; position < text.size();)
+        {
+            folded.push_back(fold(decode_utf8(text, position)));
+        }
+        size_t first = 0;
+        size_t last = folded.size();
+        while (first < last && is_space(folded[first]))
+        {
+            ++first;
+        }
+        while (last > first && is_space(folded[last - 1]))
+        {
+            --last;
+        }
+        for (size_t i = first; i < last; ++i)
+        {
+            f(folded[i]);
+        }
+    }
+
+public:
+    CharTable(
+        const std::vector<std::string>& chars, /* chars[code] = the character encoded as code */
+        const std::map<std::string, std::string>& folding = {}, /* character -> the character it's searched as */
+        const std::string& unknown_char = " ")
+    {
+        for (size_t code = 0; code < chars.size(); ++code)
+        {
+            if (code > std::numeric_limits<Code>::max())
+            {
+                throw std::invalid_argument("chars: more characters than codes");
+            }
+            m_codes[single_char(chars[code], "chars")] = (Code)code;
+        }
+        for (const auto& [from, to] : folding)
+        {
+            m_folding[single_char(from, "folding")] = single_char(to, "folding");
+        }
+        auto unknown = m_codes.find(single_char(unknown_char, "unknown_char"));
+        if (unknown == m_codes.end())
+        {
+            throw std::invalid_argument("unknown_char: not one of chars");
+        }
+        m_unknown_code = unknown->second;
+
+        std::vector<char32_t> dense_folding(DENSE_LIMIT);
+        std::vector<int32_t> dense_codes(DENSE_LIMIT);
+        for (char32_t c = 0; c < DENSE_LIMIT; ++c)
+        {
+            dense_folding[c] = fold(c);
+            dense_codes[c] = lookup(c);
+        }
+        m_dense_folding = std::move(dense_folding);
+        m_dense_codes = std::move(dense_codes);
+    }
+
+    CharTable(const CharTable&) = delete;
+    CharTable& operator=(const CharTable&) = delete;
+
+    std::vector<int> encode(std::string_view text) const
+    {
+        std::vector<int> codes;
+        codes.reserve(text.size());
+        for_each_folded(text, [&](char32_t c) { codes.push_back(lookup(c)); });
+        return codes;
+    }
+
+    std::string normalize(std::string_view text) const
+    {
+        // the folded and stripped text that encode() looks up, e.g. to key a cache
+        std::string normalized;
+        normalized.reserve(text.size());
+        for_each_folded(text, [&](char32_t c) { encode_utf8(c, normalized); });
+        return normalized;
+    }
+
+    int size() const
+    {
+        return (int)m_codes.size();
+    }
+};
+
+struct CostProfile
+{
+    // one named set of edit costs, an engine serves any number of them over the same corpus
+    std::shared_ptr<const CostTable> table;
+    unsigned long long id{ 0 }; // tells SearchSessions apart from other profiles' sessions
+    bool is_key_cost{};
+    double replace_cost{}; // if is_key_cost, then this value is used when a key is out of the table
+    double insert_cost{};
+    double append_cost{};
+    double delete_cost{};
+    double transpose_cost{};
+    double min_edit_cost{}; // the cheapest edit other than an append, see prefix_search()
+};
+
+class CancelToken
+{
+    // cancel() from any thread abandons the searches the token was passed to: the threads stop at the next chunk
+    // and the search raises SearchCancelled instead of returning partial results
+
+private:
+    std::atomic<bool> m_cancelled{ false };
+
+public:
+    void cancel()
+    {
+        m_cancelled.store(true, std::memory_order_relaxed);
+    }
+
+    bool is_cancelled() const
+    {
+        return m_cancelled.load(std::memory_order_relaxed);
+    }
+};
+
+class SearchCancelled : public std::runtime_error
+{
+public:
+    SearchCancelled() : std::runtime_error("the search was cancelled") {}
+};
+
+class SearchSession
+{
+    // the previous query and results of one as-you-type user, so that the next keystroke can skip
+    // the scan (same query) or start from a tight threshold (one character added or removed at the end)
+
+private:
+    friend class WeightDamLeven;
+    std::mutex m_mutex;
+    unsigned long long m_engine_id{ 0 }; // results are only reused with the engine that produced them
+    unsigned long long m_corpus_id{ 0 }; // and the corpus version they were found in
+    unsigned long long m_cost_profile_id{ 0 }; // and the cost profile they were scored with
+    int m_num_results{ 0 };
+    std::vector<int> m_target_word_int;
+    std::vector<WordScore> m_results;
+    long long m_repeat_count{ 0 };
+    long long m_incremental_count{ 0 };
+    long long m_full_count{ 0 };
+
+public:
+    void reset()
+    {
+        std::lock_guard<std::mutex> lock(m_mutex);
+        m_engine_id = 0;
+        m_corpus_id = 0;
+        m_cost_profile_id = 0;
+        m_num_results = 0;
+        m_target_word_int.clear();
+        m_results.clear();
+    }
+
+    std::tuple<long long, long long, long long> get_stats()
+    {
+        std::lock_guard<std::mutex> lock(m_mutex);
+        return { m_repeat_count, m_incremental_count, m_full_count };
+    }
+};
+
+
+// a search target: the encoded ints, or the text, which the engine's CharTable encodes
+using Target = std::variant<std::vector<int>, std::string>;
+
+class WeightDamLeven
+{
+
+private:
+    std::shared_ptr<Corpus> m_corpus;
+
+    // name -> cost profile, a search takes its own reference so the profile can be replaced meanwhile
+    std::map<std::string, std::shared_ptr<const CostProfile>> m_cost_profiles;
+    mutable std::mutex m_cost_profiles_mutex;
+
+    std::shared_ptr<const CharTable> m_char_table; // encodes str targets, see set_char_table()
+    mutable std::mutex m_char_table_mutex;
+
+    std::unique_ptr<WorkerPool> m_pool;
+    unsigned long long m_engine_id; // tells SearchSessions apart from other engines' sessions
+
+    // get_search_stats()
+    std::atomic<long long> m_full_searches{ 0 };
+    std::atomic<long long> m_prefix_answers{ 0 };
+    std::atomic<long long> m_deletion_answers{ 0 };
+    std::atomic<long long> m_words_scored{ 0 };
+    std::atomic<long long> m_rows_computed{ 0 };
+
+    std::atomic<SearchMode> m_search_mode{ SearchMode::SCAN };
+    std::atomic<KernelMode> m_kernel_mode{ KernelMode::SCALAR };
+
+    static constexpr int SCAN_CHUNK_SIZE = 256; // words per work item handed out by the shared cursor
+    static constexpr double LOWER_BOUND_SLACK = 1e-9;
+    static constexpr int SIMD_BYTES = 32; // one AVX2 register, the compiler splits it in two without AVX2
+    static constexpr double FIXED_POINT_SCALE = 65536.0;
+    static constexpr int FIRST_PASS_WORDS = 256; // at most this many words are scored to seed the threshold
+    static constexpr int DELETION_CANDIDATE_FRACTION = 64; // more candidates than this share of the corpus aren't worth rescoring one by one
+
+    static void atomic_min(std::atomic<double>& target, double value)
+    {
+        double current = target.load(std::memory_order_relaxed);
+        while (value < current && !target.compare_exchange_weak(current, value, std::memory_order_relaxed))
+        {
+        }
+    }
+
+    class CountScope
+    {
+        // adds what the kernels of this thread counted while it was alive to the engine's totals
+
+    private:
+        WeightDamLeven& m_engine;
+        SearchCounters m_start;
+
+    public:
+        explicit CountScope(WeightDamLeven& engine) : m_engine(engine), m_start(search_counters) {}
+
+        ~CountScope()
+        {
+            m_engine.m_words_scored.fetch_add(search_counters.words_scored - m_start.words_scored, std::memory_order_relaxed);
+            m_engine.m_rows_computed.fetch_add(search_counters.rows_computed - m_start.rows_computed, std::memory_order_relaxed);
+        }
+    };
+
+    static bool is_cancelled(const CancelToken* cancel)
+    {
+        return cancel != nullptr && cancel->is_cancelled();
+    }
+
+    static void throw_if_cancelled(const CancelToken* cancel)
+    {
+        if (is_cancelled(cancel))
+        {
+            throw SearchCancelled();
+        }
+    }
+
+    static unsigned long long next_engine_id()
+    {
+        static std::atomic<unsigned long long> engine_counter{ 0 };
+        return ++engine_counter;
+    }
+
+    static unsigned long long next_cost_profile_id()
+    {
+        static std::atomic<unsigned long long> cost_profile_counter{ 0 };
+        return ++cost_profile_counter;
+    }
+
+    void init_pool(int thread_count)
+    {
+        m_engine_id = next_engine_id();
+        if (thread_count <= 0)
+        {
+            thread_count = (int)std::thread::hardware_concurrency();
+        }
+        m_pool = std::make_unique<WorkerPool>(thread_count);
+    }
+
+    std::shared_ptr<const CorpusVersion> current_corpus() const
+    {
+        return m_corpus->current();
+    }
+
+    std::shared_ptr<const CostProfile> get_cost_profile(const std::string& name) const
+    {
+        std::lock_guard<std::mutex> lock(m_cost_profiles_mutex);
+        auto it = m_cost_profiles.find(name);
+        if (it == m_cost_profiles.end())
+        {
+            throw py::key_error("no cost profile named '" + name + "'");
+        }
+        return it->second;
+    }
+
+    std::vector<int> encode_target(const Target& target) const
+    {
+        if (const auto* target_word_int = std::get_if<std::vector<int>>(&target))
+        {
+            return *target_word_int;
+        }
+        return get_char_table()->encode(std::get<std::string>(target));
+    }
+
+    std::vector<std::vector<int>> encode_targets(const std::vector<Target>& targets) const
+    {
+        std::vector<std::vector<int>> target_words_int;
+        target_words_int.reserve(targets.size());
+        for (const Target& target : targets)
+        {
+            target_words_int.push_back(encode_target(target));
+        }
+        return target_words_int;
+    }
+
+public:
+    static constexpr const char* DEFAULT_COST_PROFILE = "default";
+
+    WeightDamLeven(
+        std::shared_ptr<Corpus> corpus,
+        int thread_count = 0) /* 0 means std::thread::hardware_concurrency() */
+        : m_corpus(std::move(corpus))
+    {
+        // cost profiles are added with set_cost_profile()
+        if (!m_corpus)
+        {
+            throw std::invalid_argument("corpus: expected a Corpus");
+        }
+        init_pool(thread_count);
+    }
+
+    WeightDamLeven(
+        std::vector<std::vector<int>>& keys_encoded,
+        std::vector<std::vector<double>>& cost_matrix,
+        bool is_key_cost,
+        double replace_cost, /* if is_key_cost, then this value is used when a key is out of cost_matrix */
+        double insert_cost,
+        double append_cost,
+        double delete_cost,
+        double transpose_cost,
+        int thread_count = 0, /* 0 means std::thread::hardware_concurrency() */
+        const std::vector<std::string>& words = {}) /* optional original words, in the same order as keys_encoded */
+        : WeightDamLeven(std::make_shared<Corpus>(keys_encoded, words), thread_count)
+    {
+        // a corpus and a "default" cost profile of its own
+        keys_encoded.clear();
+        set_cost_profile(DEFAULT_COST_PROFILE, std::make_shared<CostTable>(cost_matrix),
+            is_key_cost, replace_cost, insert_cost, append_cost, delete_cost, transpose_cost);
+    }
+
+    WeightDamLeven(
+        py::buffer keys_codes, /* 1-D uint16: every word's codes back to back */
+        py::buffer keys_offsets, /* 1-D int64 of length word count + 1: word i is keys_codes[keys_offsets[i]:keys_offsets[i + 1]] */
+        py::buffer cost_table, /* 2-D float64, square */
+        bool is_key_cost,
+        double replace_cost,
+        double insert_cost,
+        double append_cost,
+        double delete_cost,
+        double transpose_cost,
+        int thread_count = 0,
+        const std::vector<std::string>& words = {},
+        std::optional<py::buffer> words_utf8 = std::nullopt) /* 1-D uint8: the same words as UTF-8, each followed by '\n' */
+        : WeightDamLeven(std::make_shared<Corpus>(keys_codes, keys_offsets, words, words_utf8), thread_count)
+    {
+        set_cost_profile(DEFAULT_COST_PROFILE, std::make_shared<CostTable>(cost_table),
+            is_key_cost, replace_cost, insert_cost, append_cost, delete_cost, transpose_cost);
+    }
+
+    void set_cost_profile(
+        const std::string& name,
+        std::shared_ptr<CostTable> cost_table,
+        bool is_key_cost,
+        double replace_cost,
+        double insert_cost,
+        double append_cost,
+        double delete_cost,
+        double transpose_cost)
+    {
+        // adds or replaces a profile, searches already running keep the one they started with
+        if (!cost_table)
+        {
+            throw std::invalid_argument("cost_table: expected a CostTable");
+        }
+        auto profile = std::make_shared<CostProfile>();
+        profile->table = std::move(cost_table);
+        profile->id = next_cost_profile_id();
+        profile->is_key_cost = is_key_cost;
+        profile->replace_cost = replace_cost;
+        profile->insert_cost = insert_cost;
+        profile->append_cost = append_cost;
+        profile->delete_cost = delete_cost;
+        profile->transpose_cost = transpose_cost;
+        profile->min_edit_cost = std::min({ replace_cost, insert_cost, delete_cost, transpose_cost });
+        if (is_key_cost)
+        {
+            const CostTable& table = *profile->table;
+            for (int str1_idx = 0; str1_idx < table.size(); ++str1_idx)
+            {
+                for (int str2_idx = 0; str2_idx < table.size(); ++str2_idx)
+                {
+                    if (str1_idx != str2_idx)
+                    {
+                        profile->min_edit_cost = std::min(profile->min_edit_cost, table.get(str1_idx, str2_idx));
+                    }
+                }
+            }
+        }
+        std::lock_guard<std::mutex> lock(m_cost_profiles_mutex);
+        m_cost_profiles[name] = std::move(profile);
+    }
+
+    std::vector<std::string> get_cost_profile_names() const
+    {
+        std::lock_guard<std::mutex> lock(m_cost_profiles_mutex);
+        std::vector<std::string> names;
+        for (const auto& entry : m_cost_profiles)
+        {
+            names.push_back(entry.first);
+        }
+        return names;
+    }
+
+    std::shared_ptr<Corpus> get_corpus() const
+    {
+        return m_corpus;
+    }
+
+    void set_char_table(std::shared_ptr<const CharTable> char_table)
+    {
+        // searches already running keep the table they started with
+        if (!char_table)
+        {
+            throw std::invalid_argument("char_table: expected a CharTable");
+        }
+        std::lock_guard<std::mutex> lock(m_char_table_mutex);
+        m_char_table = std::move(char_table);
+    }
+
+    std::shared_ptr<const CharTable> get_char_table() const
+    {
+        std::lock_guard<std::mutex> lock(m_char_table_mutex);
+        if (!m_char_table)
+        {
+            throw std::logic_error("no char table was set, see set_char_table()");
+        }
+        return m_char_table;
+    }
+
+    std::vector<int> encode(const std::string& text) const
+    {
+        return get_char_table()->encode(text);
+    }
+
+    std::tuple<int, int> update_words(
+        const std::vector<std::vector<int>>& keys_encoded,
+        const std::vector<std::string>& words,
+        const std::vector<std::string>& removed_words)
+    {
+        return m_corpus->update_words(keys_encoded, words, removed_words);
+    }
+
+    int add_words(
+        const std::vector<std::vector<int>>& keys_encoded,
+        const std::vector<std::string>& words)
+    {
+        return m_corpus->add_words(keys_encoded, words);
+    }
+
+    int remove_words(const std::vector<std::string>& words)
+    {
+        return m_corpus->remove_words(words);
+    }
+
+    void compact()
+    {
+        m_corpus->compact();
+    }
+
+    unsigned long long get_corpus_version() const
+    {
+        return m_corpus->get_version();
+    }
+
+    int get_word_count() const
+    {
+        return m_corpus->get_word_count();
+    }
+
+    std::string get_word(int index) const
+    {
+        return m_corpus->get_word(index);
+    }
+
+    int get_thread_count() const
+    {
+        return m_pool->size();
+    }
+
+    std::shared_ptr<const DeletionIndex> build_deletion_index(
+        int max_radius,
+        int64_t max_bytes,
+        double fold_cost, /* codes whose replace cost in the profile's table is below this are indexed as one */
+        const std::string& profile)
+    {
+        // the fold classes are the connected components of the cheap replacements, in both directions
+        const CostTable& table = *get_cost_profile(profile)->table;
+        std::vector<Code> fold(std::min(table.size(), (int)std::numeric_limits<Code>::max() + 1));
+        for (int code = 0; code < (int)fold.size(); ++code)
+        {
+            fold[code] = (Code)code;
+        }
+        std::function<int(int)> find = [&](int code) { return fold[code] == code ? code : fold[code] = (Code)find(fold[code]); };
+        for (int str1_idx = 0; str1_idx < (int)fold.size(); ++str1_idx)
+        {
+            for (int str2_idx = 0; str2_idx < (int)fold.size(); ++str2_idx)
+            {
+                if (table.get(str1_idx, str2_idx) < fold_cost)
+                {
+                    int root1 = find(str1_idx);
+                    int root2 = find(str2_idx);
+                    fold[std::max(root1, root2)] = (Code)std::min(root1, root2);
+                }
+            }
+        }
+        for (int code = 0; code < (int)fold.size(); ++code)
+        {
+            fold[code] = (Code)find(code);
+        }
+        return m_corpus->build_deletion_index(max_radius, max_bytes, fold);
+    }
+
+    void set_deletion_index(std::shared_ptr<const DeletionIndex> deletion_index)
+    {
+        m_corpus->set_deletion_index(std::move(deletion_index));
+    }
+
+    std::shared_ptr<const DeletionIndex> get_deletion_index() const
+    {
+        return m_corpus->get_deletion_index();
+    }
+
+    std::tuple<long long, long long, long long, long long, long long> get_search_stats() const
+    {
+        return {
+            m_full_searches.load(std::memory_order_relaxed),
+            m_prefix_answers.load(std::memory_order_relaxed),
+            m_deletion_answers.load(std::memory_order_relaxed),
+            m_words_scored.load(std::memory_order_relaxed),
+            m_rows_computed.load(std::memory_order_relaxed) };
+    }
+
+    void reset_search_stats()
+    {
+        m_full_searches.store(0);
+        m_prefix_answers.store(0);
+        m_deletion_answers.store(0);
+        m_words_scored.store(0);
+        m_rows_computed.store(0);
+    }
+
+    double length_lower_bound(const CostProfile& costs, int target_len, int word_len) const
+    {
+        // the length difference alone forces this many inserts/appends or deletes, and no other edit is negative,
+        // shaved by a relative LOWER_BOUND_SLACK because n * cost can round above n sequentially added costs
+        if (word_len > target_len)
+        {
+            return (word_len - target_len) * std::min(costs.insert_cost, costs.append_cost) * (1.0 - LOWER_BOUND_SLACK);
+        }
+        return (target_len - word_len) * costs.delete_cost * (1.0 - LOWER_BOUND_SLACK);
+    }
+
+    std::vector<int> length_bucket_order(const CorpusVersion& corpus, const CostProfile& costs, int target_len) const
+    {
+        // nonempty lengths, cheapest lower bound (nearest length) first, so the heap threshold tightens early
+        const auto& length_buckets = corpus.length_buckets();
+        std::vector<int> order;
+        for (int len = 0; len < (int)length_buckets.size(); ++len)
+        {
+            if (!length_buckets[len].empty())
+            {
+                order.push_back(len);
+            }
+        }
+        std::stable_sort(order.begin(), order.end(), [&](int a, int b)
+        {
+            double lb_a = length_lower_bound(costs, target_len, a);
+            double lb_b = length_lower_bound(costs, target_len, b);
+            if (lb_a != lb_b)
+            {
+                return lb_a < lb_b;
+            }
+            return std::abs(a - target_len) < std::abs(b - target_len);
+        });
+        return order;
+    }
+
+    double replace_cost(const CostProfile& costs, int str1_idx, int str2_idx) const
+    {
+        if (str1_idx == str2_idx)
+        {
+            return 0.0;
+        }
+        const CostTable& table = *costs.table;
+        if (costs.is_key_cost && str1_idx >= 0 && str1_idx < table.size() && str2_idx < table.size())
+        {
+            return table.get(str1_idx, str2_idx);
+        }
+        return costs.replace_cost;
+    }
+
+    double key_weighted_damerau_levenshtein(
+        const CostProfile& costs,
+        const std::vector<int>& str1,
+        const Code* str2,
+        const int len2,
+        const double score_to_beat)
+    {
+        int len1 = (int)str1.size();
+
+        // 3-row dynamic programming - only rows i, i-1, i-2 are needed
+        // thread_local buffers - reused across calls, eliminates heap allocation in steady state
+        thread_local std::vector<double> row0, row1, row2;
+        std::vector<double>* rows[3] = { &row0, &row1, &row2 };
+        for (auto* r : rows)
+        {
+            if ((int)r->size() < len2 + 1)
+            {
+                r->resize(len2 + 1);
+            }
+        }
+
+        // p1 = row i-1 index, p2 = row i-2 index, cur = row being written
+        int cur = 2;
+        int p1 = 0;
+        int p2 = 1;
+
+        // initialize row 0 into rows[p1]
+        (*rows[p1])[0] = 0.0;
+        for (int j = 1; j <= len2; ++j)
+        {
+            double insert_append_cost = j > len1 ? costs.append_cost : costs.insert_cost;
+            (*rows[p1])[j] = (*rows[p1])[j - 1] + insert_append_cost;
+        }
+
+        double best_score_prev_row = 0.0;
+        for (int i = 1; i <= len1; ++i)
+        {
+            // reset column 0 so that (*rows[cur])[j - 1] works when j == 1
+            (*rows[cur])[0] = i * costs.delete_cost;
+
+            double best_score_this_row = (*rows[cur])[0];
+
+            for (int j = 1; j <= len2; ++j)
+            {
+                int str1_idx = str1[i - 1];
+                int str2_idx = str2[j - 1];
+
+                double replace_cost_curr = replace_cost(costs, str1_idx, str2_idx);
+
+                double insert_append_cost = j > len1 ? costs.append_cost : costs.insert_cost;
+                (*rows[cur])[j] = std::min(
+                    (*rows[p1])[j] + costs.delete_cost, // delete
+                    (*rows[cur])[j - 1] + insert_append_cost); // insert
+                (*rows[cur])[j] = std::min(
+                    (*rows[cur])[j],
+                    (*rows[p1])[j - 1] + replace_cost_curr); // replace
+
+                if (i > 1 && j > 1 && str1_idx == str2[j - 2] && str1[i - 2] == str2_idx)
+                {
+                    (*rows[cur])[j] = std::min(
+                        (*rows[cur])[j],
+                        (*rows[p2])[j - 2] + costs.transpose_cost); // transpose
+                }
+
+                best_score_this_row = std::min(best_score_this_row, (*rows[cur])[j]);
+            }
+
+            // a transpose jumps from row i - 2 to row i, so every path touches row i or row i - 1
+            // ties are kept: an equal score can still win on the lexical tie-break
+            if (score_to_beat >= 0 && std::min(best_score_this_row, best_score_prev_row) > score_to_beat)
+            {
+                ++search_counters.words_scored;
+                search_counters.rows_computed += i;
+                return score_to_beat + 1.0;
+            }
+            best_score_prev_row = best_score_this_row;
+
+            // recall p1 = row i-1 index, p2 = row i-2 index, cur = row being written
+            // rotate: p2 -> p1; p1 -> cur; cur (recycled) -> p2 (oldest)
+            // so p2 and p1 move up one index, and cur just uses the old p2 space
+            int tmp = p2;
+            p2 = p1;
+            p1 = cur;
+            cur = tmp;
+        }
+
+        ++search_counters.words_scored;
+        search_counters.rows_computed += len1;
+        return (*rows[p1])[len2]; // p1 holds the last written row after the final rotate
+    }
+
+    template <typename T>
+    void init_lane_profile(const CorpusVersion& corpus, const CostProfile& costs, LaneProfile<T>& profile, const std::vector<int>& target_word_int, double scale, double error_per_edit) const
+    {
+        auto convert = [&](double cost) -> T
+        {
+            if constexpr (std::is_integral_v<T>)
+            {
+                return (T)std::llround(cost * scale);
+            }
+            else
+            {
+                return (T)cost;
+            }
+        };
+
+        int len1 = (int)target_word_int.size();
+        int code_limit = corpus.code_limit();
+        profile.code_limit = code_limit;
+        profile.replace_costs.resize((size_t)len1 * code_limit);
+        for (int i = 0; i < len1; ++i)
+        {
+            for (int code = 0; code < code_limit; ++code)
+            {
+                profile.replace_costs[(size_t)i * code_limit + code] = convert(replace_cost(costs, target_word_int[i], code));
+            }
+        }
+        profile.insert_cost = convert(costs.insert_cost);
+        profile.append_cost = convert(costs.append_cost);
+        profile.delete_cost = convert(costs.delete_cost);
+        profile.transpose_cost = convert(costs.transpose_cost);
+        profile.scale = scale;
+        profile.error_per_edit = error_per_edit;
+        profile.max_cost = std::max({ costs.delete_cost, costs.insert_cost, costs.append_cost, costs.transpose_cost, costs.replace_cost });
+        for (int i = 0; i < len1; ++i)
+        {
+            for (int code = 0; code < code_limit; ++code)
+            {
+                profile.max_cost = std::max(profile.max_cost, replace_cost(costs, target_word_int[i], code));
+            }
+        }
+    }
+
+    QueryProfile make_query_profile(const CorpusVersion& corpus, const CostProfile& costs, const std::vector<int>& target_word_int) const
+    {
+        QueryProfile profile;
+        profile.target = &target_word_int;
+        profile.mode = m_kernel_mode.load();
+        switch (profile.mode)
+        {
+        case KernelMode::SCALAR:
+            break;
+        case KernelMode::SIMD:
+            init_lane_profile(corpus, costs, profile.lanes_f64, target_word_int, 1.0, 0.0);
+            break;
+        case KernelMode::SIMD_FLOAT32:
+            // rounding each cost and each sum to float32
+            init_lane_profile(corpus, costs, profile.lanes_f32, target_word_int, 1.0, 2.0 * std::numeric_limits<float>::epsilon());
+            break;
+        case KernelMode::SIMD_FIXED_POINT:
+            // rounding each cost to the nearest 1 / FIXED_POINT_SCALE, sums are exact
+            init_lane_profile(corpus, costs, profile.lanes_fixed, target_word_int, FIXED_POINT_SCALE, 0.5 / FIXED_POINT_SCALE);
+            break;
+        }
+        return profile;
+    }
+
+    template <typename T>
+    double lane_tolerance(const CostProfile& costs, const LaneProfile<T>& profile, int len1, int len2) const
+    {
+        // bound on |lane score - key_weighted_damerau_levenshtein score| for words of length len2:
+        // a path has at most len1 + len2 edits, and for float32 no relevant path sum exceeds deleting
+        // the target and inserting the word
+        double edits = len1 + len2 + 1.0;
+        if constexpr (std::is_floating_point_v<T>)
+        {
+            double max_score = len1 * costs.delete_cost + len2 * std::max(costs.insert_cost, costs.append_cost) + costs.replace_cost;
+            return edits * profile.error_per_edit * max_score;
+        }
+        else
+        {
+            return edits * profile.error_per_edit;
+        }
+    }
+
+    template <typename T>
+    bool lane_fits(const LaneProfile<T>& profile, int len1, int len2) const
+    {
+        // int32 sums of the fixed point costs must not overflow
+        if constexpr (std::is_integral_v<T>)
+        {
+            return (len1 + len2 + 1.0) * (profile.max_cost + 1.0) * profile.scale < std::numeric_limits<T>::max() / 2;
+        }
+        else
+        {
+            return true;
+        }
+    }
+
+    template <typename T>
+    void lane_weighted_damerau_levenshtein(
+        const CorpusVersion& corpus,
+        const LaneProfile<T>& profile,
+        const std::vector<int>& str1,
+        const int* indices, /* count <= SIMD_BYTES / sizeof(T) words, all of length len2 */
+        const int count,
+        const int len2,
+        const double score_to_beat, /* already widened by the tolerance, negative for no early abandon */
+        double* scores)
+    {
+        // key_weighted_damerau_levenshtein for several words at once: lane l of every row holds word indices[l],
+        // and the loops over lanes have no branches so that the compiler turns them into SIMD instructions
+        constexpr int LANES = SIMD_BYTES / (int)sizeof(T);
+        int len1 = (int)str1.size();
+        int width = (len2 + 1) * LANES;
+
+        thread_local std::vector<T> rows;
+        thread_local std::vector<int32_t> codes;
+        rows.resize((size_t)3 * width);
+        codes.resize((size_t)std::max(len2, 1) * LANES);
+        for (int l = 0; l < LANES; ++l)
+        {
+            // spare lanes repeat the first word
+            const Code* word = corpus.word_codes(indices[l < count ? l : 0]);
+            for (int j = 0; j < len2; ++j)
+            {
+                codes[(size_t)j * LANES + l] = word[j];
+            }
+        }
+
+        T* row_p2 = rows.data();
+        T* row_p1 = row_p2 + width;
+        T* row_cur = row_p1 + width;
+        for (int l = 0; l < LANES; ++l)
+        {
+            row_p1[l] = 0;
+        }
+        for (int j = 1; j <= len2; ++j)
+        {
+            T insert_append_cost = j > len1 ? profile.append_cost : profile.insert_cost;
+            for (int l = 0; l < LANES; ++l)
+            {
+                row_p1[j * LANES + l] = row_p1[(j - 1) * LANES + l] + insert_append_cost;
+            }
+        }
+
+        alignas(SIMD_BYTES) T best_score_prev_row[LANES] = {};
+        alignas(SIMD_BYTES) T best_score_this_row[LANES];
+        for (int i = 1; i <= len1; ++i)
+        {
+            const T* replace_costs = profile.replace_costs.data() + (size_t)(i - 1) * profile.code_limit;
+            const int32_t str1_idx = str1[i - 1];
+            const int32_t str1_prev_idx = i > 1 ? str1[i - 2] : -1; // -1 never equals a code, no transpose in row 1
+            T column_zero = (T)i * profile.delete_cost;
+            for (int l = 0; l < LANES; ++l)
+            {
+                row_cur[l] = column_zero;
+                best_score_this_row[l] = column_zero;
+            }
+
+            for (int j = 1; j <= len2; ++j)
+            {
+                T insert_append_cost = j > len1 ? profile.append_cost : profile.insert_cost;
+                const int32_t* str2_idx = codes.data() + (size_t)(j - 1) * LANES;
+                const int32_t* str2_prev_idx = j > 1 ? str2_idx - LANES : str2_idx;
+                bool can_transpose = j > 1;
+                for (int l = 0; l < LANES; ++l)
+                {
+                    T score = std::min(
+                        row_p1[j * LANES + l] + profile.delete_cost, // delete
+                        row_cur[(j - 1) * LANES + l] + insert_append_cost); // insert
+                    score = std::min(
+                        score,
+                        row_p1[(j - 1) * LANES + l] + replace_costs[str2_idx[l]]); // replace
+                    T transpose = row_p2[(can_transpose ? j - 2 : 0) * LANES + l] + profile.transpose_cost;
+                    bool is_transpose = can_transpose & (str1_idx == str2_prev_idx[l]) & (str1_prev_idx == str2_idx[l]);
+                    score = is_transpose ? std::min(score, transpose) : score; // transpose
+                    row_cur[j * LANES + l] = score;
+                    best_score_this_row[l] = std::min(best_score_this_row[l], score);
+                }
+            }
+
+            // abandon the group only when no lane can still beat score_to_beat
+            if (score_to_beat >= 0)
+            {
+                bool all_abandoned = true;
+                for (int l = 0; l < count; ++l)
+                {
+                    all_abandoned &= (double)std::min(best_score_this_row[l], best_score_prev_row[l]) / profile.scale > score_to_beat;
+                }
+                if (all_abandoned)
+                {
+                    for (int l = 0; l < count; ++l)
+                    {
+                        scores[l] = std::numeric_limits<double>::infinity();
+                    }
+                    search_counters.words_scored += count;
+                    search_counters.rows_computed += (long long)i * count;
+                    return;
+                }
+            }
+            std::copy(best_score_this_row, best_score_this_row + LANES, best_score_prev_row);
+
+            T* tmp = row_p2;
+            row_p2 = row_p1;
+            row_p1 = row_cur;
+            row_cur = tmp;
+        }
+
+        for (int l = 0; l < count; ++l)
+        {
+            scores[l] = (double)row_p1[len2 * LANES + l] / profile.scale;
+        }
+        search_counters.words_scored += count;
+        search_counters.rows_computed += (long long)len1 * count;
+    }
+
+    void set_search_mode(SearchMode search_mode)
+    {
+        if (search_mode == SearchMode::TRIE)
+        {
+            m_corpus->keep_trie();
+        }
+        m_search_mode.store(search_mode);
+    }
+
+    SearchMode get_search_mode() const
+    {
+        return m_search_mode.load();
+    }
+
+    void set_kernel_mode(KernelMode kernel_mode)
+    {
+        m_kernel_mode.store(kernel_mode);
+    }
+
+    KernelMode get_kernel_mode() const
+    {
+        return m_kernel_mode.load();
+    }
+
+    double subtree_length_lower_bound(const CostProfile& costs, int target_len, const TrieNode& node) const
+    {
+        if (target_len < node.min_len)
+        {
+            return length_lower_bound(costs, target_len, node.min_len);
+        }
+        if (target_len > node.max_len)
+        {
+            return length_lower_bound(costs, target_len, node.max_len);
+        }
+        return 0.0;
+    }
+
+    void compute_trie_row(
+        const CostProfile& costs,
+        const std::vector<int>& target_word_int,
+        const TrieNode& node,
+        std::vector<double>& rows,
+        std::vector<double>& row_min,
+        std::vector<int>& path)
+    {
+        // rows[depth * (len1 + 1) + i] = distance between target[:i] and the node's prefix (length depth),
+        // the same cells key_weighted_damerau_levenshtein computes, walked column by column
+        int len1 = (int)target_word_int.size();
+        int width = len1 + 1;
+        int depth = node.depth;
+        int code = node.code;
+        path[depth] = code;
+
+        const double* prev = rows.data() + (size_t)(depth - 1) * width;
+        const double* prev2 = depth > 1 ? rows.data() + (size_t)(depth - 2) * width : nullptr;
+        double* cur = rows.data() + (size_t)depth * width;
+        double insert_append_cost = depth > len1 ? costs.append_cost : costs.insert_cost;
+
+        cur[0] = prev[0] + insert_append_cost;
+        double best_score_this_row = cur[0];
+        for (int i = 1; i <= len1; ++i)
+        {
+            int str1_idx = target_word_int[i - 1];
+            cur[i] = std::min(
+                cur[i - 1] + costs.delete_cost, // delete
+                prev[i] + insert_append_cost); // insert
+            cur[i] = std::min(
+                cur[i],
+                prev[i - 1] + replace_cost(costs, str1_idx, code)); // replace
+
+            if (i > 1 && depth > 1 && str1_idx == path[depth - 1] && target_word_int[i - 2] == code)
+            {
+                cur[i] = std::min(
+                    cur[i],
+                    prev2[i - 2] + costs.transpose_cost); // transpose
+            }
+
+            best_score_this_row = std::min(best_score_this_row, cur[i]);
+        }
+        row_min[depth] = best_score_this_row;
+        ++search_counters.rows_computed;
+    }
+
+    void push_word_score(
+        const CorpusVersion& corpus,
+        WordScoreHeap& heap,
+        const int num_results,
+        const int index,
+        const double score,
+        std::atomic<double>& shared_score_to_beat)
+    {
+        WordScore word_score = make_word_score(corpus, index, score);
+        if ((int)heap.size() >= num_results)
+        {
+            if (!(word_score < heap.top()))
+            {
+                return;
+            }
+            heap.pop();
+        }
+        heap.push(word_score);
+        if ((int)heap.size() >= num_results)
+        {
+            atomic_min(shared_score_to_beat, heap.top().score);
+        }
+    }
+
+    void populate_heap_trie(
+        const CorpusVersion& corpus,
+        const CostProfile& costs,
+        WordScoreHeap& heap,
+        const std::vector<int>& target_word_int,
+        const int num_results,
+        std::atomic<int>& chunk_cursor,
+        std::atomic<double>& shared_score_to_beat,
+        const CancelToken* cancel)
+    {
+        if (num_results <= 0)
+        {
+            return;
+        }
+
+        CountScope count_scope(*this);
+        const TrieIndex& trie = corpus.get_trie();
+        int len1 = (int)target_word_int.size();
+        int width = len1 + 1;
+        thread_local std::vector<double> rows, row_min;
+        thread_local std::vector<int> path, ancestors;
+        rows.resize((size_t)(trie.max_depth + 1) * width);
+        row_min.resize(trie.max_depth + 1);
+        path.resize(trie.max_depth + 1);
+        for (int i = 0; i <= len1; ++i)
+        {
+            rows[i] = i * costs.delete_cost;
+        }
+        row_min[0] = 0.0;
+
+        while (true)
+        {
+            int chunk_index = chunk_cursor.fetch_add(1, std::memory_order_relaxed);
+            if (chunk_index >= (int)trie.chunks.size() || is_cancelled(cancel))
+            {
+                break;
+            }
+
+            // rows of the chunk root's ancestors, then its own row and (if descending) the rows of its subtree
+            const TrieChunk& chunk = trie.chunks[chunk_index];
+            ancestors.clear();
+            for (int node = trie.nodes[chunk.node].parent; node > 0; node = trie.nodes[node].parent)
+            {
+                ancestors.push_back(node);
+            }
+            for (auto it = ancestors.rbegin(); it != ancestors.rend(); ++it)
+            {
+                compute_trie_row(costs, target_word_int, trie.nodes[*it], rows, row_min, path);
+            }
+
+            int node = chunk.node;
+            int end = chunk.descend ? trie.nodes[node].subtree_end : node + 1;
+            while (node < end)
+            {
+                const TrieNode& trie_node = trie.nodes[node];
+                int depth = trie_node.depth;
+                if (depth > 0)
+                {
+                    compute_trie_row(costs, target_word_int, trie_node, rows, row_min, path);
+                }
+
+                // a transpose skips at most one depth, so every word below touches this row or the one above
+                double score_to_beat = current_score_to_beat(heap, num_results, shared_score_to_beat);
+                double lower_bound = depth > 0 ? std::min(row_min[depth], row_min[depth - 1]) : 0.0;
+                lower_bound = std::max(lower_bound, subtree_length_lower_bound(costs, len1, trie_node));
+                if (lower_bound > score_to_beat)
+                {
+                    node = trie_node.subtree_end;
+                    continue;
+                }
+
+                double score = rows[(size_t)depth * width + len1];
+                if (score <= score_to_beat)
+                {
+                    for (int position = trie_node.words_begin; position < trie_node.words_end; ++position)
+                    {
+                        push_word_score(corpus, heap, num_results, trie.words[position], score, shared_score_to_beat);
+                    }
+                }
+                ++node;
+            }
+        }
+    }
+
+    std::vector<WordScore> search_trie(
+        const CorpusVersion& corpus,
+        const CostProfile& costs,
+        const std::vector<int>& target_word_int,
+        int num_results,
+        double score_to_beat,
+        const CancelToken* cancel)
+    {
+        WordScoreHeap heap;
+        std::atomic<int> chunk_cursor{ 0 };
+        std::atomic<double> shared_score_to_beat{ score_to_beat };
+        populate_heap_trie(corpus, costs, heap, target_word_int, num_results, chunk_cursor, shared_score_to_beat, cancel);
+        return sort_word_scores(heap);
+    }
+
+    std::vector<WordScore> search_trie_multithread(
+        const CorpusVersion& corpus,
+        const CostProfile& costs,
+        const std::vector<int>& target_word_int,
+        int num_results,
+        double score_to_beat,
+        const CancelToken* cancel)
+    {
+        std::vector<WordScoreHeap> heaps(m_pool->size());
+        std::atomic<int> chunk_cursor{ 0 };
+        std::atomic<double> shared_score_to_beat{ score_to_beat };
+        m_pool->run([&](int worker_index)
+        {
+            populate_heap_trie(corpus, costs, heaps[worker_index], target_word_int, num_results, chunk_cursor, shared_score_to_beat, cancel);
+        });
+        WordScoreHeap merged_heap = merge_heaps(heaps, num_results);
+        return sort_word_scores(merged_heap);
+    }
+
+    WordScore make_word_score(const CorpusVersion& corpus, int index, double score) const
+    {
+        return { index, score, corpus.lex_rank(index) };
+    }
+
+    std::vector<WordScore> sort_word_scores(
+        WordScoreHeap& heap)
+    {
+        // pop max-heap: results come out in descending (score, lexical rank) order
+        std::vector<WordScore> word_scores;
+        word_scores.reserve(heap.size());
+        while (!heap.empty())
+        {
+            word_scores.push_back(heap.top());
+            heap.pop();
+        }
+        // reverse to get ascending (best-first) order
+        std::reverse(word_scores.begin(), word_scores.end());
+        return word_scores;
+    }
+
+    std::vector<std::tuple<std::vector<int>, double>> encoded_results(const CorpusVersion& corpus, const std::vector<WordScore>& word_scores) const
+    {
+        // convert to the return type: vector of tuples for Python
+        std::vector<std::tuple<std::vector<int>, double>> result(word_scores.size());
+        for (size_t i = 0; i < word_scores.size(); ++i)
+        {
+            const Code* codes = corpus.word_codes(word_scores[i].index);
+            result[i] = { std::vector<int>(codes, codes + corpus.word_len(word_scores[i].index)), word_scores[i].score };
+        }
+        return result;
+    }
+
+    std::vector<std::tuple<int, double>> index_results(const CorpusVersion& /* corpus */, const std::vector<WordScore>& word_scores) const
+    {
+        std::vector<std::tuple<int, double>> result(word_scores.size());
+        for (size_t i = 0; i < word_scores.size(); ++i)
+        {
+            result[i] = { word_scores[i].index, word_scores[i].score };
+        }
+        return result;
+    }
+
+    std::vector<std::tuple<std::string, double>> word_results(const CorpusVersion& corpus, const std::vector<WordScore>& word_scores) const
+    {
+        if (!corpus.has_words())
+        {
+            throw std::logic_error("no words were given to the constructor");
+        }
+        std::vector<std::tuple<std::string, double>> result(word_scores.size());
+        for (size_t i = 0; i < word_scores.size(); ++i)
+        {
+            result[i] = { std::string(corpus.word_utf8(word_scores[i].index)), word_scores[i].score };
+        }
+        return result;
+    }
+
+    template <typename Result>
+    std::vector<Result> batch_results(
+        const CorpusVersion& corpus,
+        const std::vector<std::vector<WordScore>>& batch_word_scores,
+        Result (WeightDamLeven::*convert)(const CorpusVersion&, const std::vector<WordScore>&) const) const
+    {
+        std::vector<Result> results;
+        results.reserve(batch_word_scores.size());
+        for (const auto& word_scores : batch_word_scores)
+        {
+            results.push_back((this->*convert)(corpus, word_scores));
+        }
+        return results;
+    }
+
+    WordScoreHeap merge_heaps(std::vector<WordScoreHeap>& heaps, int num_results)
+    {
+        // merge thread-local heaps sequentially after all threads have finished
+        WordScoreHeap merged_heap;
+        for (auto& heap : heaps)
+        {
+            while (!heap.empty())
+            {
+                WordScore word_score = heap.top();
+                heap.pop();
+                if ((int)merged_heap.size() < num_results)
+                {
+                    merged_heap.push(word_score);
+                }
+                else if (word_score < merged_heap.top())
+                {
+                    merged_heap.pop();
+                    merged_heap.push(word_score);
+                }
+            }
+        }
+        return merged_heap;
+    }
+
+    std::vector<ScanChunk> scan_chunks(const CorpusVersion& corpus, const CostProfile& costs, int target_len, int chunk_size) const
+    {
+        // chunks come out in bucket lower-bound order, so the cheapest words get scored first
+        std::vector<ScanChunk> chunks;
+        for (int len : length_bucket_order(corpus, costs, target_len))
+        {
+            int bucket_size = (int)corpus.length_buckets()[len].size();
+            for (int begin = 0; begin < bucket_size; begin += chunk_size)
+            {
+                chunks.push_back({ len, begin, std::min(begin + chunk_size, bucket_size) });
+            }
+        }
+        return chunks;
+    }
+
+    std::vector<ScanChunk> batch_scan_chunks(const CorpusVersion& corpus, const CostProfile& costs, const std::vector<std::vector<int>>& target_words_int, int chunk_size) const
+    {
+        // one pass for all queries: buckets ordered by the lowest lower bound any query has for them
+        std::vector<int> order;
+        const auto& length_buckets = corpus.length_buckets();
+        std::vector<double> best_lower_bound(length_buckets.size(), std::numeric_limits<double>::infinity());
+        for (int len = 0; len < (int)length_buckets.size(); ++len)
+        {
+            if (length_buckets[len].empty())
+            {
+                continue;
+            }
+            order.push_back(len);
+            for (const auto& target_word_int : target_words_int)
+            {
+                best_lower_bound[len] = std::min(best_lower_bound[len], length_lower_bound(costs, (int)target_word_int.size(), len));
+            }
+        }
+        std::stable_sort(order.begin(), order.end(), [&](int a, int b) { return best_lower_bound[a] < best_lower_bound[b]; });
+
+        std::vector<ScanChunk> chunks;
+        for (int len : order)
+        {
+            int bucket_size = (int)length_buckets[len].size();
+            for (int begin = 0; begin < bucket_size; begin += chunk_size)
+            {
+                chunks.push_back({ len, begin, std::min(begin + chunk_size, bucket_size) });
+            }
+        }
+        return chunks;
+    }
+
+    double current_score_to_beat(const WordScoreHeap& heap, int num_results, const std::atomic<double>& shared_score_to_beat) const
+    {
+        // shared_score_to_beat is the lowest heap.top().score of any full heap (or infinity),
+        // a word scoring above it can't make the merged top num_results
+        double score_to_beat = shared_score_to_beat.load(std::memory_order_relaxed);
+        if ((int)heap.size() >= num_results)
+        {
+            score_to_beat = std::min(score_to_beat, heap.top().score);
+        }
+        return score_to_beat;
+    }
+
+    void score_into_heap(
+        const CorpusVersion& corpus,
+        const CostProfile& costs,
+        WordScoreHeap& heap,
+        const std::vector<int>& target_word_int,
+        const int num_results,
+        const int index,
+        std::atomic<double>& shared_score_to_beat)
+    {
+        double score_to_beat = current_score_to_beat(heap, num_results, shared_score_to_beat);
+        double score = key_weighted_damerau_levenshtein(
+            costs,
+            target_word_int,
+            corpus.word_codes(index),
+            corpus.word_len(index),
+            std::isinf(score_to_beat) ? -1.0 : score_to_beat);
+        if (score > score_to_beat)
+        {
+            return;
+        }
+        push_word_score(corpus, heap, num_results, index, score, shared_score_to_beat);
+    }
+
+    template <typename T>
+    void score_lanes_into_heap(
+        const CorpusVersion& corpus,
+        const CostProfile& costs,
+        WordScoreHeap& heap,
+        const LaneProfile<T>& lane_profile,
+        const std::vector<int>& target_word_int,
+        const int num_results,
+        const int* indices,
+        const int count,
+        const int len2,
+        std::atomic<double>& shared_score_to_beat)
+    {
+        constexpr int LANES = SIMD_BYTES / (int)sizeof(T);
+        int len1 = (int)target_word_int.size();
+        if (!lane_fits(lane_profile, len1, len2))
+        {
+            for (int l = 0; l < count; ++l)
+            {
+                score_into_heap(corpus, costs, heap, target_word_int, num_results, indices[l], shared_score_to_beat);
+            }
+            return;
+        }
+
+        // a lane score within tolerance of score_to_beat may be a real result, and is rescored exactly,
+        // so the results never depend on the kernel
+        double tolerance = lane_tolerance(costs, lane_profile, len1, len2);
+        double score_to_beat = current_score_to_beat(heap, num_results, shared_score_to_beat);
+        double lane_scores[LANES];
+        lane_weighted_damerau_levenshtein(
+            corpus,
+            lane_profile,
+            target_word_int,
+            indices,
+            count,
+            len2,
+            std::isinf(score_to_beat) ? -1.0 : score_to_beat + tolerance,
+            lane_scores);
+        for (int l = 0; l < count; ++l)
+        {
+            if (lane_scores[l] - tolerance > current_score_to_beat(heap, num_results, shared_score_to_beat))
+            {
+                continue;
+            }
+            if (tolerance > 0.0)
+            {
+                score_into_heap(corpus, costs, heap, target_word_int, num_results, indices[l], shared_score_to_beat);
+            }
+            else
+            {
+                push_word_score(corpus, heap, num_results, indices[l], lane_scores[l], shared_score_to_beat);
+            }
+        }
+    }
+
+    int lane_count(KernelMode mode) const
+    {
+        switch (mode)
+        {
+        case KernelMode::SIMD:
+            return SIMD_BYTES / (int)sizeof(double);
+        case KernelMode::SIMD_FLOAT32:
+            return SIMD_BYTES / (int)sizeof(float);
+        case KernelMode::SIMD_FIXED_POINT:
+            return SIMD_BYTES / (int)sizeof(int32_t);
+        default:
+            return 1;
+        }
+    }
+
+    void score_group_into_heap(
+        const CorpusVersion& corpus,
+        const CostProfile& costs,
+        WordScoreHeap& heap,
+        const QueryProfile& profile,
+        const int num_results,
+        const int* indices, /* up to lane_count(profile.mode) words of length len2 */
+        const int count,
+        const int len2,
+        std::atomic<double>& shared_score_to_beat)
+    {
+        const std::vector<int>& target_word_int = *profile.target;
+        switch (profile.mode)
+        {
+        case KernelMode::SCALAR:
+            for (int l = 0; l < count; ++l)
+            {
+                score_into_heap(corpus, costs, heap, target_word_int, num_results, indices[l], shared_score_to_beat);
+            }
+            break;
+        case KernelMode::SIMD:
+            score_lanes_into_heap(corpus, costs, heap, profile.lanes_f64, target_word_int, num_results, indices, count, len2, shared_score_to_beat);
+            break;
+        case KernelMode::SIMD_FLOAT32:
+            score_lanes_into_heap(corpus, costs, heap, profile.lanes_f32, target_word_int, num_results, indices, count, len2, shared_score_to_beat);
+            break;
+        case KernelMode::SIMD_FIXED_POINT:
+            score_lanes_into_heap(corpus, costs, heap, profile.lanes_fixed, target_word_int, num_results, indices, count, len2, shared_score_to_beat);
+            break;
+        }
+    }
+
+    void populate_heaps_batch(
+        const CorpusVersion& corpus,
+        const CostProfile& costs,
+        std::vector<WordScoreHeap>& heaps,
+        const std::vector<std::vector<int>>& target_words_int,
+        const int num_results,
+        const std::vector<ScanChunk>& chunks,
+        std::atomic<int>& chunk_cursor,
+        std::vector<std::atomic<double>>& shared_scores_to_beat,
+        const CancelToken* cancel)
+    {
+        // same as populate_heap, but every word is scored against all queries while it is in cache
+        if (num_results <= 0)
+        {
+            return;
+        }
+
+        CountScope count_scope(*this);
+        int query_count = (int)target_words_int.size();
+        std::vector<QueryProfile> profiles;
+        profiles.reserve(query_count);
+        for (const auto& target_word_int : target_words_int)
+        {
+            profiles.push_back(make_query_profile(corpus, costs, target_word_int));
+        }
+        int group_size = query_count > 0 ? lane_count(profiles[0].mode) : 1;
+        std::vector<int> active_queries;
+        active_queries.reserve(query_count);
+        while (true)
+        {
+            int chunk_index = chunk_cursor.fetch_add(1, std::memory_order_relaxed);
+            if (chunk_index >= (int)chunks.size() || is_cancelled(cancel))
+            {
+                break;
+            }
+
+            const ScanChunk& chunk = chunks[chunk_index];
+            active_queries.clear();
+            for (int query = 0; query < query_count; ++query)
+            {
+                double score_to_beat = current_score_to_beat(heaps[query], num_results, shared_scores_to_beat[query]);
+                if (length_lower_bound(costs, (int)target_words_int[query].size(), chunk.len) <= score_to_beat)
+                {
+                    active_queries.push_back(query);
+                }
+            }
+            if (active_queries.empty())
+            {
+                continue;
+            }
+
+            const std::vector<int>& bucket = corpus.length_buckets()[chunk.len];
+            for (int position = chunk.begin; position < chunk.end; position += group_size)
+            {
+                int count = std::min(group_size, chunk.end - position);
+                for (int query : active_queries)
+                {
+                    score_group_into_heap(corpus, costs, heaps[query], profiles[query], num_results, &bucket[position], count, chunk.len, shared_scores_to_beat[query]);
+                }
+            }
+        }
+    }
+
+    void populate_heap(
+        const CorpusVersion& corpus,
+        const CostProfile& costs,
+        WordScoreHeap& heap,
+        const std::vector<int>& target_word_int,
+        const int num_results,
+        const std::vector<ScanChunk>& chunks,
+        std::atomic<int>& chunk_cursor,
+        std::atomic<double>& shared_score_to_beat,
+        const CancelToken* cancel)
+    {
+        if (num_results <= 0)
+        {
+            return;
+        }
+
+        CountScope count_scope(*this);
+        int target_len = (int)target_word_int.size();
+        QueryProfile profile = make_query_profile(corpus, costs, target_word_int);
+        int group_size = lane_count(profile.mode);
+        while (true)
+        {
+            int chunk_index = chunk_cursor.fetch_add(1, std::memory_order_relaxed);
+            if (chunk_index >= (int)chunks.size() || is_cancelled(cancel))
+            {
+                break;
+            }
+
+            // chunks are ordered by lower bound, so once one can't reach the threshold none of the rest can
+            const ScanChunk& chunk = chunks[chunk_index];
+            if (length_lower_bound(costs, target_len, chunk.len) > current_score_to_beat(heap, num_results, shared_score_to_beat))
+            {
+                break;
+            }
+
+            const std::vector<int>& bucket = corpus.length_buckets()[chunk.len];
+            for (int position = chunk.begin; position < chunk.end; position += group_size)
+            {
+                int count = std::min(group_size, chunk.end - position);
+                score_group_into_heap(corpus, costs, heap, profile, num_results, &bucket[position], count, chunk.len, shared_score_to_beat);
+            }
+        }
+    };
+
+    std::vector<WordScore> search_scan(
+        const CorpusVersion& corpus,
+        const CostProfile& costs,
+        const std::vector<int>& target_word_int,
+        int num_results,
+        double score_to_beat,
+        const CancelToken* cancel)
+    {
+        // insertion is O(log[num_results])
+        WordScoreHeap heap;
+
+        // whole length buckets, unless the cancel token needs checking now and then
+        int chunk_size = cancel != nullptr ? SCAN_CHUNK_SIZE : std::numeric_limits<int>::max();
+        std::vector<ScanChunk> chunks = scan_chunks(corpus, costs, (int)target_word_int.size(), chunk_size);
+        std::atomic<int> chunk_cursor{ 0 };
+        std::atomic<double> shared_score_to_beat{ score_to_beat };
+        populate_heap(
+            corpus,
+            costs,
+            heap,
+            target_word_int,
+            num_results,
+            chunks,
+            chunk_cursor,
+            shared_score_to_beat,
+            cancel);
+
+        return sort_word_scores(heap);
+    }
+
+    std::vector<WordScore> search_scan_multithread(
+        const CorpusVersion& corpus,
+        const CostProfile& costs,
+        const std::vector<int>& target_word_int,
+        int num_results,
+        double score_to_beat,
+        const CancelToken* cancel)
+    {
+        // each thread maintains its own heap to avoid synchronization overhead during scoring,
+        // threads pull small chunks from a shared cursor so that uneven early-abandon costs even out,
+        // and share a single score to beat so that one thread's good results prune the others
+        std::vector<WordScoreHeap> heaps(m_pool->size());
+        std::vector<ScanChunk> chunks = scan_chunks(corpus, costs, (int)target_word_int.size(), SCAN_CHUNK_SIZE);
+        std::atomic<int> chunk_cursor{ 0 };
+        std::atomic<double> shared_score_to_beat{ score_to_beat };
+
+        m_pool->run([&](int worker_index)
+        {
+            populate_heap(
+                corpus,
+                costs,
+                heaps[worker_index],
+                target_word_int,
+                num_results,
+                chunks,
+                chunk_cursor,
+                shared_score_to_beat,
+                cancel);
+        });
+
+        WordScoreHeap merged_heap = merge_heaps(heaps, num_results);
+        return sort_word_scores(merged_heap);
+    }
+
+    std::vector<std::vector<WordScore>> search_batch_scan(
+        const CorpusVersion& corpus,
+        const CostProfile& costs,
+        const std::vector<std::vector<int>>& target_words_int,
+        int num_results,
+        const std::vector<double>& scores_to_beat,
+        const CancelToken* cancel)
+    {
+        int query_count = (int)target_words_int.size();
+        std::vector<WordScoreHeap> heaps(query_count);
+        int chunk_size = cancel != nullptr ? SCAN_CHUNK_SIZE : std::numeric_limits<int>::max();
+        std::vector<ScanChunk> chunks = batch_scan_chunks(corpus, costs, target_words_int, chunk_size);
+        std::atomic<int> chunk_cursor{ 0 };
+        std::vector<std::atomic<double>> shared_scores_to_beat(query_count);
+        for (int query = 0; query < query_count; ++query)
+        {
+            shared_scores_to_beat[query].store(scores_to_beat[query]);
+        }
+        populate_heaps_batch(
+            corpus,
+            costs,
+            heaps,
+            target_words_int,
+            num_results,
+            chunks,
+            chunk_cursor,
+            shared_scores_to_beat,
+            cancel);
+
+        std::vector<std::vector<WordScore>> results(query_count);
+        for (int query = 0; query < query_count; ++query)
+        {
+            results[query] = sort_word_scores(heaps[query]);
+        }
+        return results;
+    }
+
+    std::vector<std::vector<WordScore>> search_batch_scan_multithread(
+        const CorpusVersion& corpus,
+        const CostProfile& costs,
+        const std::vector<std::vector<int>>& target_words_int,
+        int num_results,
+        const std::vector<double>& scores_to_beat,
+        const CancelToken* cancel)
+    {
+        // heaps[worker_index][query]
+        int query_count = (int)target_words_int.size();
+        std::vector<std::vector<WordScoreHeap>> heaps(m_pool->size(), std::vector<WordScoreHeap>(query_count));
+        std::vector<ScanChunk> chunks = batch_scan_chunks(corpus, costs, target_words_int, SCAN_CHUNK_SIZE);
+        std::atomic<int> chunk_cursor{ 0 };
+        std::vector<std::atomic<double>> shared_scores_to_beat(query_count);
+        for (int query = 0; query < query_count; ++query)
+        {
+            shared_scores_to_beat[query].store(scores_to_beat[query]);
+        }
+
+        m_pool->run([&](int worker_index)
+        {
+            populate_heaps_batch(
+                corpus,
+                costs,
+                heaps[worker_index],
+                target_words_int,
+                num_results,
+                chunks,
+                chunk_cursor,
+                shared_scores_to_beat,
+                cancel);
+        });
+
+        std::vector<std::vector<WordScore>> results(query_count);
+        for (int query = 0; query < query_count; ++query)
+        {
+            std::vector<WordScoreHeap> query_heaps;
+            query_heaps.reserve(heaps.size());
+            for (auto& worker_heaps : heaps)
+            {
+                query_heaps.push_back(std::move(worker_heaps[query]));
+            }
+            WordScoreHeap merged_heap = merge_heaps(query_heaps, num_results);
+            results[query] = sort_word_scores(merged_heap);
+        }
+        return results;
+    }
+
+    static bool is_trailing_edit(const std::vector<int>& previous, const std::vector<int>& target)
+    {
+        // one character appended to or deleted from the end
+        size_t shorter = std::min(previous.size(), target.size());
+        size_t longer = std::max(previous.size(), target.size());
+        return longer == shorter + 1 && std::equal(target.begin(), target.begin() + shorter, previous.begin());
+    }
+
+    bool begin_session_search(
+        const CorpusVersion& corpus,
+        const CostProfile& costs,
+        SearchSession* session,
+        const std::vector<int>& target_word_int,
+        int num_results,
+        double& score_to_beat,
+        std::vector<WordScore>& results)
+    {
+        // returns true if the session already holds the results, otherwise sets the starting score_to_beat
+        score_to_beat = std::numeric_limits<double>::infinity();
+        if (session == nullptr)
+        {
+            return false;
+        }
+
+        std::lock_guard<std::mutex> lock(session->m_mutex);
+        if (session->m_engine_id != m_engine_id
+            || session->m_corpus_id != corpus.get_id()
+            || session->m_cost_profile_id != costs.id
+            || session->m_num_results != num_results)
+        {
+            ++session->m_full_count;
+            return false;
+        }
+        if (session->m_target_word_int == target_word_int)
+        {
+            ++session->m_repeat_count;
+            results = session->m_results;
+            return true;
+        }
+        if (!is_trailing_edit(session->m_target_word_int, target_word_int))
+        {
+            ++session->m_full_count;
+            return false;
+        }
+
+        // the previous results are usually still close: num_results real scores for the new query
+        // bound its k-th best from above, so the scan prunes from the first word
+        ++session->m_incremental_count;
+        CountScope count_scope(*this);
+        if (num_results > 0 && (int)session->m_results.size() >= num_results)
+        {
+            double worst_score = -std::numeric_limits<double>::infinity();
+            for (const WordScore& word_score : session->m_results)
+            {
+                worst_score = std::max(worst_score, key_weighted_damerau_levenshtein(
+                    costs,
+                    target_word_int,
+                    corpus.word_codes(word_score.index),
+                    corpus.word_len(word_score.index),
+                    -1.0));
+            }
+            score_to_beat = worst_score;
+        }
+        return false;
+    }
+
+    void end_session_search(
+        const CorpusVersion& corpus,
+        const CostProfile& costs,
+        SearchSession* session,
+        const std::vector<int>& target_word_int,
+        int num_results,
+        const std::vector<WordScore>& results)
+    {
+        if (session == nullptr)
+        {
+            return;
+        }
+        std::lock_guard<std::mutex> lock(session->m_mutex);
+        session->m_engine_id = m_engine_id;
+        session->m_corpus_id = corpus.get_id();
+        session->m_cost_profile_id = costs.id;
+        session->m_num_results = num_results;
+        session->m_target_word_int = target_word_int;
+        session->m_results = results;
+    }
+
+    bool prefix_search(
+        const CorpusVersion& corpus,
+        const CostProfile& costs,
+        const std::vector<int>& target_word_int,
+        int num_results,
+        std::vector<WordScore>& results)
+    {
+        // returns true if the words that start with the target are the results
+        //
+        // only matching every target code and then appending L codes costs nothing but L appends, any other
+        // alignment has an edit that costs at least costs.min_edit_cost, so while L appends stay below it
+        // the words extending the target by L codes score exactly that and every other word scores more
+        if (num_results <= 0 || !(costs.min_edit_cost > 0.0) || !(costs.append_cost >= 0.0))
+        {
+            return false;
+        }
+        std::vector<WordScore> found;
+        int bucket_count = (int)corpus.length_buckets().size();
+        double append_score = 0.0; // summed like the DP row does
+        for (int len = (int)target_word_int.size(); len < bucket_count && append_score < costs.min_edit_cost; ++len)
+        {
+            if ((int)found.size() >= num_results && append_score > found.back().score)
+            {
+                break;
+            }
+            auto [first, last] = corpus.prefix_range(target_word_int, len);
+            for (const int* position = first; position != last; ++position)
+            {
+                found.push_back(make_word_score(corpus, *position, append_score));
+            }
+            append_score += costs.append_cost;
+        }
+        if ((int)found.size() >= num_results)
+        {
+            std::partial_sort(found.begin(), found.begin() + num_results, found.end());
+            found.resize(num_results);
+            results = std::move(found);
+            return true;
         }
+        return false;
+    }
 
-        for (int i = 1; i <= len1; ++i)
+    double first_pass(
+        const CorpusVersion& corpus,
+        const CostProfile& costs,
+        const std::vector<int>& target_word_int,
+        int num_results,
+        double score_to_beat)
+    {
+        // scores the words next to the target in code order, of about its length and sharing its first codes,
+        // which are usually close: the k-th best of their scores bounds the k-th best overall from above, so the
+        // search that follows prunes from its first word, in every thread
+        CountScope count_scope(*this);
+        std::priority_queue<double> best; // the num_results lowest scores so far, worst on top
+        int target_len = (int)target_word_int.size();
+        int count = std::max(1, std::min(num_results, FIRST_PASS_WORDS / 8));
+        for (int len = std::max(target_len - 1, 0); len <= target_len + 2; ++len)
         {
-            // reset column 0 so that (*rows[cur])[j - 1] works when j == 1
-            (*rows[cur])[0] = i * m_delete_cost;
-
-            double best_score_this_row = (*rows[cur])[0];
-
-            for (int j = 1; j <= len2; ++j)
+            auto [first, last] = corpus.code_order_neighbours(target_word_int, len, count);
+            for (const int* position = first; position != last; ++position)
             {
-                int str1_idx = str1[i - 1];
-                int str2_idx = str2[j - 1];
-
-                double replace_cost_curr;
-                if (str1_idx == str2_idx)
-                {
-                    replace_cost_curr = 0.0;
-                }
-                else if (m_is_key_cost)
-                {
-                    replace_cost_curr = m_replace_cost;
-                    if (str1_idx < (int)m_cost_matrix.size() && str2_idx < (int)m_cost_matrix.size())
-                    {
-                        replace_cost_curr = m_cost_matrix[str1_idx][str2_idx];
-                    }
-                }
-                else
+                double score_to_beat_now = (int)best.size() >= num_results ? std::min(best.top(), score_to_beat) : score_to_beat;
+                double score = key_weighted_damerau_levenshtein(
+                    costs,
+                    target_word_int,
+                    corpus.word_codes(*position),
+                    corpus.word_len(*position),
+                    std::isinf(score_to_beat_now) ? -1.0 : score_to_beat_now);
+                if (score > score_to_beat_now)
                 {
-                    replace_cost_curr = m_replace_cost;
+                    continue;
                 }
-
-                double insert_append_cost = j > len1 ? m_append_cost : m_insert_cost;
-                (*rows[cur])[j] = std::min(
-                    (*rows[p1])[j] + m_delete_cost, // delete
-                    (*rows[cur])[j - 1] + insert_append_cost); // insert
-                (*rows[cur])[j] = std::min(
-                    (*rows[cur])[j],
-                    (*rows[p1])[j - 1] + replace_cost_curr); // replace
-
-                if (i > 1 && j > 1 && str1_idx == str2[j - 2] && str1[i - 2] == str2_idx)
+                best.push(score);
+                if ((int)best.size() > num_results)
                 {
-                    (*rows[cur])[j] = std::min(
-                        (*rows[cur])[j],
-                        (*rows[p2])[j - 2] + m_transpose_cost); // transpose
+                    best.pop();
                 }
-
-                best_score_this_row = std::min(best_score_this_row, (*rows[cur])[j]);
             }
+        }
+        return (int)best.size() >= num_results ? std::min(best.top(), score_to_beat) : score_to_beat;
+    }
 
-            if (score_to_beat >= 0 && best_score_this_row >= score_to_beat)
+    double deletion_lower_bound(const DeletionIndex& deletion_index, const CostProfile& costs) const
+    {
+        // a word outside the candidates needs more than radius counted edits, i.e. all but replacements within
+        // a fold class, and each of those costs at least the cheapest counted edit of the profile
+        double min_cost = std::min({ costs.replace_cost, costs.insert_cost, costs.append_cost, costs.delete_cost, costs.transpose_cost });
+        if (costs.is_key_cost)
+        {
+            const CostTable& table = *costs.table;
+            for (int str1_idx = 0; str1_idx < table.size(); ++str1_idx)
             {
-                return score_to_beat + 1.0;
+                for (int str2_idx = 0; str2_idx < table.size(); ++str2_idx)
+                {
+                    if (deletion_index.fold(str1_idx) != deletion_index.fold(str2_idx))
+                    {
+                        min_cost = std::min(min_cost, table.get(str1_idx, str2_idx));
+                    }
+                }
             }
-
-            // recall p1 = row i-1 index, p2 = row i-2 index, cur = row being written
-            // rotate: p2 -> p1; p1 -> cur; cur (recycled) -> p2 (oldest)
-            // so p2 and p1 move up one index, and cur just uses the old p2 space
-            int tmp = p2;
-            p2 = p1;
-            p1 = cur;
-            cur = tmp;
         }
-
-        return (*rows[p1])[len2]; // p1 holds the last written row after the final rotate
+        return (deletion_index.radius() + 1) * min_cost * (1.0 - LOWER_BOUND_SLACK);
     }
 
-    std::vector<std::tuple<std::vector<int>, double>> sort_word_scores(
-        std::priority_queue<WordScore, std::vector<WordScore>>& heap)
+    bool deletion_search(
+        const CorpusVersion& corpus,
+        const CostProfile& costs,
+        const std::vector<int>& target_word_int,
+        int num_results,
+        double max_cost,
+        double& score_to_beat,
+        std::vector<WordScore>& results)
     {
-        // pop max-heap: results come out in descending score order
-        std::vector<WordScore> word_scores;
-        word_scores.reserve(heap.size());
-        while (!heap.empty())
+        // returns true if rescoring the deletion index candidates gave the results: every word scoring below
+        // deletion_lower_bound() is a candidate, so if the k-th best candidate or max_cost is below it too
+        // nothing else can be in the results
+        // otherwise lowers score_to_beat to the k-th best candidate, which still bounds the k-th best overall
+        auto deletion_index = corpus.get_deletion_index();
+        if (!deletion_index || deletion_index->radius() < 0 || num_results <= 0)
         {
-            word_scores.push_back(heap.top());
-            heap.pop();
+            return false;
         }
-        // reverse to get ascending (best-first) order
-        std::reverse(word_scores.begin(), word_scores.end());
-
-        // convert to the return type: vector of tuples for Python
-        std::vector<std::tuple<std::vector<int>, double>> result(word_scores.size());
-        for (size_t i = 0; i < word_scores.size(); ++i)
+        double lower_bound = deletion_lower_bound(*deletion_index, costs);
+        bool is_bounded = max_cost < lower_bound; // every word within max_cost is a candidate
+        if (!(lower_bound > 0.0) || (!is_bounded && num_results >= corpus.live_count()))
         {
-            result[i] = {m_keys_encoded[word_scores[i].index], word_scores[i].score};
+            return false;
         }
-        return result;
-    }
 
-    void populate_heap(
-        std::priority_queue<WordScore, std::vector<WordScore>>& heap,
-        const std::vector<int>& target_word_int,
-        const int num_results,
-        const int counter_start,
-        const int counter_stop)
-    {
-        for (int index = counter_start; index < counter_stop; ++index)
+        std::vector<int> candidates;
+        deletion_index->find_candidates(target_word_int, candidates);
+        for (int index = deletion_index->word_count(); index < corpus.slot_count(); ++index)
         {
-            std::vector<int>& word = m_keys_encoded[index];
-            double score = key_weighted_damerau_levenshtein(
-                target_word_int,
-                word,
-                ((int)heap.size() < num_results) ? -1.0 : heap.top().score);
+            candidates.push_back(index);
+        }
+        if ((int)candidates.size() > corpus.live_count() / DELETION_CANDIDATE_FRACTION)
+        {
+            return false;
+        }
 
-            if ((int)heap.size() < num_results)
-            {
-                heap.push({ index, score });
-            }
-            else if (score < heap.top().score)
+        CountScope count_scope(*this);
+        WordScoreHeap heap;
+        std::atomic<double> shared_score_to_beat{ std::min(max_cost, score_to_beat) };
+        for (int index : candidates)
+        {
+            if (corpus.is_live(index))
             {
-                heap.pop();
-                heap.push({ index, score });
+                score_into_heap(corpus, costs, heap, target_word_int, num_results, index, shared_score_to_beat);
             }
         }
-    };
+        if (is_bounded || ((int)heap.size() >= num_results && heap.top().score < lower_bound))
+        {
+            m_deletion_answers.fetch_add(1, std::memory_order_relaxed);
+            results = sort_word_scores(heap);
+            return true;
+        }
+        if ((int)heap.size() >= num_results)
+        {
+            score_to_beat = std::min(score_to_beat, heap.top().score);
+        }
+        return false;
+    }
 
-    std::vector<std::tuple<std::vector<int>, double>> weighted_damerau_levenshtein(
+    std::vector<WordScore> search(
+        const CorpusVersion& corpus,
+        const CostProfile& costs,
         const std::vector<int>& target_word_int,
-        int num_results)
+        int num_results,
+        SearchSession* session = nullptr,
+        const CancelToken* cancel = nullptr)
     {
         num_results = std::max(num_results, 1);
-        num_results = std::min(num_results, (int)(m_keys_encoded.size()));
-
-        // max-heap of capacity num_results: top() is the worst (highest) accepted score
-        // insertion is O(log[num_results])
-        std::priority_queue<WordScore, std::vector<WordScore>> heap;
-
-        populate_heap(
-            heap,
-            target_word_int,
-            num_results,
-            0,
-            (int)m_keys_encoded.size());
+        num_results = std::min(num_results, corpus.live_count());
 
-        return sort_word_scores(heap);
+        double score_to_beat;
+        std::vector<WordScore> results;
+        if (begin_session_search(corpus, costs, session, target_word_int, num_results, score_to_beat, results))
+        {
+            return results;
+        }
+        if (prefix_search(corpus, costs, target_word_int, num_results, results))
+        {
+            m_prefix_answers.fetch_add(1, std::memory_order_relaxed);
+            end_session_search(corpus, costs, session, target_word_int, num_results, results);
+            return results;
+        }
+        if (deletion_search(corpus, costs, target_word_int, num_results, std::numeric_limits<double>::infinity(), score_to_beat, results))
+        {
+            end_session_search(corpus, costs, session, target_word_int, num_results, results);
+            return results;
+        }
+        score_to_beat = first_pass(corpus, costs, target_word_int, num_results, score_to_beat);
+        m_full_searches.fetch_add(1, std::memory_order_relaxed);
+        if (m_search_mode.load() == SearchMode::TRIE)
+        {
+            results = search_trie(corpus, costs, target_word_int, num_results, score_to_beat, cancel);
+        }
+        else
+        {
+            results = search_scan(corpus, costs, target_word_int, num_results, score_to_beat, cancel);
+        }
+        throw_if_cancelled(cancel); // partial results are neither returned nor kept by the session
+        end_session_search(corpus, costs, session, target_word_int, num_results, results);
+        return results;
     }
 
-    std::vector<std::tuple<std::vector<int>, double>> weighted_damerau_levenshtein_multithread(
+    std::vector<WordScore> search_multithread(
+        const CorpusVersion& corpus,
+        const CostProfile& costs,
         const std::vector<int>& target_word_int,
-        int num_results)
+        int num_results,
+        SearchSession* session = nullptr,
+        const CancelToken* cancel = nullptr)
     {
-        int thread_count = (int)std::thread::hardware_concurrency();
         num_results = std::max(num_results, 1);
-        num_results = std::min(num_results, (int)(m_keys_encoded.size()));
+        num_results = std::min(num_results, corpus.live_count());
+
+        double score_to_beat;
+        std::vector<WordScore> results;
+        if (begin_session_search(corpus, costs, session, target_word_int, num_results, score_to_beat, results))
+        {
+            return results;
+        }
+        if (prefix_search(corpus, costs, target_word_int, num_results, results))
+        {
+            m_prefix_answers.fetch_add(1, std::memory_order_relaxed);
+            end_session_search(corpus, costs, session, target_word_int, num_results, results);
+            return results;
+        }
+        if (deletion_search(corpus, costs, target_word_int, num_results, std::numeric_limits<double>::infinity(), score_to_beat, results))
+        {
+            end_session_search(corpus, costs, session, target_word_int, num_results, results);
+            return results;
+        }
+        score_to_beat = first_pass(corpus, costs, target_word_int, num_results, score_to_beat);
+        m_full_searches.fetch_add(1, std::memory_order_relaxed);
+        if (m_search_mode.load() == SearchMode::TRIE)
+        {
+            results = search_trie_multithread(corpus, costs, target_word_int, num_results, score_to_beat, cancel);
+        }
+        else
+        {
+            results = search_scan_multithread(corpus, costs, target_word_int, num_results, score_to_beat, cancel);
+        }
+        throw_if_cancelled(cancel); // partial results are neither returned nor kept by the session
+        end_session_search(corpus, costs, session, target_word_int, num_results, results);
+        return results;
+    }
 
-        // each thread maintains its own heap to avoid synchronization overhead during scoring
-        std::vector<std::priority_queue<WordScore, std::vector<WordScore>>> heaps(thread_count);
-        int chunk_size = (int)std::ceil(m_keys_encoded.size() / (double)thread_count);
-        int counter_start = 0;
-        int counter_stop = 0;
-        std::vector<std::thread> threads(thread_count);
+    std::vector<std::vector<WordScore>> search_batch(
+        const CorpusVersion& corpus,
+        const CostProfile& costs,
+        const std::vector<std::vector<int>>& target_words_int,
+        int num_results,
+        const std::vector<SearchSession*>& sessions,
+        bool multithread,
+        const CancelToken* cancel = nullptr)
+    {
+        num_results = std::max(num_results, 1);
+        num_results = std::min(num_results, corpus.live_count());
+        int query_count = (int)target_words_int.size();
+        if (!sessions.empty() && (int)sessions.size() != query_count)
+        {
+            throw std::invalid_argument("sessions: expected one session per query");
+        }
 
-        for (int i = 0; i < thread_count; ++i)
+        // queries whose session, prefix or deletion index candidates already have the answer are left out of the pass over the words
+        std::vector<std::vector<WordScore>> results(query_count);
+        std::vector<int> pending;
+        std::vector<std::vector<int>> pending_words_int;
+        std::vector<double> scores_to_beat;
+        for (int query = 0; query < query_count; ++query)
         {
-            if (i == thread_count - 1)
+            SearchSession* session = sessions.empty() ? nullptr : sessions[query];
+            double score_to_beat;
+            if (begin_session_search(corpus, costs, session, target_words_int[query], num_results, score_to_beat, results[query]))
             {
-                // last thread takes any remaining items due to rounding
-                counter_stop = (int)m_keys_encoded.size();
+                continue;
             }
-            else
+            if (prefix_search(corpus, costs, target_words_int[query], num_results, results[query]))
+            {
+                m_prefix_answers.fetch_add(1, std::memory_order_relaxed);
+                end_session_search(corpus, costs, session, target_words_int[query], num_results, results[query]);
+                continue;
+            }
+            if (deletion_search(corpus, costs, target_words_int[query], num_results, std::numeric_limits<double>::infinity(), score_to_beat, results[query]))
             {
-                counter_stop = std::min(counter_start + chunk_size, (int)m_keys_encoded.size());
+                end_session_search(corpus, costs, session, target_words_int[query], num_results, results[query]);
+                continue;
             }
+            score_to_beat = first_pass(corpus, costs, target_words_int[query], num_results, score_to_beat);
+            m_full_searches.fetch_add(1, std::memory_order_relaxed);
+            pending.push_back(query);
+            pending_words_int.push_back(target_words_int[query]);
+            scores_to_beat.push_back(score_to_beat);
+        }
 
-            if (counter_start >= counter_stop)
+        std::vector<std::vector<WordScore>> pending_results;
+        if (m_search_mode.load() == SearchMode::TRIE)
+        {
+            // the trie already shares work across words, queries are walked one after another
+            for (int i = 0; i < (int)pending.size() && !is_cancelled(cancel); ++i)
             {
-                break; // no more items to process, can happen if thread_count > m_keys_encoded.size()
+                pending_results.push_back(multithread
+                    ? search_trie_multithread(corpus, costs, pending_words_int[i], num_results, scores_to_beat[i], cancel)
+                    : search_trie(corpus, costs, pending_words_int[i], num_results, scores_to_beat[i], cancel));
             }
+        }
+        else if (!pending.empty())
+        {
+            pending_results = multithread
+                ? search_batch_scan_multithread(corpus, costs, pending_words_int, num_results, scores_to_beat, cancel)
+                : search_batch_scan(corpus, costs, pending_words_int, num_results, scores_to_beat, cancel);
+        }
+        throw_if_cancelled(cancel);
 
-            threads[i] = std::thread(
-                &WeightDamLeven::populate_heap,
-                this,
-                std::ref(heaps[i]),
-                std::ref(target_word_int),
-                num_results,
-                counter_start,
-                counter_stop);
-            counter_start = counter_stop;
+        for (int i = 0; i < (int)pending.size(); ++i)
+        {
+            int query = pending[i];
+            results[query] = std::move(pending_results[i]);
+            end_session_search(corpus, costs, sessions.empty() ? nullptr : sessions[query], target_words_int[query], num_results, results[query]);
         }
+        return results;
+    }
 
-        for (int i = 0; i < thread_count; ++i)
+    std::vector<WordScore> search_within(
+        const CorpusVersion& corpus,
+        const CostProfile& costs,
+        const std::vector<int>& target_word_int,
+        double max_cost,
+        int limit,
+        bool multithread,
+        const CancelToken* cancel = nullptr)
+    {
+        // the top-k search with the threshold fixed at max_cost from the first word on, instead of
+        // whatever the heap has found so far, and a heap of limit words (every live word if limit <= 0)
+        int num_results = limit > 0 ? std::min(limit, corpus.live_count()) : corpus.live_count();
+        if (num_results <= 0 || !(max_cost >= 0.0))
         {
-            threads[i].join();
+            return {};
         }
 
-        // merge thread-local heaps sequentially after all threads have finished
-        std::priority_queue<WordScore, std::vector<WordScore>> merged_heap;
-        for (auto& heap : heaps)
+        std::vector<WordScore> results;
+        double score_to_beat = max_cost;
+        if (deletion_search(corpus, costs, target_word_int, num_results, max_cost, score_to_beat, results))
         {
-            while (!heap.empty())
-            {
-                WordScore word_score = heap.top();
-                heap.pop();
-                if ((int)merged_heap.size() < num_results)
-                {
-                    merged_heap.push(word_score);
-                }
-                else if (word_score.score < merged_heap.top().score)
-                {
-                    merged_heap.pop();
-                    merged_heap.push(word_score);
-                }
-            }
+            return results;
+        }
+        if (m_search_mode.load() == SearchMode::TRIE)
+        {
+            results = multithread
+                ? search_trie_multithread(corpus, costs, target_word_int, num_results, score_to_beat, cancel)
+                : search_trie(corpus, costs, target_word_int, num_results, score_to_beat, cancel);
+        }
+        else
+        {
+            results = multithread
+                ? search_scan_multithread(corpus, costs, target_word_int, num_results, score_to_beat, cancel)
+                : search_scan(corpus, costs, target_word_int, num_results, score_to_beat, cancel);
         }
+        throw_if_cancelled(cancel);
+        return results;
+    }
 
-        return sort_word_scores(merged_heap);
+    std::vector<std::tuple<std::vector<int>, double>> weighted_damerau_levenshtein(
+        const Target& target,
+        int num_results,
+        const std::string& profile)
+    {
+        auto corpus = current_corpus();
+        auto costs = get_cost_profile(profile);
+        return encoded_results(*corpus, search(*corpus, *costs, encode_target(target), num_results));
+    }
+
+    std::vector<std::tuple<std::vector<int>, double>> weighted_damerau_levenshtein_multithread(
+        const Target& target,
+        int num_results,
+        const std::string& profile)
+    {
+        auto corpus = current_corpus();
+        auto costs = get_cost_profile(profile);
+        return encoded_results(*corpus, search_multithread(*corpus, *costs, encode_target(target), num_results));
+    }
+
+    std::vector<std::vector<std::tuple<std::vector<int>, double>>> weighted_damerau_levenshtein_batch(
+        const std::vector<Target>& targets,
+        int num_results,
+        const std::string& profile)
+    {
+        auto corpus = current_corpus();
+        auto costs = get_cost_profile(profile);
+        return batch_results(*corpus, search_batch(*corpus, *costs, encode_targets(targets), num_results, {}, false), &WeightDamLeven::encoded_results);
+    }
+
+    std::vector<std::vector<std::tuple<std::vector<int>, double>>> weighted_damerau_levenshtein_batch_multithread(
+        const std::vector<Target>& targets,
+        int num_results,
+        const std::string& profile)
+    {
+        auto corpus = current_corpus();
+        auto costs = get_cost_profile(profile);
+        return batch_results(*corpus, search_batch(*corpus, *costs, encode_targets(targets), num_results, {}, true), &WeightDamLeven::encoded_results);
     }
 
     std::tuple<std::vector<int>, double> weighted_damerau_levenshtein_single(
-        const std::vector<int>& target_word_int)
+        const Target& target,
+        const std::string& profile)
     {
-        return weighted_damerau_levenshtein(target_word_int, 1)[0];
+        return weighted_damerau_levenshtein(target, 1, profile)[0];
     }
 
     std::tuple<std::vector<int>, double> weighted_damerau_levenshtein_single_multithread(
-        const std::vector<int>& target_word_int)
+        const Target& target,
+        const std::string& profile)
+    {
+        return weighted_damerau_levenshtein_multithread(target, 1, profile)[0];
+    }
+
+    // the _within searches return every word scoring at most max_cost (the best limit of them if limit > 0),
+    // ordered by score and then lexically
+
+    std::vector<std::tuple<std::vector<int>, double>> weighted_damerau_levenshtein_within(
+        const Target& target,
+        double max_cost,
+        int limit,
+        const std::string& profile)
+    {
+        auto corpus = current_corpus();
+        auto costs = get_cost_profile(profile);
+        return encoded_results(*corpus, search_within(*corpus, *costs, encode_target(target), max_cost, limit, false));
+    }
+
+    std::vector<std::tuple<std::vector<int>, double>> weighted_damerau_levenshtein_within_multithread(
+        const Target& target,
+        double max_cost,
+        int limit,
+        const std::string& profile)
+    {
+        auto corpus = current_corpus();
+        auto costs = get_cost_profile(profile);
+        return encoded_results(*corpus, search_within(*corpus, *costs, encode_target(target), max_cost, limit, true));
+    }
+
+    // the _indices and _words searches return corpus indices or the original words instead of encoded ints,
+    // ordered by score and then lexically, and can reuse the previous query of a SearchSession
+    // and be abandoned midway through a CancelToken
+
+    std::vector<std::tuple<int, double>> weighted_damerau_levenshtein_indices(
+        const Target& target,
+        int num_results,
+        SearchSession* session,
+        const std::string& profile,
+        const CancelToken* cancel)
+    {
+        auto corpus = current_corpus();
+        auto costs = get_cost_profile(profile);
+        return index_results(*corpus, search(*corpus, *costs, encode_target(target), num_results, session, cancel));
+    }
+
+    std::vector<std::tuple<int, double>> weighted_damerau_levenshtein_indices_multithread(
+        const Target& target,
+        int num_results,
+        SearchSession* session,
+        const std::string& profile,
+        const CancelToken* cancel)
+    {
+        auto corpus = current_corpus();
+        auto costs = get_cost_profile(profile);
+        return index_results(*corpus, search_multithread(*corpus, *costs, encode_target(target), num_results, session, cancel));
+    }
+
+    std::vector<std::vector<std::tuple<int, double>>> weighted_damerau_levenshtein_indices_batch(
+        const std::vector<Target>& targets,
+        int num_results,
+        const std::vector<SearchSession*>& sessions,
+        const std::string& profile,
+        const CancelToken* cancel)
+    {
+        auto corpus = current_corpus();
+        auto costs = get_cost_profile(profile);
+        return batch_results(*corpus, search_batch(*corpus, *costs, encode_targets(targets), num_results, sessions, false, cancel), &WeightDamLeven::index_results);
+    }
+
+    std::vector<std::vector<std::tuple<int, double>>> weighted_damerau_levenshtein_indices_batch_multithread(
+        const std::vector<Target>& targets,
+        int num_results,
+        const std::vector<SearchSession*>& sessions,
+        const std::string& profile,
+        const CancelToken* cancel)
+    {
+        auto corpus = current_corpus();
+        auto costs = get_cost_profile(profile);
+        return batch_results(*corpus, search_batch(*corpus, *costs, encode_targets(targets), num_results, sessions, true, cancel), &WeightDamLeven::index_results);
+    }
+
+    std::vector<std::tuple<std::string, double>> weighted_damerau_levenshtein_words(
+        const Target& target,
+        int num_results,
+        SearchSession* session,
+        const std::string& profile,
+        const CancelToken* cancel)
+    {
+        auto corpus = current_corpus();
+        auto costs = get_cost_profile(profile);
+        return word_results(*corpus, search(*corpus, *costs, encode_target(target), num_results, session, cancel));
+    }
+
+    std::vector<std::tuple<std::string, double>> weighted_damerau_levenshtein_words_multithread(
+        const Target& target,
+        int num_results,
+        SearchSession* session,
+        const std::string& profile,
+        const CancelToken* cancel)
+    {
+        auto corpus = current_corpus();
+        auto costs = get_cost_profile(profile);
+        return word_results(*corpus, search_multithread(*corpus, *costs, encode_target(target), num_results, session, cancel));
+    }
+
+    std::vector<std::vector<std::tuple<std::string, double>>> weighted_damerau_levenshtein_words_batch(
+        const std::vector<Target>& targets,
+        int num_results,
+        const std::vector<SearchSession*>& sessions,
+        const std::string& profile,
+        const CancelToken* cancel)
+    {
+        auto corpus = current_corpus();
+        auto costs = get_cost_profile(profile);
+        return batch_results(*corpus, search_batch(*corpus, *costs, encode_targets(targets), num_results, sessions, false, cancel), &WeightDamLeven::word_results);
+    }
+
+    std::vector<std::vector<std::tuple<std::string, double>>> weighted_damerau_levenshtein_words_batch_multithread(
+        const std::vector<Target>& targets,
+        int num_results,
+        const std::vector<SearchSession*>& sessions,
+        const std::string& profile,
+        const CancelToken* cancel)
+    {
+        auto corpus = current_corpus();
+        auto costs = get_cost_profile(profile);
+        return batch_results(*corpus, search_batch(*corpus, *costs, encode_targets(targets), num_results, sessions, true, cancel), &WeightDamLeven::word_results);
+    }
+
+    std::vector<std::tuple<int, double>> weighted_damerau_levenshtein_indices_within(
+        const Target& target,
+        double max_cost,
+        int limit,
+        const std::string& profile,
+        const CancelToken* cancel)
+    {
+        auto corpus = current_corpus();
+        auto costs = get_cost_profile(profile);
+        return index_results(*corpus, search_within(*corpus, *costs, encode_target(target), max_cost, limit, false, cancel));
+    }
+
+    std::vector<std::tuple<int, double>> weighted_damerau_levenshtein_indices_within_multithread(
+        const Target& target,
+        double max_cost,
+        int limit,
+        const std::string& profile,
+        const CancelToken* cancel)
+    {
+        auto corpus = current_corpus();
+        auto costs = get_cost_profile(profile);
+        return index_results(*corpus, search_within(*corpus, *costs, encode_target(target), max_cost, limit, true, cancel));
+    }
+
+    std::vector<std::tuple<std::string, double>> weighted_damerau_levenshtein_words_within(
+        const Target& target,
+        double max_cost,
+        int limit,
+        const std::string& profile,
+        const CancelToken* cancel)
+    {
+        auto corpus = current_corpus();
+        auto costs = get_cost_profile(profile);
+        return word_results(*corpus, search_within(*corpus, *costs, encode_target(target), max_cost, limit, false, cancel));
+    }
+
+    std::vector<std::tuple<std::string, double>> weighted_damerau_levenshtein_words_within_multithread(
+        const Target& target,
+        double max_cost,
+        int limit,
+        const std::string& profile,
+        const CancelToken* cancel)
     {
-        return weighted_damerau_levenshtein_multithread(target_word_int, 1)[0];
+        auto corpus = current_corpus();
+        auto costs = get_cost_profile(profile);
+        return word_results(*corpus, search_within(*corpus, *costs, encode_target(target), max_cost, limit, true, cancel));
     }
 };
 
 PYBIND11_MODULE(weightdamleven, m)
 {
+    py::enum_<SearchMode>(m, "SearchMode")
+        .value("SCAN", SearchMode::SCAN)
+        .value("TRIE", SearchMode::TRIE);
+
+    py::enum_<KernelMode>(m, "KernelMode")
+        .value("SCALAR", KernelMode::SCALAR)
+        .value("SIMD", KernelMode::SIMD)
+        .value("SIMD_FLOAT32", KernelMode::SIMD_FLOAT32)
+        .value("SIMD_FIXED_POINT", KernelMode::SIMD_FIXED_POINT);
+
+    py::class_<SearchSession>(m, "SearchSession")
+        .def(py::init<>(),
+            "Per-user search state for as-you-type queries, pass it to the _indices/_words searches.")
+        .def("reset",
+            &SearchSession::reset,
+            "Forget the previous query.")
+        .def("get_stats",
+            &SearchSession::get_stats,
+            "(repeated queries answered from the session, incremental searches, full searches).");
+
+    py::class_<CancelToken>(m, "CancelToken")
+        .def(py::init<>(),
+            "Pass it to the _indices/_words searches, cancel() makes them raise SearchCancelled.")
+        .def("cancel",
+            &CancelToken::cancel,
+            "Stop the searches using this token at their next chunk, from any thread.")
+        .def("is_cancelled",
+            &CancelToken::is_cancelled);
+
+    py::register_exception<SearchCancelled>(m, "SearchCancelled");
+
+    py::class_<Corpus, std::shared_ptr<Corpus>>(m, "Corpus")
+        .def(py::init<
+                const std::vector<std::vector<int>>&,
+                const std::vector<std::string>&>(),
+            "The encoded words (and optionally the original words), shared by any number of WeightDamLevens.",
+            py::arg("keys_encoded"),
+            py::arg("words") = std::vector<std::string>())
+        .def(py::init<
+                py::buffer,
+                py::buffer,
+                const std::vector<std::string>&,
+                std::optional<py::buffer>>(),
+            "Zero-copy constructor from flat buffers (e.g. NumPy arrays): uint16 keys_codes, int64 keys_offsets, "
+            "optional uint8 words_utf8 of newline-terminated words.",
+            py::arg("keys_codes"),
+            py::arg("keys_offsets"),
+            py::arg("words") = std::vector<std::string>(),
+            py::arg("words_utf8") = py::none())
+        .def("update_words",
+            &Corpus::update_words,
+            "Remove removed_words, then add keys_encoded (with their words if the corpus has words), as one new corpus version. "
+            "Searches already running finish on the previous version. Returns (words added, words removed).",
+            py::arg("keys_encoded"),
+            py::arg("words") = std::vector<std::string>(),
+            py::arg("removed_words") = std::vector<std::string>(),
+            py::call_guard<py::gil_scoped_release>())
+        .def("add_words",
+            &Corpus::add_words,
+            "Add words that aren't in the corpus yet, returns how many were added. New words get the next free indices.",
+            py::arg("keys_encoded"),
+            py::arg("words") = std::vector<std::string>(),
+            py::call_guard<py::gil_scoped_release>())
+        .def("remove_words",
+            &Corpus::remove_words,
+            "Remove words by their original text, returns how many were removed. Indices of the other words don't change until compaction.",
+            py::arg("words"),
+            py::call_guard<py::gil_scoped_release>())
+        .def("compact",
+            &Corpus::compact,
+            "Drop removed words and renumber the corpus by length and codes. Updates compact on their own once enough words changed.",
+            py::call_guard<py::gil_scoped_release>())
+        .def("get_version",
+            &Corpus::get_version,
+            "Id of the current corpus version, it changes with every update and compaction.")
+        .def("get_word_count",
+            &Corpus::get_word_count,
+            "Number of words in the corpus, removed words excluded.")
+        .def("get_word",
+            &Corpus::get_word,
+            "The original word at a corpus index (needs the words constructor argument).",
+            py::arg("index"));
+
+    py::class_<CostTable, std::shared_ptr<CostTable>>(m, "CostTable")
+        .def(py::init<const std::vector<std::vector<double>>&>(),
+            "Square replace cost table, cost_matrix[code1][code2] = the cost to turn code1 into code2.",
+            py::arg("cost_matrix"))
+        .def(py::init<py::buffer>(),
+            "Zero-copy constructor from a square float64 buffer (e.g. a NumPy array).",
+            py::arg("cost_table"))
+        .def("size",
+            &CostTable::size,
+            "Number of codes the table covers.");
+
+    py::class_<CharTable, std::shared_ptr<CharTable>>(m, "CharTable")
+        .def(py::init<
+                const std::vector<std::string>&,
+                const std::map<std::string, std::string>&,
+                const std::string&>(),
+            "Encodes query text like the corpus: chars[code] is the character encoded as code, folding maps characters to the ones "
+            "they're searched as (e.g. long vowels to short ones), characters that aren't in chars get the code of unknown_char.",
+            py::arg("chars"),
+            py::arg("folding") = std::map<std::string, std::string>(),
+            py::arg("unknown_char") = std::string(" "))
+        .def("encode",
+            &CharTable::encode,
+            "Fold, strip surrounding whitespace and encode text.",
+            py::arg("text"))
+        .def("normalize",
+            &CharTable::normalize,
+            "The folded and stripped text, the same for every text that encodes the same.",
+            py::arg("text"))
+        .def("size",
+            &CharTable::size,
+            "Number of characters with a code.");
+
+    py::class_<DeletionIndex, std::shared_ptr<DeletionIndex>>(m, "DeletionIndex")
+        .def(py::init<py::buffer>(),
+            "Zero-copy constructor from what to_bytes() returned (e.g. a NumPy uint8 view of a mapped file), "
+            "attach it with WeightDamLeven.set_deletion_index().",
+            py::arg("data"))
+        .def("to_bytes",
+            &DeletionIndex::to_bytes,
+            "The index as bytes, to save it and skip building it on the next start.")
+        .def("get_radius",
+            &DeletionIndex::radius,
+            "Deletions indexed per word, lower than max_radius if max_bytes didn't allow more, -1 if not even 0 fit.")
+        .def("get_entry_count",
+            &DeletionIndex::entry_count,
+            "Indexed (hash, word) pairs, 12 bytes each.");
+
     py::class_<WeightDamLeven>(m, "WeightDamLeven")
+        .def(py::init<std::shared_ptr<Corpus>, int>(),
+            "Search a shared Corpus, with the cost profiles added by set_cost_profile().",
+            py::arg("corpus"),
+            py::arg("thread_count") = 0)
         .def(py::init<
                 std::vector<std::vector<int>>&,
                 std::vector<std::vector<double>>&,
@@ -318,8 +4110,10 @@ PYBIND11_MODULE(weightdamleven, m)
                 double,
                 double,
                 double,
-                double>(),
-            "Constructor.",
+                double,
+                int,
+                const std::vector<std::string>&>(),
+            "Constructor, with its own corpus and the cost profile \"default\".",
             py::arg("keys_encoded"),
             py::arg("cost_matrix"),
             py::arg("is_key_cost"),
@@ -327,24 +4121,305 @@ PYBIND11_MODULE(weightdamleven, m)
             py::arg("insert_cost"),
             py::arg("append_cost"),
             py::arg("delete_cost"),
+            py::arg("transpose_cost"),
+            py::arg("thread_count") = 0,
+            py::arg("words") = std::vector<std::string>())
+        .def(py::init<
+                py::buffer,
+                py::buffer,
+                py::buffer,
+                bool,
+                double,
+                double,
+                double,
+                double,
+                double,
+                int,
+                const std::vector<std::string>&,
+                std::optional<py::buffer>>(),
+            "Zero-copy constructor from flat buffers (e.g. NumPy arrays): uint16 keys_codes, int64 keys_offsets, square float64 cost_table, "
+            "optional uint8 words_utf8 of newline-terminated words. Has its own corpus and the cost profile \"default\".",
+            py::arg("keys_codes"),
+            py::arg("keys_offsets"),
+            py::arg("cost_table"),
+            py::arg("is_key_cost"),
+            py::arg("replace_cost"),
+            py::arg("insert_cost"),
+            py::arg("append_cost"),
+            py::arg("delete_cost"),
+            py::arg("transpose_cost"),
+            py::arg("thread_count") = 0,
+            py::arg("words") = std::vector<std::string>(),
+            py::arg("words_utf8") = py::none())
+        .def("set_cost_profile",
+            &WeightDamLeven::set_cost_profile,
+            "Add or replace a named set of edit costs, chosen per search by the profile argument.",
+            py::arg("name"),
+            py::arg("cost_table"),
+            py::arg("is_key_cost"),
+            py::arg("replace_cost"),
+            py::arg("insert_cost"),
+            py::arg("append_cost"),
+            py::arg("delete_cost"),
             py::arg("transpose_cost"))
+        .def("get_cost_profile_names",
+            &WeightDamLeven::get_cost_profile_names,
+            "Names of the cost profiles, sorted.")
+        .def("get_corpus",
+            &WeightDamLeven::get_corpus,
+            "The Corpus this engine searches, updates to it are seen by every engine that shares it.")
+        .def("get_word_count",
+            &WeightDamLeven::get_word_count,
+            "Number of words in the corpus, removed words excluded.")
+        .def("get_word",
+            &WeightDamLeven::get_word,
+            "The original word at a corpus index (needs the words constructor argument).",
+            py::arg("index"))
+        .def("update_words",
+            &WeightDamLeven::update_words,
+            "Remove removed_words, then add keys_encoded (with their words if the corpus has words), as one new corpus version. "
+            "Searches already running finish on the previous version. Returns (words added, words removed).",
+            py::arg("keys_encoded"),
+            py::arg("words") = std::vector<std::string>(),
+            py::arg("removed_words") = std::vector<std::string>(),
+            py::call_guard<py::gil_scoped_release>())
+        .def("add_words",
+            &WeightDamLeven::add_words,
+            "Add words that aren't in the corpus yet, returns how many were added. New words get the next free indices.",
+            py::arg("keys_encoded"),
+            py::arg("words") = std::vector<std::string>(),
+            py::call_guard<py::gil_scoped_release>())
+        .def("remove_words",
+            &WeightDamLeven::remove_words,
+            "Remove words by their original text, returns how many were removed. Indices of the other words don't change until compaction.",
+            py::arg("words"),
+            py::call_guard<py::gil_scoped_release>())
+        .def("compact",
+            &WeightDamLeven::compact,
+            "Drop removed words and renumber the corpus by length and codes. Updates compact on their own once enough words changed.",
+            py::call_guard<py::gil_scoped_release>())
+        .def("get_corpus_version",
+            &WeightDamLeven::get_corpus_version,
+            "Id of the current corpus version, it changes with every update and compaction.")
+        .def("set_search_mode",
+            &WeightDamLeven::set_search_mode,
+            "Switch between scanning every word and walking a prefix trie (built on first use). Results are the same.",
+            py::arg("search_mode"),
+            py::call_guard<py::gil_scoped_release>())
+        .def("get_search_mode",
+            &WeightDamLeven::get_search_mode,
+            "The current SearchMode.")
+        .def("set_kernel_mode",
+            &WeightDamLeven::set_kernel_mode,
+            "Choose the scan scoring kernel. Results are the same, float32/fixed point only filter before exact rescoring.",
+            py::arg("kernel_mode"))
+        .def("get_kernel_mode",
+            &WeightDamLeven::get_kernel_mode,
+            "The current KernelMode.")
+        .def("set_char_table",
+            &WeightDamLeven::set_char_table,
+            "Let every search take the query text (str) in place of target_word_int, encoded by char_table without the GIL.",
+            py::arg("char_table"))
+        .def("get_char_table",
+            &WeightDamLeven::get_char_table,
+            "The CharTable set by set_char_table().")
+        .def("encode",
+            &WeightDamLeven::encode,
+            "What a search encodes text to.",
+            py::arg("text"))
+        .def("get_thread_count",
+            &WeightDamLeven::get_thread_count,
+            "Number of threads in the worker pool used by the multithreaded searches.")
+        .def("build_deletion_index",
+            &WeightDamLeven::build_deletion_index,
+            "Index every string left after deleting up to max_radius codes from each word, within max_bytes. Codes whose replace cost in "
+            "the profile's table is below fold_cost (e.g. case changes) are indexed as one code. Top-k and within searches then rescore "
+            "the words sharing such a string with the target first, and only scan when that can't prove the results. Compaction "
+            "rebuilds it.",
+            py::arg("max_radius") = 2,
+            py::arg("max_bytes") = (int64_t)256 << 20,
+            py::arg("fold_cost") = 0.0,
+            py::arg("profile") = std::string(WeightDamLeven::DEFAULT_COST_PROFILE),
+            py::call_guard<py::gil_scoped_release>())
+        .def("set_deletion_index",
+            &WeightDamLeven::set_deletion_index,
+            "Attach a saved DeletionIndex, it must have been built from the current corpus version.",
+            py::arg("deletion_index"),
+            py::call_guard<py::gil_scoped_release>())
+        .def("get_deletion_index",
+            &WeightDamLeven::get_deletion_index,
+            "The DeletionIndex of the current corpus version, None without one.")
+        .def("get_search_stats",
+            &WeightDamLeven::get_search_stats,
+            "(searches that scanned or walked the trie, searches answered by the prefix index, searches answered by the deletion index, "
+            "words scored, DP rows computed) "
+            "since the engine was built or reset_search_stats(). A DP row is one target character of a scanned word, "
+            "or one trie node.")
+        .def("reset_search_stats",
+            &WeightDamLeven::reset_search_stats)
         .def("weighted_damerau_levenshtein",
             &WeightDamLeven::weighted_damerau_levenshtein,
             "Normal Search.",
             py::arg("target_word_int"),
-            py::arg("num_results"))
+            py::arg("num_results"),
+            py::arg("profile") = std::string(WeightDamLeven::DEFAULT_COST_PROFILE),
+            py::call_guard<py::gil_scoped_release>())
         .def("weighted_damerau_levenshtein_multithread",
             &WeightDamLeven::weighted_damerau_levenshtein_multithread,
             "Multithreaded Search.",
             py::arg("target_word_int"),
-            py::arg("num_results"))
+            py::arg("num_results"),
+            py::arg("profile") = std::string(WeightDamLeven::DEFAULT_COST_PROFILE),
+            py::call_guard<py::gil_scoped_release>())
+        .def("weighted_damerau_levenshtein_batch",
+            &WeightDamLeven::weighted_damerau_levenshtein_batch,
+            "Search for several queries in one pass over the words.",
+            py::arg("target_words_int"),
+            py::arg("num_results"),
+            py::arg("profile") = std::string(WeightDamLeven::DEFAULT_COST_PROFILE),
+            py::call_guard<py::gil_scoped_release>())
+        .def("weighted_damerau_levenshtein_batch_multithread",
+            &WeightDamLeven::weighted_damerau_levenshtein_batch_multithread,
+            "Multithreaded search for several queries in one pass over the words.",
+            py::arg("target_words_int"),
+            py::arg("num_results"),
+            py::arg("profile") = std::string(WeightDamLeven::DEFAULT_COST_PROFILE),
+            py::call_guard<py::gil_scoped_release>())
         .def("weighted_damerau_levenshtein_single",
             &WeightDamLeven::weighted_damerau_levenshtein_single,
             "Find the single best match.",
-            py::arg("target_word_int"))
+            py::arg("target_word_int"),
+            py::arg("profile") = std::string(WeightDamLeven::DEFAULT_COST_PROFILE),
+            py::call_guard<py::gil_scoped_release>())
         .def("weighted_damerau_levenshtein_single_multithread",
             &WeightDamLeven::weighted_damerau_levenshtein_single_multithread,
             "Multithreaded single best match.",
-            py::arg("target_word_int"))
+            py::arg("target_word_int"),
+            py::arg("profile") = std::string(WeightDamLeven::DEFAULT_COST_PROFILE),
+            py::call_guard<py::gil_scoped_release>())
+        .def("weighted_damerau_levenshtein_indices",
+            &WeightDamLeven::weighted_damerau_levenshtein_indices,
+            "Search returning (corpus indices, score), ordered by score then lexically.",
+            py::arg("target_word_int"),
+            py::arg("num_results"),
+            py::arg("session") = static_cast<SearchSession*>(nullptr),
+            py::arg("profile") = std::string(WeightDamLeven::DEFAULT_COST_PROFILE),
+            py::arg("cancel") = static_cast<CancelToken*>(nullptr),
+            py::call_guard<py::gil_scoped_release>())
+        .def("weighted_damerau_levenshtein_indices_multithread",
+            &WeightDamLeven::weighted_damerau_levenshtein_indices_multithread,
+            "Multithreaded search returning (corpus indices, score), ordered by score then lexically.",
+            py::arg("target_word_int"),
+            py::arg("num_results"),
+            py::arg("session") = static_cast<SearchSession*>(nullptr),
+            py::arg("profile") = std::string(WeightDamLeven::DEFAULT_COST_PROFILE),
+            py::arg("cancel") = static_cast<CancelToken*>(nullptr),
+            py::call_guard<py::gil_scoped_release>())
+        .def("weighted_damerau_levenshtein_indices_batch",
+            &WeightDamLeven::weighted_damerau_levenshtein_indices_batch,
+            "Batched search returning (corpus indices, score), ordered by score then lexically.",
+            py::arg("target_words_int"),
+            py::arg("num_results"),
+            py::arg("sessions") = std::vector<SearchSession*>(),
+            py::arg("profile") = std::string(WeightDamLeven::DEFAULT_COST_PROFILE),
+            py::arg("cancel") = static_cast<CancelToken*>(nullptr),
+            py::call_guard<py::gil_scoped_release>())
+        .def("weighted_damerau_levenshtein_indices_batch_multithread",
+            &WeightDamLeven::weighted_damerau_levenshtein_indices_batch_multithread,
+            "Multithreaded batched search returning (corpus indices, score), ordered by score then lexically.",
+            py::arg("target_words_int"),
+            py::arg("num_results"),
+            py::arg("sessions") = std::vector<SearchSession*>(),
+            py::arg("profile") = std::string(WeightDamLeven::DEFAULT_COST_PROFILE),
+            py::arg("cancel") = static_cast<CancelToken*>(nullptr),
+            py::call_guard<py::gil_scoped_release>())
+        .def("weighted_damerau_levenshtein_words",
+            &WeightDamLeven::weighted_damerau_levenshtein_words,
+            "Search returning (original words, score), ordered by score then lexically.",
+            py::arg("target_word_int"),
+            py::arg("num_results"),
+            py::arg("session") = static_cast<SearchSession*>(nullptr),
+            py::arg("profile") = std::string(WeightDamLeven::DEFAULT_COST_PROFILE),
+            py::arg("cancel") = static_cast<CancelToken*>(nullptr),
+            py::call_guard<py::gil_scoped_release>())
+        .def("weighted_damerau_levenshtein_words_multithread",
+            &WeightDamLeven::weighted_damerau_levenshtein_words_multithread,
+            "Multithreaded search returning (original words, score), ordered by score then lexically.",
+            py::arg("target_word_int"),
+            py::arg("num_results"),
+            py::arg("session") = static_cast<SearchSession*>(nullptr),
+            py::arg("profile") = std::string(WeightDamLeven::DEFAULT_COST_PROFILE),
+            py::arg("cancel") = static_cast<CancelToken*>(nullptr),
+            py::call_guard<py::gil_scoped_release>())
+        .def("weighted_damerau_levenshtein_words_batch",
+            &WeightDamLeven::weighted_damerau_levenshtein_words_batch,
+            "Batched search returning (original words, score), ordered by score then lexically.",
+            py::arg("target_words_int"),
+            py::arg("num_results"),
+            py::arg("sessions") = std::vector<SearchSession*>(),
+            py::arg("profile") = std::string(WeightDamLeven::DEFAULT_COST_PROFILE),
+            py::arg("cancel") = static_cast<CancelToken*>(nullptr),
+            py::call_guard<py::gil_scoped_release>())
+        .def("weighted_damerau_levenshtein_words_batch_multithread",
+            &WeightDamLeven::weighted_damerau_levenshtein_words_batch_multithread,
+            "Multithreaded batched search returning (original words, score), ordered by score then lexically.",
+            py::arg("target_words_int"),
+            py::arg("num_results"),
+            py::arg("sessions") = std::vector<SearchSession*>(),
+            py::arg("profile") = std::string(WeightDamLeven::DEFAULT_COST_PROFILE),
+            py::arg("cancel") = static_cast<CancelToken*>(nullptr),
+            py::call_guard<py::gil_scoped_release>())
+        .def("weighted_damerau_levenshtein_within",
+            &WeightDamLeven::weighted_damerau_levenshtein_within,
+            "Every word within max_cost as (encoded ints, score), at most limit of them if limit > 0, ordered by score then lexically.",
+            py::arg("target_word_int"),
+            py::arg("max_cost"),
+            py::arg("limit") = 0,
+            py::arg("profile") = std::string(WeightDamLeven::DEFAULT_COST_PROFILE),
+            py::call_guard<py::gil_scoped_release>())
+        .def("weighted_damerau_levenshtein_within_multithread",
+            &WeightDamLeven::weighted_damerau_levenshtein_within_multithread,
+            "Multithreaded search for every word within max_cost as (encoded ints, score).",
+            py::arg("target_word_int"),
+            py::arg("max_cost"),
+            py::arg("limit") = 0,
+            py::arg("profile") = std::string(WeightDamLeven::DEFAULT_COST_PROFILE),
+            py::call_guard<py::gil_scoped_release>())
+        .def("weighted_damerau_levenshtein_indices_within",
+            &WeightDamLeven::weighted_damerau_levenshtein_indices_within,
+            "Every word within max_cost as (corpus indices, score), at most limit of them if limit > 0, ordered by score then lexically.",
+            py::arg("target_word_int"),
+            py::arg("max_cost"),
+            py::arg("limit") = 0,
+            py::arg("profile") = std::string(WeightDamLeven::DEFAULT_COST_PROFILE),
+            py::arg("cancel") = static_cast<CancelToken*>(nullptr),
+            py::call_guard<py::gil_scoped_release>())
+        .def("weighted_damerau_levenshtein_indices_within_multithread",
+            &WeightDamLeven::weighted_damerau_levenshtein_indices_within_multithread,
+            "Multithreaded search for every word within max_cost as (corpus indices, score).",
+            py::arg("target_word_int"),
+            py::arg("max_cost"),
+            py::arg("limit") = 0,
+            py::arg("profile") = std::string(WeightDamLeven::DEFAULT_COST_PROFILE),
+            py::arg("cancel") = static_cast<CancelToken*>(nullptr),
+            py::call_guard<py::gil_scoped_release>())
+        .def("weighted_damerau_levenshtein_words_within",
+            &WeightDamLeven::weighted_damerau_levenshtein_words_within,
+            "Every word within max_cost as (original words, score), at most limit of them if limit > 0, ordered by score then lexically.",
+            py::arg("target_word_int"),
+            py::arg("max_cost"),
+            py::arg("limit") = 0,
+            py::arg("profile") = std::string(WeightDamLeven::DEFAULT_COST_PROFILE),
+            py::arg("cancel") = static_cast<CancelToken*>(nullptr),
+            py::call_guard<py::gil_scoped_release>())
+        .def("weighted_damerau_levenshtein_words_within_multithread",
+            &WeightDamLeven::weighted_damerau_levenshtein_words_within_multithread,
+            "Multithreaded search for every word within max_cost as (original words, score).",
+            py::arg("target_word_int"),
+            py::arg("max_cost"),
+            py::arg("limit") = 0,
+            py::arg("profile") = std::string(WeightDamLeven::DEFAULT_COST_PROFILE),
+            py::arg("cancel") = static_cast<CancelToken*>(nullptr),
+            py::call_guard<py::gil_scoped_release>())
         .doc() = "WeightDamLeven is used to find close string matches.";
 }
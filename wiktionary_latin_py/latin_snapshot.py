@@ -0,0 +1,221 @@
+import os
+import pathlib
+import glob
+import hashlib
+import mmap
+import struct
+import numpy as np
+
+
+class LatinSnapshot:
+    """
+    The precomputed Latin search state in one binary file that is loaded by mmap:
+    the words, their uint16 codes and int64 offsets, the char map and the cost table.
+    The arrays are read-only views into the mapping, so every WeightDamLeven built from them shares the same pages.
+
+    Layout (little-endian): a header, then one section per entry of SECTIONS, each aligned to ALIGNMENT bytes.
+    header = MAGIC, VERSION, section count, cost table size, source key, then (offset, byte count) per section.
+    Bump VERSION whenever the layout or the meaning of a section changes.
+    """
+    MAGIC = b'LATSNAP\0'
+    VERSION = 1
+    ALIGNMENT = 64
+    # name -> dtype, words_utf8 and chars_utf8 hold newline-terminated UTF-8 strings
+    SECTIONS = {
+        'words_utf8': np.uint8,
+        'codes': np.uint16,
+        'offsets': np.int64,
+        'chars_utf8': np.uint8,
+        'cost_matrix': np.float64,
+    }
+    HEADER = struct.Struct('<8sIII32s')
+    SECTION = struct.Struct('<QQ')
+
+    def __init__(self, mapping: mmap.mmap, arrays: dict[str, np.ndarray]):
+        self._mapping = mapping  # the arrays point into the mapping, which stays open as long as they do
+        self._arrays = arrays
+
+    def get_words(self) -> list[str]:
+        return self._arrays['words_utf8'].tobytes().decode('utf-8').split('\n')[:-1]
+
+    def get_words_utf8(self) -> np.ndarray:
+        return self._arrays['words_utf8']
+
+    def get_codes(self) -> np.ndarray:
+        return self._arrays['codes']
+
+    def get_offsets(self) -> np.ndarray:
+        return self._arrays['offsets']
+
+    def get_chars(self) -> list[str]:
+        """ chars[code] is the character encoded as code. """
+        return self._arrays['chars_utf8'].tobytes().decode('utf-8').split('\n')[:-1]
+
+    def get_cost_matrix(self) -> np.ndarray:
+        return self._arrays['cost_matrix']
+
+    @classmethod
+    def calc_source_key(cls, latin_words_path: str, cost_key: bytes) -> bytes:
+        """ A snapshot belongs to one latin_words.txt and one cost setup (cost_key). """
+        digest = hashlib.sha256()
+        digest.update(struct.pack('<I', cls.VERSION))
+        digest.update(cost_key)
+        with open(latin_words_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024**2), b''):
+                digest.update(block)
+        return digest.digest()
+
+    @classmethod
+    def get_path(cls, latin_words_path: str, source_key: bytes) -> str:
+        """ Snapshots are named by their key, so a new one never overwrites a file that may still be mapped. """
+        stem = os.path.splitext(latin_words_path)[0]
+        return f"{stem}.{source_key.hex()[:16]}.snapshot"
+
+    @classmethod
+    def write(cls,
+              path: str,
+              source_key: bytes,
+              words: list[str],
+              codes: np.ndarray,
+              offsets: np.ndarray,
+              chars: list[str],
+              cost_matrix: np.ndarray) -> None:
+        arrays = {
+            'words_utf8': np.frombuffer(''.join(word + '\n' for word in words).encode('utf-8'), dtype=np.uint8),
+            'codes': codes,
+            'offsets': offsets,
+            'chars_utf8': np.frombuffer(''.join(char + '\n' for char in chars).encode('utf-8'), dtype=np.uint8),
+            'cost_matrix': cost_matrix,
+        }
+        sections = []
+        position = cls.HEADER.size + cls.SECTION.size * len(cls.SECTIONS)
+        for name, dtype in cls.SECTIONS.items():
+            data = np.ascontiguousarray(arrays[name], dtype=np.dtype(dtype).newbyteorder('<')).tobytes()
+            position += -position % cls.ALIGNMENT
+            sections.append((position, data))
+            position += len(data)
+
+        # write to a temporary file first, so a crash never leaves a truncated snapshot behind
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(cls.HEADER.pack(cls.MAGIC, cls.VERSION, len(cls.SECTIONS), cost_matrix.shape[0], source_key))
+            for offset, data in sections:
+                f.write(cls.SECTION.pack(offset, len(data)))
+            for offset, data in sections:
+                f.write(b'\0' * (offset - f.tell()))
+                f.write(data)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str, source_key: bytes) -> 'LatinSnapshot | None':
+        """
+        Map a snapshot, None if it's missing, from another VERSION, built from a different source
+        or damaged, so that the caller builds it again.
+        """
+        if not pathlib.Path(path).is_file():
+            return None
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < cls.HEADER.size + cls.SECTION.size * len(cls.SECTIONS):
+                return None
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, section_count, cost_matrix_size, key = cls.HEADER.unpack_from(mapping, 0)
+        if magic != cls.MAGIC or version != cls.VERSION or section_count != len(cls.SECTIONS) or key != source_key:
+            mapping.close()
+            return None
+
+        arrays = cls.map_arrays(mapping, cost_matrix_size)
+        if arrays is None:
+            mapping.close()  # no views into it are left
+            return None
+        return cls(mapping, arrays)
+
+    @classmethod
+    def map_arrays(cls, mapping: mmap.mmap, cost_matrix_size: int) -> dict[str, np.ndarray] | None:
+        """ The sections as arrays, None unless every one lies within the file and they agree with each other. """
+        arrays = {}
+        for i, (name, dtype) in enumerate(cls.SECTIONS.items()):
+            offset, byte_count = cls.SECTION.unpack_from(mapping, cls.HEADER.size + i * cls.SECTION.size)
+            dtype = np.dtype(dtype).newbyteorder('<')
+            if offset % cls.ALIGNMENT or byte_count % dtype.itemsize or offset + byte_count > len(mapping):
+                return None
+            arrays[name] = np.frombuffer(mapping, dtype=dtype, count=byte_count // dtype.itemsize, offset=offset)
+        offsets = arrays['offsets']
+        words_utf8 = arrays['words_utf8']
+        if (len(arrays['cost_matrix']) != cost_matrix_size * cost_matrix_size
+                or len(offsets) < 1 or offsets[0] != 0 or offsets[-1] != len(arrays['codes'])
+                or np.any(offsets[1:] < offsets[:-1])
+                or np.count_nonzero(words_utf8 == ord('\n')) != len(offsets) - 1
+                or (len(words_utf8) > 0 and words_utf8[-1] != ord('\n'))):
+            return None
+        arrays['cost_matrix'] = arrays['cost_matrix'].reshape(cost_matrix_size, cost_matrix_size)
+        return arrays
+
+    @classmethod
+    def get_deletion_index_path(cls, snapshot_path: str, settings: tuple) -> str:
+        """ A weightdamleven.DeletionIndex saved next to the snapshot it was built from, named by its settings. """
+        settings_key = hashlib.sha256(repr(settings).encode()).hexdigest()[:16]
+        return f"{snapshot_path}.{settings_key}.deletion"
+
+    @classmethod
+    def write_deletion_index(cls, path: str, data: bytes) -> None:
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load_deletion_index(cls, path: str) -> np.ndarray | None:
+        """ A read-only uint8 view of a mapped deletion index, None if it's missing. The view keeps the mapping open. """
+        if not pathlib.Path(path).is_file() or os.path.getsize(path) == 0:
+            return None
+        with open(path, 'rb') as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return np.frombuffer(mapping, dtype=np.uint8)
+
+    @classmethod
+    def get_generation_path(cls, latin_words_path: str) -> str:
+        return f"{os.path.splitext(latin_words_path)[0]}.generation"
+
+    @classmethod
+    def publish(cls, latin_words_path: str, snapshot_path: str, source_key: bytes) -> int:
+        """
+        Make snapshot_path the generation that other processes attach to, returns its number.
+        The generation file is replaced as a whole, so a reader sees either the previous generation or this one.
+        """
+        generation = cls.read_generation(latin_words_path)
+        if generation is not None and generation[1:] == (os.path.abspath(snapshot_path), source_key):
+            return generation[0]
+        number = generation[0] + 1 if generation is not None else 1
+        path = cls.get_generation_path(latin_words_path)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(f"{number}\n{source_key.hex()}\n{os.path.basename(snapshot_path)}\n")
+        os.replace(temp_path, path)
+        return number
+
+    @classmethod
+    def read_generation(cls, latin_words_path: str) -> tuple[int, str, bytes] | None:
+        """ (number, snapshot path, source key) of the published generation, None if there's none. """
+        try:
+            with open(cls.get_generation_path(latin_words_path), 'r', encoding='utf-8') as f:
+                number, source_key, snapshot_name = f.read().split('\n')[:3]
+            snapshot_path = os.path.join(os.path.dirname(os.path.abspath(latin_words_path)), snapshot_name)
+            return int(number), snapshot_path, bytes.fromhex(source_key)
+        except (OSError, ValueError):
+            return None
+
+    @classmethod
+    def remove_stale(cls, latin_words_path: str, keep_path: str, published_path: str | None = None) -> None:
+        """
+        Remove the other snapshots and their deletion indices, except the published generation (published_path).
+        Best effort: a file that's still mapped (e.g. on Windows) is left for the next start.
+        """
+        stem = os.path.splitext(latin_words_path)[0]
+        keep_paths = [os.path.abspath(path) for path in (keep_path, published_path) if path is not None]
+        for path in glob.glob(f"{glob.escape(stem)}.*.snapshot") + glob.glob(f"{glob.escape(stem)}.*.snapshot.*.deletion"):
+            path = os.path.abspath(path)
+            if not any(path == keep or path.startswith(f"{keep}.") for keep in keep_paths):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
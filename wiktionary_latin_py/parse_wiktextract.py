@@ -5,6 +5,12 @@ import json
 import math
 import requests
 import gzip
+import zlib
+import collections
+import multiprocessing
+import queue
+import threading
+import hashlib
 from tqdm import tqdm
 
 
@@ -15,14 +21,20 @@ class WiktextractParser:
     WIKTEXTRACT_DATA_GZ = os.path.join(DIRECTORY, "database", os.path.basename(LINK))
     WIKTEXTRACT_DATA = os.path.join(DIRECTORY, "database", "raw-wiktextract-data.jsonl")
     LATIN_WORDS = os.path.join(DIRECTORY, "database", "latin_words.txt")
+    # ETag, Last-Modified and SHA-256 of the dump latin_words.txt was last parsed from
+    FETCH_METADATA = os.path.join(DIRECTORY, "database", "latin_words_source.json")
+    BLOCK_SIZE = 16 * 1024**2  # bytes of the dump handed to a worker at a time
+    # json.dumps spelling of a Latin entry, some lines with it are other languages with a Latin translation
+    LANG_CODE_LA = (b'"lang_code": "la"', b'"lang_code":"la"')
+    READ_AHEAD_CHUNKS = 64  # downloaded CHUNK_SIZE chunks waiting to be decompressed
 
     def __init__(self):
         pass
 
     @classmethod
-    def download_raw_wiktextract_data_jsonl(cls) -> bytes | None:
+    def download_raw_wiktextract_data_jsonl(cls, url: str = LINK) -> bytes | None:
         try:
-            response = requests.get(cls.LINK, stream=True)
+            response = requests.get(url, stream=True)
             response.raise_for_status() # error?
             total_size = int(response.headers.get('content-length', 0))
             progress_bar = tqdm(
@@ -58,27 +70,313 @@ class WiktextractParser:
             f_in_tell_prev = f_in_tell
             line = f_in.readline()
 
-        latin_words = list(latin_words.keys())
+        progress_bar.close()
+        return cls.save_latin_word_list(list(latin_words.keys()))
+
+    @classmethod
+    def save_latin_word_list(cls, latin_words: list[str]) -> list[str]:
         with open(cls.LATIN_WORDS, 'w', encoding="utf-8") as f_out:
             for word in latin_words:
                 f_out.write(word + '\n')
-        progress_bar.close()
         return latin_words
 
     @classmethod
-    def parse_latin_word_list_from_file(cls) -> list[str]:
+    def parse_latin_block(cls, block: bytes) -> list[str]:
+        """ The Latin words of whole lines of raw-wiktextract-data.jsonl, only lines with LANG_CODE_LA are decoded. """
+        latin_words = []
+        starts = set()
+        for pattern in cls.LANG_CODE_LA:
+            position = block.find(pattern)
+            while position >= 0:
+                start = block.rfind(b'\n', 0, position) + 1
+                end = block.find(b'\n', position)
+                end = len(block) if end < 0 else end
+                starts.add((start, end))
+                position = block.find(pattern, end)
+        for start, end in sorted(starts):
+            data = json.loads(block[start:end])
+            try:
+                if data['lang_code'] == 'la':
+                    latin_words.append(data['word'].strip())
+            except KeyError:
+                pass
+        return latin_words
+
+    @classmethod
+    def split_blocks(cls, chunks: typing.Iterable[bytes]) -> typing.Iterator[bytes]:
+        """ Regroup chunks of the dump into pieces of at least BLOCK_SIZE bytes that end at a line break. """
+        pending = []
+        pending_size = 0
+        for chunk in chunks:
+            pending.append(chunk)
+            pending_size += len(chunk)
+            if pending_size >= cls.BLOCK_SIZE:
+                block = b''.join(pending)
+                end = block.rfind(b'\n') + 1
+                pending = [block[end:]]
+                pending_size = len(pending[0])
+                if end:
+                    yield block[:end]
+        if pending_size:
+            yield b''.join(pending)
+
+    @classmethod
+    def read_blocks(cls, f_in: typing.BinaryIO) -> typing.Iterator[bytes]:
+        """ Read f_in in BLOCK_SIZE pieces that end at a line break. """
+        return cls.split_blocks(iter(lambda: f_in.read(cls.BLOCK_SIZE), b''))
+
+    @classmethod
+    def gunzip_chunks(cls, chunks: typing.Iterable[bytes]) -> typing.Iterator[bytes]:
+        """
+        Decompress a gzip stream (possibly several concatenated members) chunk by chunk.
+        Raises EOFError, as gzip.open does, if the stream ends inside a member, e.g. a truncated download.
+        """
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        in_member = False  # the decompressor has data of a member whose end it hasn't seen
+        for chunk in chunks:
+            while chunk:
+                in_member = True
+                data = decompressor.decompress(chunk)
+                if data:
+                    yield data
+                chunk = b''
+                if decompressor.eof:
+                    chunk = decompressor.unused_data
+                    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                    in_member = False
+        if in_member:
+            raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+
+    @classmethod
+    def iter_download(cls, response: requests.Response, tee_path: str | None = None) -> typing.Iterator[bytes]:
+        """
+        The body of response, read ahead on a thread so that the download overlaps with decompressing and parsing.
+        With tee_path, the raw bytes are also saved there once the whole body has arrived.
+        """
+        chunks = queue.Queue(maxsize=cls.READ_AHEAD_CHUNKS)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    chunks.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        def download():
+            try:
+                for chunk in response.iter_content(chunk_size=cls.CHUNK_SIZE):
+                    if stop.is_set():
+                        return
+                    if chunk:
+                        put(chunk)
+                put(None)
+            except Exception as e:
+                put(e)
+
+        threading.Thread(target=download, daemon=True).start()
+        temp_path = f"{tee_path}.{os.getpid()}.tmp" if tee_path else None
+        f_tee = open(temp_path, 'wb') if temp_path else None
+        completed = False
+        try:
+            while True:
+                chunk = chunks.get()
+                if chunk is None:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                if f_tee:
+                    f_tee.write(chunk)
+                yield chunk
+            completed = True
+        finally:
+            stop.set()
+            if f_tee:
+                f_tee.close()
+                if completed:
+                    os.replace(temp_path, tee_path)
+                else:
+                    os.remove(temp_path)
+
+    @classmethod
+    def parse_latin_word_list_fast(
+            cls,
+            f_in: typing.BinaryIO,
+            file_size: int,
+            tell: typing.Callable[[], int],
+            processes: int | None = None) -> list[str]:
+        """ Same result as parse_latin_word_list_helper, reading the binary dump f_in in blocks. """
+        return cls.save_latin_word_list(cls.parse_latin_blocks(cls.read_blocks(f_in), file_size, tell, processes))
+
+    @classmethod
+    def parse_latin_blocks(
+            cls,
+            blocks: typing.Iterable[bytes],
+            file_size: int,
+            tell: typing.Callable[[], int],
+            processes: int | None = None) -> list[str]:
+        """
+        Blocks of whole lines of the dump are parsed by a pool of processes, at most two blocks per process in flight,
+        and merged in order. Progress is tell() against file_size per block. processes=None means every core.
+        The workers come from a fork server, or are spawned, never forked from a caller that may have threads
+        holding locks. Either way they import __main__ again, so callers whose __main__ doesn't guard its work,
+        like the server, pass processes=1 (no pool).
+        """
+        if processes is None:
+            processes = os.cpu_count() or 1
+        latin_words = {}  # use a dict as an ordered set
+        progress_bar = tqdm(desc="Loading Latin List", total=file_size, unit='bytes')
+
+        def merge(words: list[str]):
+            for word in words:
+                latin_words[word] = None
+            progress_bar.update(tell() - progress_bar.n)
+
+        if processes == 1:
+            for block in blocks:
+                merge(cls.parse_latin_block(block))
+        else:
+            context = multiprocessing.get_context(
+                'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+            with context.Pool(processes) as pool:
+                in_flight = collections.deque()
+                for block in blocks:
+                    in_flight.append(pool.apply_async(cls.parse_latin_block, (block,)))
+                    if len(in_flight) >= 2 * processes:
+                        merge(in_flight.popleft().get())
+                while in_flight:
+                    merge(in_flight.popleft().get())
+        progress_bar.close()
+        return list(latin_words.keys())
+
+    @classmethod
+    def parse_latin_word_list_from_file(cls, fast: bool = True, processes: int | None = None) -> list[str]:
         file_size = os.path.getsize(cls.WIKTEXTRACT_DATA)
+        if fast:
+            with open(cls.WIKTEXTRACT_DATA, 'rb') as f_in:
+                return cls.parse_latin_word_list_fast(f_in, file_size, f_in.tell, processes)
         with open(cls.WIKTEXTRACT_DATA, 'r', encoding="utf-8") as f_in:
             return cls.parse_latin_word_list_helper(f_in, file_size)
 
     @classmethod
-    def parse_latin_word_list_from_url(cls) -> list[str]:
-        cls.download_raw_wiktextract_data_jsonl()
+    def load_fetch_metadata(cls) -> dict[str, str]:
+        try:
+            with open(cls.FETCH_METADATA, 'r', encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @classmethod
+    def save_fetch_metadata(cls, metadata: dict[str, str]) -> None:
+        with open(cls.FETCH_METADATA, 'w', encoding="utf-8") as f:
+            json.dump(metadata, f, indent=1)
+
+    @classmethod
+    def read_latin_word_list(cls) -> list[str]:
+        """ The current latin_words.txt, empty if there is none. """
+        try:
+            with open(cls.LATIN_WORDS, 'r', encoding="utf-8") as f:
+                return [word.strip() for word in f]
+        except FileNotFoundError:
+            return []
+
+    @classmethod
+    def stream_latin_word_list(
+            cls,
+            url: str,
+            headers: dict[str, str],
+            processes: int | None,
+            tee_path: str | None) -> tuple[list[str] | None, dict[str, str]]:
+        """
+        Decompress and parse the dump while it downloads. Returns (None, {}) if the server answers 304 Not Modified,
+        otherwise the Latin words in dump order and the metadata of this fetch.
+        """
+        response = requests.get(url, headers=headers, stream=True)
+        with response:
+            if response.status_code == 304:
+                return None, {}
+            response.raise_for_status()
+            total_size = int(response.headers.get('content-length', 0))
+            compressed_bytes = 0
+            digest = hashlib.sha256()
+
+            def count_bytes(chunks: typing.Iterable[bytes]) -> typing.Iterator[bytes]:
+                nonlocal compressed_bytes
+                for chunk in chunks:
+                    compressed_bytes += len(chunk)
+                    digest.update(chunk)
+                    yield chunk
+
+            blocks = cls.split_blocks(cls.gunzip_chunks(count_bytes(cls.iter_download(response, tee_path))))
+            latin_words = cls.parse_latin_blocks(blocks, total_size, lambda: compressed_bytes, processes)
+            metadata = {
+                'url': url,
+                'etag': response.headers.get('ETag', ''),
+                'last_modified': response.headers.get('Last-Modified', ''),
+                'sha256': digest.hexdigest(),
+            }
+        return latin_words, metadata
+
+    @classmethod
+    def parse_latin_word_list_from_url(
+            cls,
+            fast: bool = True,
+            processes: int | None = None,
+            url: str = LINK,
+            tee_path: str | None = None) -> list[str]:
+        """
+        fast: decompress and parse the dump while it downloads, progress is measured in compressed bytes,
+        and the download is only kept on disk if tee_path is given (e.g. WIKTEXTRACT_DATA_GZ).
+        Otherwise download to WIKTEXTRACT_DATA_GZ first and parse it line by line.
+        """
+        if fast:
+            latin_words, metadata = cls.stream_latin_word_list(url, {}, processes, tee_path)
+            cls.save_latin_word_list(latin_words)
+            cls.save_fetch_metadata(metadata)
+            return latin_words
+
+        cls.download_raw_wiktextract_data_jsonl(url)
         with gzip.open(cls.WIKTEXTRACT_DATA_GZ, 'rb') as f_in:
             file_size = f_in.seek(0, os.SEEK_END)
         with gzip.open(cls.WIKTEXTRACT_DATA_GZ, 'rt', encoding='utf-8') as f_in:
             return cls.parse_latin_word_list_helper(f_in, file_size)
 
+    @classmethod
+    def refresh_latin_word_list(
+            cls,
+            processes: int | None = None,
+            url: str = LINK,
+            tee_path: str | None = None,
+            loaded_words: list[str] | None = None) -> tuple[list[str], list[str], dict[str, str]] | None:
+        """
+        Refetch the dump only if it changed since the words were loaded from it: a conditional request on the
+        saved ETag/Last-Modified, and if the server sends the body anyway, a comparison of its SHA-256.
+        Returns None if nothing changed, otherwise the (added, removed) words, sorted, against loaded_words
+        (default: latin_words.txt), and the metadata of this fetch. latin_words.txt is rewritten for the reload
+        to build from, the metadata is only saved by save_fetch_metadata() once the reload has succeeded,
+        so that a failed one fetches and diffs again next time instead of being answered 304.
+        """
+        metadata = cls.load_fetch_metadata()
+        old_words = cls.read_latin_word_list() if loaded_words is None else loaded_words
+        headers = {}
+        if old_words and metadata.get('url') == url:
+            if metadata.get('etag'):
+                headers['If-None-Match'] = metadata['etag']
+            if metadata.get('last_modified'):
+                headers['If-Modified-Since'] = metadata['last_modified']
+
+        latin_words, new_metadata = cls.stream_latin_word_list(url, headers, processes, tee_path)
+        if latin_words is None:
+            return None
+        if old_words and metadata.get('url') == url and metadata.get('sha256') == new_metadata['sha256']:
+            cls.save_fetch_metadata(new_metadata)  # same bytes, possibly new validators
+            return None
+
+        old_word_set = set(old_words)
+        new_word_set = set(latin_words)
+        cls.save_latin_word_list(latin_words)
+        return sorted(new_word_set - old_word_set), sorted(old_word_set - new_word_set), new_metadata
 
 if __name__ == '__main__':
-    WiktextractParser.parse_latin_word_list_from_url()
+    WiktextractParser.parse_latin_word_list_from_url(processes=os.cpu_count())
@@ -0,0 +1,533 @@
+import os
+import sys
+import time
+import zlib
+import heapq
+import itertools
+import threading
+import subprocess
+from multiprocessing.connection import Connection, Client, Listener
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_EXCEPTION
+import numpy as np
+
+import weightdamleven
+from latin_snapshot import LatinSnapshot
+
+
+class ShardError(RuntimeError):
+    """ A shard crashed, timed out or couldn't load, the search is failed rather than answered from the other shards. """
+
+
+class ShardedSearch:
+    """
+    The front end of a corpus split across worker processes, each running its own WeightDamLeven over a contiguous
+    slice of the snapshot's sorted words. It has the search methods of WeightDamLeven that the server uses:
+    every query is sent to all shards and their top-k lists are merged by (score, word), the order in which
+    weighted_damerau_levenshtein_multithread merges its threads' heaps, so sharding never changes the results.
+
+    The workers are search_shards.py servers: local processes on a loopback port (shard_count), or servers started
+    on other hosts (addresses), which need the same snapshot file at the same path. A worker that dies is started again
+    (local) or reconnected (remote) on the next query, the word list updates applied since are replayed to it.
+    Requests are pickled, so the servers only talk to clients with their authkey: remote ones need it given here,
+    every local one gets a key of its own.
+    """
+    CANCEL_POLL_SECONDS = 0.005  # how often a waiting search looks at its CancelToken
+
+    def __init__(self,
+                 config: dict,
+                 shard_count: int = 0,
+                 addresses: list[tuple[str, int]] | None = None,
+                 authkey: bytes | None = None,
+                 timeout_seconds: float = 30.0):
+        """ config is what load_shard() needs, see make_shard_config(). """
+        addresses = addresses or []
+        count = len(addresses) or shard_count
+        if count <= 0:
+            raise ValueError("shard_count: expected at least one shard")
+        if addresses and not authkey:
+            raise ValueError("authkey: the search shard servers' shared secret is required with addresses")
+        self._timeout_seconds = timeout_seconds
+        self._error: ShardError | None = None  # set once the shards may disagree about the word list
+        self._shards = [_Shard(index, count, config, addresses[index] if addresses else None, authkey)
+                        for index in range(count)]
+        try:
+            self._wait([shard.start() for shard in self._shards], None)
+        except BaseException:
+            self.close()
+            raise
+
+    def get_shard_count(self) -> int:
+        return len(self._shards)
+
+    def weighted_damerau_levenshtein_words(self, target_word_int, num_results: int,
+                                           session: weightdamleven.SearchSession | None = None,
+                                           profile: str = 'default',
+                                           cancel: weightdamleven.CancelToken | None = None) -> list[tuple[str, float]]:
+        return self._search_top_k('weighted_damerau_levenshtein_words', target_word_int, num_results,
+                                  session, profile, cancel)
+
+    def weighted_damerau_levenshtein_words_multithread(self, target_word_int, num_results: int,
+                                                       session: weightdamleven.SearchSession | None = None,
+                                                       profile: str = 'default',
+                                                       cancel: weightdamleven.CancelToken | None = None) -> list[tuple[str, float]]:
+        return self._search_top_k('weighted_damerau_levenshtein_words_multithread', target_word_int, num_results,
+                                  session, profile, cancel)
+
+    def weighted_damerau_levenshtein_words_within(self, target_word_int, max_cost: float, limit: int = 0,
+                                                  profile: str = 'default',
+                                                  cancel: weightdamleven.CancelToken | None = None) -> list[tuple[str, float]]:
+        return self._search_within('weighted_damerau_levenshtein_words_within', target_word_int, max_cost, limit,
+                                   profile, cancel)
+
+    def weighted_damerau_levenshtein_words_within_multithread(self, target_word_int, max_cost: float, limit: int = 0,
+                                                              profile: str = 'default',
+                                                              cancel: weightdamleven.CancelToken | None = None) -> list[tuple[str, float]]:
+        return self._search_within('weighted_damerau_levenshtein_words_within_multithread', target_word_int, max_cost,
+                                   limit, profile, cancel)
+
+    def update_words(self,
+                     keys_encoded: list[list[int]],
+                     words: list[str],
+                     removed_words: list[str]) -> tuple[int, int]:
+        """
+        Like WeightDamLeven.update_words(), returns (words added, words removed).
+        An added word goes to one shard picked by its hash, so words must not be in the corpus yet,
+        removed words are sent to every shard and removed wherever they are.
+        If a shard fails to apply its part, the others keep theirs, so every later call raises ShardError:
+        build a new ShardedSearch.
+        """
+        self._check()
+        added_by_shard = [([], []) for _ in self._shards]
+        for word_encoded, word in zip(keys_encoded, words):
+            shard_keys, shard_words = added_by_shard[zlib.crc32(word.encode('utf-8')) % len(self._shards)]
+            shard_keys.append(word_encoded)
+            shard_words.append(word)
+        futures = []
+        try:
+            for shard, (shard_keys, shard_words) in zip(self._shards, added_by_shard):
+                futures.append(shard.update(shard_keys, shard_words, removed_words))
+            wait(futures, timeout=self._timeout_seconds)
+            counts = [future.result(timeout=0) for future in futures]
+        except Exception as e:
+            self._error = ShardError(f"a word list update reached only some search shards: {e}")
+            raise self._error from e
+        return sum(added for added, _ in counts), sum(removed for _, removed in counts)
+
+    def get_word_count(self) -> int:
+        return sum(self._call_all('get_word_count'))
+
+    def get_search_stats(self) -> tuple:
+        """ WeightDamLeven.get_search_stats() summed over the shards. """
+        return tuple(sum(values) for values in zip(*self._call_all('get_search_stats')))
+
+    def reset_search_stats(self) -> None:
+        self._call_all('reset_search_stats')
+
+    def close(self) -> None:
+        """ Stop the local workers and disconnect from the remote ones, after the searches in flight finish. """
+        for shard in self._shards:
+            shard.close(self._timeout_seconds)
+
+    def _check(self) -> None:
+        if self._error is not None:
+            raise self._error
+
+    def _call_all(self, method: str, *args, **kwargs) -> list:
+        self._check()
+        return self._wait([shard.submit(method, args, kwargs) for shard in self._shards], None)
+
+    def _search_top_k(self, method: str, target, num_results: int, session, profile: str, cancel) -> list[tuple[str, float]]:
+        kwargs = {'profile': profile}
+        if session is not None:
+            kwargs['session'] = id(session)  # the client's session lives on, in every shard, under this key
+        per_shard = self._search(method, (target, num_results), kwargs, cancel)
+        return list(itertools.islice(heapq.merge(*per_shard, key=self.rank), max(num_results, 0)))
+
+    def _search_within(self, method: str, target, max_cost: float, limit: int, profile: str, cancel) -> list[tuple[str, float]]:
+        per_shard = self._search(method, (target, max_cost, limit), {'profile': profile}, cancel)
+        merged = heapq.merge(*per_shard, key=self.rank)
+        return list(itertools.islice(merged, limit) if limit > 0 else merged)
+
+    def _search(self, method: str, args: tuple, kwargs: dict, cancel: weightdamleven.CancelToken | None) -> list:
+        self._check()
+        kwargs['cancel'] = cancel is not None
+        return self._wait([shard.submit(method, args, kwargs) for shard in self._shards], cancel)
+
+    def _wait(self, futures: list[Future], cancel: weightdamleven.CancelToken | None) -> list:
+        """ Every shard's answer in shard order, or the first error: cancelled, timed out or failed. """
+        deadline = time.monotonic() + self._timeout_seconds
+        pending = set(futures)
+        while pending:
+            now = time.monotonic()
+            if cancel is not None and cancel.is_cancelled():
+                self._cancel(futures)
+                raise weightdamleven.SearchCancelled("search cancelled")
+            if now >= deadline:
+                self._cancel(futures)
+                raise ShardError(f"no answer from a search shard within {self._timeout_seconds} s")
+            timeout = deadline - now if cancel is None else min(deadline - now, self.CANCEL_POLL_SECONDS)
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_EXCEPTION)
+            for future in done:
+                if future.exception() is not None:
+                    self._cancel(futures)
+                    raise future.exception()
+        return [future.result() for future in futures]
+
+    def _cancel(self, futures: list[Future]) -> None:
+        for shard, future in zip(self._shards, futures):
+            shard.cancel(future)
+
+    @staticmethod
+    def rank(word_score: tuple[str, float]) -> tuple[float, str]:
+        # Python orders str by code point, the same as the engine's UTF-8 byte order
+        return word_score[1], word_score[0]
+
+
+class _Shard:
+    """ One worker seen from the front end: its connection, the requests waiting for an answer and its update log. """
+
+    def __init__(self, index: int, count: int, config: dict, address: tuple[str, int] | None, authkey: bytes | None):
+        self._index = index
+        self._count = count
+        self._config = config
+        self._address = address
+        self._authkey = authkey
+        self._lock = threading.Lock()  # guards everything below and serializes sends
+        self._connection: Connection | None = None
+        self._process: subprocess.Popen | None = None
+        self._pending: dict[int, Future] = {}  # request id -> its answer
+        self._request_ids: dict[Future, int] = {}
+        self._next_request_id = itertools.count()
+        # the update_words() calls since load, compacted into one to replay after a restart: removals apply first
+        self._added_words: dict[str, list[int]] = {}  # word -> its encoding
+        self._removed_words: set[str] = set()
+        self._closed = False
+
+    def start(self) -> Future:
+        with self._lock:
+            return self._start()
+
+    def submit(self, method: str, args: tuple, kwargs: dict) -> Future:
+        with self._lock:
+            self._connect()
+            return self._send(method, args, kwargs)
+
+    def update(self, keys_encoded: list[list[int]], words: list[str], removed_words: list[str]) -> Future:
+        # logged in the same step as it's sent, so a restart either replays it or comes before it
+        with self._lock:
+            self._connect()
+            future = self._send('update_words', (keys_encoded, words, removed_words), {})
+            for word in removed_words:
+                self._added_words.pop(word, None)
+                self._removed_words.add(word)
+            for word_encoded, word in zip(keys_encoded, words):
+                self._added_words[word] = word_encoded
+            return future
+
+    def cancel(self, future: Future) -> None:
+        with self._lock:
+            request_id = self._request_ids.get(future)
+            if request_id is not None and self._connection is not None:
+                try:
+                    self._connection.send((None, 'cancel', (request_id,), {}))
+                except OSError:
+                    pass
+
+    def close(self, timeout_seconds: float) -> None:
+        with self._lock:
+            self._closed = True
+            pending = list(self._pending.values())
+        wait(pending, timeout=timeout_seconds)
+        with self._lock:
+            connection, process = self._connection, self._process
+            self._connection = None
+            self._process = None
+        if connection is not None:
+            try:
+                connection.send((None, 'exit', (), {}))
+            except OSError:
+                pass
+            connection.close()
+        if process is not None:
+            try:
+                process.wait(timeout_seconds)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    def _connect(self) -> None:
+        """ Called with the lock held. """
+        if self._connection is None:
+            if self._closed:
+                raise ShardError(f"search shard {self._index} is closed")
+            self._start()  # after a crash, the load and replayed updates are queued before the next request
+
+    def _start(self) -> Future:
+        """ Start or connect to the worker and queue its load, called with the lock held. """
+        address, authkey = self._address, self._authkey
+        if address is None:
+            # a script of its own rather than multiprocessing, whose spawned children would import the server again
+            authkey = make_authkey()
+            self._process = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), '127.0.0.1', '0', '--once'],
+                stdout=subprocess.PIPE, text=True, env=dict(os.environ, SEARCH_SHARD_AUTHKEY=authkey.decode()))
+            line = self._process.stdout.readline()  # the port it listens on, nothing if it failed to start
+            self._process.stdout.close()
+            if not line:
+                self._process.wait()
+                self._process = None
+                raise ShardError(f"search shard {self._index} failed to start")
+            host, port = line.split()
+            address = (host, int(port))
+        connection = Client(address, authkey=authkey)
+        self._connection = connection
+        threading.Thread(target=self._receive_func, args=(connection,), daemon=True).start()
+        future = self._send('load', (self._config, self._index, self._count), {})
+        if self._added_words or self._removed_words:
+            self._send('update_words', (list(self._added_words.values()), list(self._added_words),
+                                        sorted(self._removed_words)), {})
+        return future
+
+    def _send(self, method: str, args: tuple, kwargs: dict) -> Future:
+        """ Called with the lock held. """
+        future = Future()
+        request_id = next(self._next_request_id)
+        self._pending[request_id] = future
+        self._request_ids[future] = request_id
+        try:
+            self._connection.send((request_id, method, args, kwargs))
+        except OSError as e:
+            self._disconnect(self._connection, ShardError(f"search shard {self._index} is gone: {e}"))
+        return future
+
+    def _receive_func(self, connection: Connection) -> None:
+        while True:
+            try:
+                request_id, is_ok, value = connection.recv()
+            except (EOFError, OSError):
+                with self._lock:
+                    self._disconnect(connection, ShardError(f"search shard {self._index} is gone"))
+                return
+            with self._lock:
+                future = self._pending.pop(request_id, None)
+                self._request_ids.pop(future, None)
+            if future is not None:
+                if is_ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+    def _disconnect(self, connection: Connection, error: ShardError) -> None:
+        """ Fail every request of a lost connection, called with the lock held. """
+        if self._connection is not connection:
+            return
+        self._connection = None
+        if self._process is not None:
+            self._process.kill()  # a worker that hung up but lives on is no use either
+            self._process.wait()
+            self._process = None
+        pending = list(self._pending.values())
+        self._pending.clear()
+        self._request_ids.clear()
+        for future in pending:
+            if not future.done():
+                future.set_exception(error)
+
+
+def make_shard_config(snapshot_path: str,
+                      source_key: bytes,
+                      folding: dict[str, str],
+                      cost_profiles: dict[str, tuple],
+                      is_cost_matrix: bool,
+                      thread_count: int,
+                      search_mode: weightdamleven.SearchMode,
+                      kernel_mode: weightdamleven.KernelMode,
+                      deletion_index_settings: tuple | None,
+                      deletion_index_profile: str,
+                      session_idle_seconds: float) -> dict:
+    """ Everything a worker needs to build its engine, without importing the server. """
+    return {
+        'snapshot_path': snapshot_path,
+        'source_key': source_key,
+        'folding': dict(folding),
+        'cost_profiles': dict(cost_profiles),
+        'is_cost_matrix': is_cost_matrix,
+        'thread_count': thread_count,
+        'search_mode': search_mode.name,
+        'kernel_mode': kernel_mode.name,
+        'deletion_index_settings': deletion_index_settings,
+        'deletion_index_profile': deletion_index_profile,
+        'session_idle_seconds': session_idle_seconds,
+    }
+
+
+def slice_snapshot(snapshot: LatinSnapshot, index: int, count: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ Shard index of count: the codes, offsets and words_utf8 of a contiguous run of the words, views where possible. """
+    offsets = snapshot.get_offsets()
+    words_utf8 = snapshot.get_words_utf8()
+    word_count = len(offsets) - 1
+    first, last = word_count * index // count, word_count * (index + 1) // count
+    word_ends = np.flatnonzero(words_utf8 == ord('\n'))
+    utf8_first = int(word_ends[first - 1]) + 1 if first > 0 else 0
+    utf8_last = int(word_ends[last - 1]) + 1 if last > 0 else 0
+    codes = snapshot.get_codes()[offsets[first]:offsets[last]]
+    return codes, offsets[first:last + 1] - offsets[first], words_utf8[utf8_first:utf8_last]
+
+
+def load_shard(config: dict, index: int, count: int) -> weightdamleven.WeightDamLeven:
+    """ The engine of one shard, with its deletion index saved next to the snapshot like the unsharded one. """
+    snapshot = LatinSnapshot.load(config['snapshot_path'], config['source_key'])
+    if snapshot is None:
+        raise FileNotFoundError(f"no snapshot at {config['snapshot_path']} for this word list")
+    codes, offsets, words_utf8 = slice_snapshot(snapshot, index, count)
+    corpus = weightdamleven.Corpus(codes, offsets, words_utf8=words_utf8)
+    cost_table = weightdamleven.CostTable(snapshot.get_cost_matrix())
+    wdl = weightdamleven.WeightDamLeven(corpus, config['thread_count'])
+    for name, costs in config['cost_profiles'].items():
+        wdl.set_cost_profile(name, cost_table, config['is_cost_matrix'], *costs)
+    wdl.set_char_table(weightdamleven.CharTable(snapshot.get_chars(), config['folding']))
+    wdl.set_search_mode(getattr(weightdamleven.SearchMode, config['search_mode']))
+    wdl.set_kernel_mode(getattr(weightdamleven.KernelMode, config['kernel_mode']))
+
+    settings = config['deletion_index_settings']
+    if settings is not None:
+        path = LatinSnapshot.get_deletion_index_path(config['snapshot_path'], (*settings, index, count))
+        data = LatinSnapshot.load_deletion_index(path)
+        try:
+            if data is not None:
+                wdl.set_deletion_index(weightdamleven.DeletionIndex(data))
+                return wdl
+        except ValueError:  # saved by another weightdamleven version
+            data = None
+        deletion_index = wdl.build_deletion_index(*settings, profile=config['deletion_index_profile'])
+        LatinSnapshot.write_deletion_index(path, deletion_index.to_bytes())
+    return wdl
+
+
+# the requests a worker answers, besides 'load', 'cancel' and 'exit'
+SHARD_METHODS = {
+    'weighted_damerau_levenshtein_words',
+    'weighted_damerau_levenshtein_words_multithread',
+    'weighted_damerau_levenshtein_words_within',
+    'weighted_damerau_levenshtein_words_within_multithread',
+    'update_words',
+    'get_word_count',
+    'get_search_stats',
+    'reset_search_stats',
+}
+
+
+def serve_connection(connection: Connection, request_workers: int = 0) -> None:
+    """
+    A worker's side of one connection: requests are (request id, method, args, kwargs), answers are
+    (request id, True, result) or (request id, False, exception). Searches run side by side on a thread pool,
+    'cancel' cancels one by request id and kwargs['session'] names a SearchSession kept between requests.
+    """
+    executor = ThreadPoolExecutor(max_workers=request_workers or os.cpu_count() or 1)
+    send_lock = threading.Lock()
+    state_lock = threading.Lock()
+    tokens: dict[int, weightdamleven.CancelToken] = {}
+    sessions: dict[int, list] = {}  # session key -> [SearchSession, time.monotonic() of the last search]
+    wdl: weightdamleven.WeightDamLeven | None = None
+    session_idle_seconds = 0.0
+
+    def answer(request_id: int, is_ok: bool, value) -> None:
+        with send_lock:
+            try:
+                connection.send((request_id, is_ok, value))
+            except OSError:
+                pass
+            except Exception as e:  # an exception that doesn't pickle
+                connection.send((request_id, False, ShardError(f"{type(value).__name__}: {value}: {e}")))
+
+    def get_session(key: int) -> weightdamleven.SearchSession:
+        now = time.monotonic()
+        with state_lock:
+            for idle_key in [k for k, (_, last_used) in sessions.items() if now - last_used > session_idle_seconds]:
+                del sessions[idle_key]
+            session = sessions.setdefault(key, [weightdamleven.SearchSession(), now])
+            session[1] = now
+            return session[0]
+
+    def run(request_id: int, method: str, args: tuple, kwargs: dict) -> None:
+        try:
+            if wdl is None:
+                raise ShardError("the shard isn't loaded")
+            if 'session' in kwargs:
+                kwargs['session'] = get_session(kwargs['session'])
+            if kwargs.pop('cancel', False):
+                kwargs['cancel'] = tokens[request_id]
+            answer(request_id, True, getattr(wdl, method)(*args, **kwargs))
+        except Exception as e:
+            answer(request_id, False, e)
+        finally:
+            with state_lock:
+                tokens.pop(request_id, None)
+
+    while True:
+        try:
+            request_id, method, args, kwargs = connection.recv()
+        except (EOFError, OSError):
+            break
+        if method == 'exit':
+            break
+        if method == 'cancel':
+            with state_lock:
+                token = tokens.get(args[0])
+            if token is not None:
+                token.cancel()
+        elif method == 'load':
+            # answered before any later request is read, so those always find the engine
+            try:
+                config, index, count = args
+                wdl = load_shard(config, index, count)
+                session_idle_seconds = config['session_idle_seconds']
+                answer(request_id, True, wdl.get_word_count())
+            except Exception as e:
+                answer(request_id, False, e)
+        elif method in SHARD_METHODS:
+            if kwargs.get('cancel'):
+                with state_lock:
+                    tokens[request_id] = weightdamleven.CancelToken()
+            if method == 'update_words':
+                run(request_id, method, args, kwargs)  # in order with the requests before and after it
+            else:
+                executor.submit(run, request_id, method, args, kwargs)
+        else:
+            answer(request_id, False, ShardError(f"unknown method '{method}'"))
+    executor.shutdown(wait=True)
+    connection.close()
+
+
+def make_authkey() -> bytes:
+    """ A new random secret for serve() and ShardedSearch. """
+    return os.urandom(32).hex().encode()
+
+
+def serve(address: tuple[str, int], authkey: bytes, once: bool = False) -> None:
+    """
+    A shard server, one thread per connection. It prints the host and port it listens on first,
+    once serves a single connection and returns, which is how ShardedSearch runs its local workers.
+    authkey must not be empty: Listener skips authentication without one, and requests are unpickled.
+    """
+    if not authkey:
+        raise ValueError("authkey: a search shard server needs a shared secret")
+    with Listener(address, authkey=authkey) as listener:
+        host, port = listener.address
+        print(f"{host} {port}", flush=True)
+        if once:
+            serve_connection(listener.accept())
+            return
+        while True:
+            try:
+                connection = listener.accept()
+            except Exception as e:  # e.g. a client with the wrong authkey
+                print(f"search shard server: {e}")
+                continue
+            threading.Thread(target=serve_connection, args=(connection,), daemon=True).start()
+
+
+if __name__ == "__main__":
+    # python search_shards.py <host> <port> [--once], with the shared secret in SEARCH_SHARD_AUTHKEY
+    if not os.environ.get('SEARCH_SHARD_AUTHKEY'):
+        sys.exit("search_shards.py: set SEARCH_SHARD_AUTHKEY to the secret the front end connects with")
+    serve((sys.argv[1], int(sys.argv[2])), os.environ['SEARCH_SHARD_AUTHKEY'].encode(), '--once' in sys.argv[3:])
@@ -0,0 +1,124 @@
+# python -m pytest wiktionary_latin_py/tests (or python -m unittest discover wiktionary_latin_py/tests)
+# the word-list refresh against a local HTTP stand-in for kaikki.org that serves a fixture dump
+import os
+import sys
+import gzip
+import json
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from parse_wiktextract import WiktextractParser
+
+
+def make_dump(latin_words: list[str]) -> bytes:
+    """ A gzipped raw-wiktextract-data.jsonl with an English entry between every Latin one. """
+    lines = []
+    for word in latin_words:
+        lines.append(json.dumps({'word': word, 'lang': 'Latin', 'lang_code': 'la'}))
+        lines.append(json.dumps({'word': word.upper(), 'lang': 'English', 'lang_code': 'en'}))
+    return gzip.compress(('\n'.join(lines) + '\n').encode('utf-8'))
+
+
+class DumpServer(ThreadingHTTPServer):
+    """ Serves body with etag, answers 304 to a matching If-None-Match unless ignore_validators. """
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), DumpHandler)
+        self.body = b''
+        self.etag = ''
+        self.ignore_validators = False
+        self.requests = []  # the headers of every request
+
+    def get_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/raw-wiktextract-data.jsonl.gz"
+
+
+class DumpHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+        if not self.server.ignore_validators and self.headers.get('If-None-Match') == self.server.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/gzip')
+        self.send_header('Content-Length', str(len(self.server.body)))
+        self.send_header('ETag', self.server.etag)
+        self.end_headers()
+        self.wfile.write(self.server.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestRefreshLatinWordList(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.saved_paths = WiktextractParser.LATIN_WORDS, WiktextractParser.FETCH_METADATA
+        WiktextractParser.LATIN_WORDS = os.path.join(self.directory.name, "latin_words.txt")
+        WiktextractParser.FETCH_METADATA = os.path.join(self.directory.name, "latin_words_source.json")
+        self.server = DumpServer()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = self.server.get_url()
+        self.server.body, self.server.etag = make_dump(['amo', 'amas', 'amat']), '"v1"'
+        added_words, removed_words, metadata = self.refresh()
+        self.assertEqual((added_words, removed_words), (['amas', 'amat', 'amo'], []))
+        WiktextractParser.save_fetch_metadata(metadata)  # as the server does once it has the words
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        WiktextractParser.LATIN_WORDS, WiktextractParser.FETCH_METADATA = self.saved_paths
+        self.directory.cleanup()
+
+    def refresh(self, loaded_words: list[str] | None = None):
+        return WiktextractParser.refresh_latin_word_list(processes=1, url=self.url, loaded_words=loaded_words)
+
+    def read_files(self) -> tuple[list[str], dict[str, str]]:
+        return WiktextractParser.read_latin_word_list(), WiktextractParser.load_fetch_metadata()
+
+    def test_truncated_body_keeps_word_list(self):
+        before = self.read_files()
+        body = make_dump(['amo', 'amas', 'amat', 'amamus', 'amatis', 'amant'])
+        self.server.body, self.server.etag = body[:len(body) - 12], '"v2"'  # cut inside the gzip trailer
+        with self.assertRaises(EOFError):
+            self.refresh()
+        self.assertEqual(self.read_files(), before)
+
+    def test_unchanged_etag(self):
+        before = self.read_files()
+        self.assertIsNone(self.refresh())
+        self.assertEqual(self.server.requests[-1].get('If-None-Match'), '"v1"')
+        self.assertEqual(self.read_files(), before)
+
+    def test_unchanged_body_without_304(self):
+        before = self.read_files()
+        self.server.ignore_validators = True
+        self.assertIsNone(self.refresh())
+        self.assertEqual(self.read_files(), before)
+
+    def test_changed_body(self):
+        self.server.body, self.server.etag = make_dump(['amo', 'amat', 'amamus']), '"v2"'
+        added_words, removed_words, metadata = self.refresh()
+        self.assertEqual((added_words, removed_words), (['amamus'], ['amas']))
+        words, saved_metadata = self.read_files()
+        self.assertEqual(words, ['amo', 'amat', 'amamus'])
+        self.assertEqual(saved_metadata['etag'], '"v1"')  # not until the reload has the words
+        WiktextractParser.save_fetch_metadata(metadata)
+        self.assertEqual(self.read_files()[1]['etag'], '"v2"')
+        self.assertIsNone(self.refresh())
+
+    def test_failed_reload_is_fetched_again(self):
+        loaded_words = self.read_files()[0]
+        self.server.body, self.server.etag = make_dump(['amo', 'amat', 'amamus']), '"v2"'
+        self.assertEqual(self.refresh(loaded_words)[:2], (['amamus'], ['amas']))
+        # the reload failed, so the metadata wasn't saved and the server still has loaded_words
+        self.assertEqual(self.refresh(loaded_words)[:2], (['amamus'], ['amas']))
+        self.assertEqual(self.server.requests[-1].get('If-None-Match'), '"v1"')
+
+
+if __name__ == '__main__':
+    unittest.main()
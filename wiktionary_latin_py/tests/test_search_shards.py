@@ -0,0 +1,149 @@
+# python -m pytest wiktionary_latin_py/tests (or python -m unittest discover wiktionary_latin_py/tests)
+# local search shards against one engine over the same snapshot, with weightdamleven built and importable
+import os
+import sys
+import time
+import random
+import hashlib
+import tempfile
+import unittest
+from concurrent.futures import Future
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import weightdamleven
+from latin_snapshot import LatinSnapshot
+from search_shards import ShardedSearch, ShardError, make_shard_config, serve
+
+CHARS = list("abcdefghilmnopqrstuvxyzABCDEFGHILMNOPQRSTUVXYZāēīōū ")
+LONG_VOWELS = {'ā': 'a', 'ē': 'e', 'ī': 'i', 'ō': 'o', 'ū': 'u'}
+COST_PROFILES = {
+    'perquire': (10.0, 3.0, 3.0, 3.0, 2.0),
+    'suggestions': (10.0, 3.0, 0.1, 3.0, 2.0),
+}
+DELETION_INDEX_SETTINGS = (2, 2**24, 0.5)
+
+
+def make_words(count: int, seed: int) -> list[str]:
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < count:
+        words.add(''.join(rng.choice(CHARS[:-1]) for _ in range(rng.randint(1, 9))))
+    return sorted(words)
+
+
+def encode(word: str) -> list[int]:
+    return [CHARS.index(char) for char in word]
+
+
+class TestShardedSearch(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.words = make_words(3000, 1)
+        rng = random.Random(2)
+        cls.queries = [rng.choice(cls.words)[:rng.randint(1, 9)] for _ in range(30)] + ['', 'zzqq', 'ām', 'a b']
+        cost_matrix = np.array([[0.0 if i == j else 1.0 + (i + j) % 5 for j in range(len(CHARS))]
+                                for i in range(len(CHARS))])
+        cls.source_key = hashlib.sha256(b'test_search_shards').digest()
+        cls.snapshot_path = os.path.join(cls.directory.name, "latin_words.snapshot")
+        offsets = np.zeros(len(cls.words) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(word) for word in cls.words])
+        codes = np.array([code for word in cls.words for code in encode(word)], dtype=np.uint16)
+        LatinSnapshot.write(cls.snapshot_path, cls.source_key, cls.words, codes, offsets, CHARS, cost_matrix)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def setUp(self):
+        self.searches = []
+
+    def tearDown(self):
+        for search in self.searches:
+            search.close()
+
+    def make_engine(self) -> weightdamleven.WeightDamLeven:
+        """ The unsharded engine, set up like the server's create_wdl(). """
+        snapshot = LatinSnapshot.load(self.snapshot_path, self.source_key)
+        corpus = weightdamleven.Corpus(snapshot.get_codes(), snapshot.get_offsets(), words_utf8=snapshot.get_words_utf8())
+        cost_table = weightdamleven.CostTable(snapshot.get_cost_matrix())
+        wdl = weightdamleven.WeightDamLeven(corpus, 2)
+        for name, costs in COST_PROFILES.items():
+            wdl.set_cost_profile(name, cost_table, True, *costs)
+        wdl.set_char_table(weightdamleven.CharTable(CHARS, LONG_VOWELS))
+        return wdl
+
+    def make_sharded(self, shard_count: int, deletion_index_settings: tuple | None = None) -> ShardedSearch:
+        config = make_shard_config(
+            self.snapshot_path, self.source_key, LONG_VOWELS, COST_PROFILES, True, 1,
+            weightdamleven.SearchMode.SCAN, weightdamleven.KernelMode.SIMD, deletion_index_settings, 'perquire', 600.0)
+        search = ShardedSearch(config, shard_count, timeout_seconds=60.0)
+        self.searches.append(search)
+        return search
+
+    def assert_same_results(self, wdl: weightdamleven.WeightDamLeven, search: ShardedSearch):
+        self.assertEqual(search.get_word_count(), wdl.get_word_count())
+        session = weightdamleven.SearchSession()
+        for query in self.queries:
+            for profile in COST_PROFILES:
+                with self.subTest(query=query, profile=profile):
+                    for num_results in (1, 10, 50):
+                        expected = wdl.weighted_damerau_levenshtein_words(query, num_results, profile=profile)
+                        self.assertEqual(search.weighted_damerau_levenshtein_words(
+                            query, num_results, profile=profile), expected)
+                        self.assertEqual(search.weighted_damerau_levenshtein_words_multithread(
+                            query, num_results, session, profile=profile), expected)
+                    for max_cost, limit in ((4.0, 0), (8.0, 5)):
+                        expected = wdl.weighted_damerau_levenshtein_words_within(query, max_cost, limit, profile=profile)
+                        self.assertEqual(search.weighted_damerau_levenshtein_words_within_multithread(
+                            query, max_cost, limit, profile=profile), expected)
+
+    def update(self, wdl, search: ShardedSearch, added_words: list[str], removed_words: list[str]):
+        added_encoded = [encode(word) for word in added_words]
+        self.assertEqual(search.update_words(added_encoded, added_words, removed_words),
+                         wdl.update_words(added_encoded, added_words, removed_words))
+
+    def test_same_results_as_one_engine(self):
+        wdl = self.make_engine()
+        for shard_count in (1, 3):
+            for deletion_index_settings in (None, DELETION_INDEX_SETTINGS):
+                with self.subTest(shard_count=shard_count, deletion_index_settings=deletion_index_settings):
+                    self.assert_same_results(wdl, self.make_sharded(shard_count, deletion_index_settings))
+
+    def test_updates_are_replayed_after_a_crash(self):
+        wdl = self.make_engine()
+        search = self.make_sharded(3)
+        self.update(wdl, search, ['zzqqa', 'zzqqb', 'amāre'], self.words[::7])
+        self.update(wdl, search, ['zzqqc', self.words[7]], ['zzqqa', self.words[1]])
+        self.assert_same_results(wdl, search)
+
+        shard = search._shards[1]
+        shard._process.kill()
+        deadline = time.monotonic() + 10.0
+        while shard._connection is not None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assert_same_results(wdl, search)  # restarted on the first request
+
+    def test_partial_update_failure(self):
+        search = self.make_sharded(2)
+        failed = Future()
+        failed.set_exception(ShardError("search shard 1 is gone"))
+        search._shards[1].update = lambda *args: failed
+        with self.assertRaises(ShardError):
+            search.update_words([encode('zzqqa')], ['zzqqa'], [])
+        # the shards disagree now, so nothing is answered from them any more
+        with self.assertRaises(ShardError):
+            search.weighted_damerau_levenshtein_words('amo', 10, profile='perquire')
+        with self.assertRaises(ShardError):
+            search.update_words([], [], [self.words[0]])
+
+    def test_authkey_is_required(self):
+        with self.assertRaises(ValueError):
+            serve(('127.0.0.1', 0), b'')
+        with self.assertRaises(ValueError):
+            ShardedSearch({}, addresses=[('127.0.0.1', 1)], authkey=b'')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -16,22 +16,28 @@
 
 import threading
 import itertools
+import functools
 import os
 import subprocess
 import sys
 import pathlib
 import random
+import heapq
 from enum import Enum
 import threading
 import time
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from typing import Callable
 import numpy as np
 from send2trash import send2trash
-from flask import Flask, Response, request, render_template, make_response, redirect
+from flask import Flask, Response, request, render_template, make_response, redirect, jsonify
 from flask_socketio import SocketIO
 
 import weightdamleven
 from parse_wiktextract import WiktextractParser
+from latin_snapshot import LatinSnapshot
+from search_shards import ShardedSearch, ShardError, make_shard_config
+from worker_messages import WorkerMessages
 
 print(f"weightdamleven library: {weightdamleven.__file__}")
 
@@ -39,31 +45,103 @@ print(f"weightdamleven library: {weightdamleven.__file__}")
 class Latin:
     MAX_RESULTS = 100
     DIRECTORY = pathlib.Path(__file__).parent.resolve()
-    LATIN_WORDS = os.path.join(DIRECTORY, "database", "latin_words.txt")
+    # WIKTIONARY_LATIN_WORDS points the server at another word list, e.g. the load test's fixture
+    LATIN_WORDS = os.environ.get('WIKTIONARY_LATIN_WORDS', os.path.join(DIRECTORY, "database", "latin_words.txt"))
     LINKS = os.path.join(DIRECTORY, "database", "links.txt")
     if not pathlib.Path(LINKS).is_file():
         open(LINKS, 'w').close()
     LONG_VOWELS = {'ā': 'a', 'ē': 'e', 'ī': 'i', 'ō': 'o', 'ū': 'u',
                     'Ā': 'A', 'Ē': 'E', 'Ī': 'I', 'Ō': 'O', 'Ū': 'U'}
 
-    def __init__(self):
-        self._latin_words: list[str] = self.read_parsed_latin_words()  # list of latin words
+    def __init__(self, attach_published: bool = False):
         self._char_char_cost: defaultdict[tuple[str, str], complex] = self.calc_char_char_cost()  # the cost of replacing char1 with char2
+        if not (attach_published and self.attach_published_snapshot()):
+            self.load_snapshot()
 
+    def load_snapshot(self) -> None:
+        """
+        Load the words, encodings and cost matrix from the binary snapshot of latin_words.txt,
+        building the snapshot first if latin_words.txt or the costs changed since it was written.
+        """
+        source_key = LatinSnapshot.calc_source_key(self.LATIN_WORDS, repr(sorted(self._char_char_cost.items())).encode())
+        snapshot_path = LatinSnapshot.get_path(self.LATIN_WORDS, source_key)
+        snapshot = LatinSnapshot.load(snapshot_path, source_key)
+        if snapshot is None:
+            self._latin_words = self.read_parsed_latin_words()
+            self._char_int_dict = self.calc_char_int_dict()
+            self._int_char_dict = self.calc_int_char_dict()
+            codes, offsets = self.calc_latin_words_encoded()
+            chars = [self._int_char_dict[code] for code in range(len(self._int_char_dict))]
+            LatinSnapshot.write(snapshot_path, source_key, self._latin_words, codes, offsets, chars, self.calc_cost_matrix())
+            snapshot = LatinSnapshot.load(snapshot_path, source_key)
+            # the published generation may still be mapped by other server workers, only later ones are removed
+            generation = LatinSnapshot.read_generation(self.LATIN_WORDS)
+            LatinSnapshot.remove_stale(self.LATIN_WORDS, snapshot_path, generation[1] if generation is not None else None)
+        self.set_snapshot(snapshot, snapshot_path, source_key)
+
+    def attach_published_snapshot(self) -> bool:
+        """
+        Map the snapshot generation that another process published instead of checking latin_words.txt,
+        False if there's none or it's gone already.
+        """
+        generation = LatinSnapshot.read_generation(self.LATIN_WORDS)
+        if generation is None:
+            return False
+        _number, snapshot_path, source_key = generation
+        snapshot = LatinSnapshot.load(snapshot_path, source_key)
+        if snapshot is None:
+            return False
+        self.set_snapshot(snapshot, snapshot_path, source_key)
+        return True
+
+    def publish_snapshot(self) -> int:
+        """ Make this snapshot the generation that other server workers attach to, call it once the engine is built. """
+        return LatinSnapshot.publish(self.LATIN_WORDS, self._snapshot_path, self._source_key)
+
+    def set_snapshot(self, snapshot: LatinSnapshot, snapshot_path: str, source_key: bytes) -> None:
+        self._snapshot: LatinSnapshot = snapshot
+        self._snapshot_path: str = snapshot_path
+        self._source_key: bytes = source_key
+        self._latin_words: list[str] | None = None  # list of latin words, sorted, decoded from the snapshot when first needed
         # str -> list[int] conversions because pybind11 wasn't playing nicely with (variable size) unicode
-        self._char_int_dict: defaultdict[str, int] = self.calc_char_int_dict()  # maps from chars to encoding ints
+        self._char_int_dict: defaultdict[str, int] = self.calc_char_int_dict_from_chars(snapshot.get_chars())  # maps from chars to encoding ints
         self._int_char_dict: dict[int, str] = self.calc_int_char_dict()  # maps from encoding ints to chars
-        self._cost_matrix: list[list[float]] = self.calc_cost_matrix()  # self._cost_matrix[char_int_dict[char1]][char_int_dict[char2]] = the cost to turn char1 into char2
-        self._latin_words_encoded: list[list[int]] = self.calc_latin_words_encoded()  # list of all words encoded as list[int]
+        self._cost_matrix: np.ndarray = snapshot.get_cost_matrix()  # self._cost_matrix[char_int_dict[char1], char_int_dict[char2]] = the cost to turn char1 into char2
+        # folds long vowels, strips and encodes queries natively, the engines get it too so they take the query text as is
+        self._char_table = weightdamleven.CharTable(snapshot.get_chars(), self.LONG_VOWELS)
+        # all words encoded back to back as uint16, word i is codes[offsets[i]:offsets[i + 1]]
+        self._latin_words_codes: np.ndarray = snapshot.get_codes()
+        self._latin_words_offsets: np.ndarray = snapshot.get_offsets()
+
+    def get_snapshot_path(self) -> str:
+        return self._snapshot_path
+
+    def get_source_key(self) -> bytes:
+        return self._source_key
+
+    def get_latin_words(self) -> list[str]:
+        if self._latin_words is None:
+            self._latin_words = self._snapshot.get_words()
+        return self._latin_words
 
     def get_int_char_dict(self) -> dict[int, str]:
         return self._int_char_dict
 
-    def get_cost_matrix(self) -> list[list[float]]:
+    def get_char_table(self) -> weightdamleven.CharTable:
+        return self._char_table
+
+    def get_cost_matrix(self) -> np.ndarray:
         return self._cost_matrix
 
-    def get_latin_words_encoded(self) -> list[list[int]]:
-        return self._latin_words_encoded
+    def get_latin_words_codes(self) -> np.ndarray:
+        return self._latin_words_codes
+
+    def get_latin_words_offsets(self) -> np.ndarray:
+        return self._latin_words_offsets
+
+    def get_latin_words_utf8(self) -> np.ndarray:
+        """ The words as newline-terminated UTF-8, for WeightDamLeven's words_utf8. """
+        return self._snapshot.get_words_utf8()
 
     def calc_char_set(self) -> dict[str, None]:
         """ char_set is the ordered set (dict[str, None]) of all characters used. """
@@ -85,10 +163,14 @@ class Latin:
         char_int_dict[char1] maps from char1 to encoding int1.
         Used this for cost matrix indexing:
         """
-        char_set = self.calc_char_set()
+        return self.calc_char_int_dict_from_chars(list(self.calc_char_set()))
+
+    @classmethod
+    def calc_char_int_dict_from_chars(cls, chars: list[str]) -> defaultdict[str, int]:
+        """ chars[int1] is char1. """
         counter = 0
         char_int_dict = defaultdict(lambda: 0)
-        for char in char_set:
+        for char in chars:
             char_int_dict[char] = counter
             counter += 1
         # map unknown chars to space bar
@@ -106,43 +188,62 @@ class Latin:
             int_char_dict[val] = char
         return int_char_dict
 
-    def calc_cost_matrix(self) -> list[list[float]]:
-        """ cost_matrix[char_int_dict[char1]][char_int_dict[char2]] = the cost to turn char1 into char2. """
+    def calc_cost_matrix(self) -> np.ndarray:
+        """ cost_matrix[char_int_dict[char1], char_int_dict[char2]] = the cost to turn char1 into char2. """
         char_set = set()
         for char_char in self._char_char_cost:
             for char in char_char:
                 char_set.add(char)
         char_set_length = len(char_set)
 
-        cost_matrix = [[0.0 for _j in range(char_set_length)] for _i in range(char_set_length)]
+        cost_matrix = np.zeros((char_set_length, char_set_length), dtype=np.float64)
         for char_char in self._char_char_cost:
             char1, char2 = char_char
             i = self._char_int_dict[char1]
             j = self._char_int_dict[char2]
-            cost_matrix[i][j] = self._char_char_cost[char_char]
+            cost_matrix[i, j] = self._char_char_cost[char_char]
         return cost_matrix
 
-    def calc_latin_words_encoded(self) -> list[list[int]]:
-        """ list of all words encoded as list[int]. """
-        latin_words_encoded = []
-        for word in self._latin_words:
-            latin_words_encoded.append([self._char_int_dict[char] for char in word])
-        return latin_words_encoded
+    def calc_latin_words_encoded(self) -> tuple[np.ndarray, np.ndarray]:
+        """ All words encoded back to back as uint16 codes, plus the int64 offsets where each word starts. """
+        codes = np.fromiter(
+            (self._char_int_dict[char] for word in self._latin_words for char in word),
+            dtype=np.uint16)
+        offsets = np.zeros(len(self._latin_words) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.array([len(word) for word in self._latin_words], dtype=np.int64))
+        return codes, offsets
 
     def get_random_word(self) -> str:
         """ Get a random Latin word. """
-        return random.choice(self._latin_words)
+        return random.choice(self.get_latin_words())
 
     @classmethod
     def read_parsed_latin_words(cls) -> list[str]:
-        """ Read in the saved list produced by WiktextractParser.parse_latin_word_list(). """
+        """ Read in the saved list produced by WiktextractParser.parse_latin_word_list(), deduplicated and sorted. """
         with open(cls.LATIN_WORDS, 'r', encoding="utf-8") as f:
-            latin_words = list(set(word.strip() for word in f.readlines()))
+            latin_words = sorted(set(word.strip() for word in f.readlines()))
         return latin_words
 
-    def reload_latin_words(self) -> None:
-        self._latin_words = self.read_parsed_latin_words()
-        self._latin_words_encoded = self.calc_latin_words_encoded()
+    def calc_updated_latin_words(self, added_words: list[str], removed_words: list[str]) -> list[str]:
+        """
+        The word list with a diff applied, for set_latin_words() once WeightDamLeven.update_words() has it too.
+        The snapshot arrays are left as they are, the next load_snapshot() rebuilds them from latin_words.txt.
+        """
+        removed_set = set(removed_words)
+        latin_words = self.get_latin_words()
+        kept_words = (word for word in latin_words if word not in removed_set)
+        return list(heapq.merge(kept_words, sorted(set(added_words) - set(latin_words))))
+
+    def set_latin_words(self, latin_words: list[str]) -> None:
+        self._latin_words = latin_words
+
+    def is_encodable(self, word: str) -> bool:
+        """ True if every char of word already has an encoding int, i.e. the word can join the corpus without a rebuild. """
+        return all(char in self._char_int_dict for char in word)
+
+    def encode_word(self, word: str) -> list[int]:
+        """ Encode a corpus word as is, the way calc_latin_words_encoded() does. """
+        return [self._char_int_dict[char] for char in word]
 
     @classmethod
     def calc_char_char_cost(cls) -> defaultdict[tuple[str, str], complex]:
@@ -193,10 +294,8 @@ class Latin:
         return char_char_cost
 
     def convert_to_search_ints(self, word: str) -> list[int]:
-        """ Remove long vowels and strip whitespace. Convert from unicode to ints. """
-        text = self.convert_to_search_word(word)
-        text_ints = [self._char_int_dict[char] for char in text]
-        return text_ints
+        """ Remove long vowels and strip whitespace. Convert from unicode to ints, unknown chars become the space bar. """
+        return self._char_table.encode(word)
 
     @classmethod
     def create_url(cls, word: str) -> str:
@@ -225,12 +324,9 @@ class Latin:
                 break
         return result
 
-    @classmethod
-    def convert_to_search_word(cls, word: str) -> str:
+    def convert_to_search_word(self, word: str) -> str:
         """ Remove long vowels and strip whitespace. """
-        for long, short in cls.LONG_VOWELS.items():
-            word = word.replace(long, short)
-        return word.strip()
+        return self._char_table.normalize(word)
 
     @classmethod
     def load_links(cls) -> dict[str, str]:
@@ -264,49 +360,211 @@ class ReloadState(Enum):
     DOWNLOAD = 2
     RELOAD = 3
 
-def query_update_thread_func():
-    """ An infinite loop that checks the latest 'query_update' """
-    global latin_global
-    global query_update_global
-    global query_update_lock_global
-    global wdl_global
-    global wdl_suggestions_global
+class QueryCache:
+    """ A bounded LRU cache of finished search results, entries expire after ttl_seconds. """
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self._max_size = max_size
+        self._ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[tuple, tuple[float, object]] = OrderedDict()  # key -> (time stored, value)
+        self._generation = 0  # bumped by clear() so results of searches started before it aren't stored
+        self._hits = 0
+        self._misses = 0
 
-    while True:
-        with query_update_lock_global:
-            pending = list(query_update_global.items())
-            query_update_global.clear()
-
-        for request_sid, text in pending:
-            if not text:
-                socketio.emit('on_query_update_done', {'latin_words': []}, to=request_sid)
-                continue
-
-            text_ints = latin_global.convert_to_search_ints(text)
-            latin_words_scores = wdl_suggestions_global.weighted_damerau_levenshtein_multithread(text_ints, 10)
-            latin_words = defaultdict(lambda: [])
-            for i, (ints, score) in enumerate(latin_words_scores):
-                latin_words[score].append(''.join([int_char_dict_global[ival] for ival in ints]))
-
-            suggestions = []
-            for score in latin_words:
-                for word in sorted(latin_words[score]):
-                    suggestions.append([word, latin_global.create_url(word)])
-            socketio.emit('on_query_update_done', {'suggestions': suggestions}, to=request_sid)
-        time.sleep(0.001)
-
-
-latin_global = Latin()
-int_char_dict_global = latin_global.get_int_char_dict()
+    @classmethod
+    def make_key(cls, profile: str, search_word: str, num_results: int) -> tuple[str, str, int]:
+        """ search_word is the query after Latin.convert_to_search_word(), so queries that normalize the same share an entry. """
+        return profile, search_word, num_results
+
+    def get(self, key: tuple) -> tuple[object | None, int]:
+        """ Return (the cached value or None, the generation to pass back to put()). """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self._ttl_seconds:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self._misses += 1
+                return None, self._generation
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[1], self._generation
+
+    def put(self, key: tuple, value: object, generation: int) -> None:
+        with self._lock:
+            if generation < self._generation:
+                return  # computed with engines that have been replaced since
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self, swap: Callable[[], None] | None = None) -> None:
+        """
+        Drop every entry and start a new generation, in the same locked step as swap() that only assigns the new engine
+        and word list, built beforehand as every search waits for the lock: no get() after it returns the old engine's
+        results, and put() rejects results of searches whose get() came before it. That holds as long as searches read
+        the engine after get().
+        """
+        with self._lock:
+            try:
+                if swap is not None:
+                    swap()
+            finally:
+                self._entries.clear()
+                self._generation += 1
+
+    def get_stats(self) -> dict[str, int]:
+        with self._lock:
+            return {'size': len(self._entries), 'max_size': self._max_size, 'hits': self._hits, 'misses': self._misses}
+
+
+class QueryDispatcher:
+    """ Runs the 'query_update' searches on a pool of worker threads that sleep until there is work.
+    Each client has at most one search running, a newer query replaces its pending one and cancels its running one.
+    A query sent with an id is answered with it, and with 'on_query_update_superseded' if a newer one replaced it. """
+    def __init__(self, worker_count: int):
+        self._condition = threading.Condition()
+        # request.sid -> (latest query not started yet, its id or None), oldest first
+        self._pending: OrderedDict[str, tuple[str, object]] = OrderedDict()
+        self._running: dict[str, weightdamleven.CancelToken] = {}  # request.sid -> token of its search in flight
+        self._sessions: dict[str, list] = {}  # request.sid -> [SearchSession, time.monotonic() of the last query_update]
+        self._next_session_sweep = time.monotonic() + SESSION_IDLE_SECONDS
+        self._completed = 0
+        self._replaced = 0  # replaced while pending
+        self._cancelled = 0  # cancelled while running
+        self._workers = [threading.Thread(target=self._worker_func, daemon=True) for _ in range(max(worker_count, 1))]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, request_sid: str, text: str, query_id: object = None) -> None:
+        with self._condition:
+            replaced = self._pending.pop(request_sid, None)
+            if replaced is not None:
+                self._replaced += 1
+            self._pending[request_sid] = (text, query_id)
+            token = self._running.get(request_sid)
+            if token is not None:
+                token.cancel()
+            self._condition.notify()
+        if replaced is not None:
+            self._emit_superseded(request_sid, *replaced)
+
+    def discard(self, request_sid: str) -> None:
+        with self._condition:
+            self._pending.pop(request_sid, None)
+            self._sessions.pop(request_sid, None)
+            token = self._running.get(request_sid)
+            if token is not None:
+                token.cancel()
+
+    def get_stats(self) -> dict[str, int]:
+        with self._condition:
+            return {'workers': len(self._workers), 'pending': len(self._pending), 'running': len(self._running),
+                    'completed': self._completed, 'replaced': self._replaced, 'cancelled': self._cancelled}
+
+    def _next_request(self) -> str | None:
+        """ The oldest pending client without a search in flight, called with the lock held. """
+        return next((request_sid for request_sid in self._pending if request_sid not in self._running), None)
+
+    def _sweep_sessions(self, now: float) -> None:
+        if now < self._next_session_sweep:
+            return
+        self._next_session_sweep = now + SESSION_IDLE_SECONDS
+        for request_sid in [sid for sid, (_, last_used) in self._sessions.items()
+                            if now - last_used > SESSION_IDLE_SECONDS and sid not in self._running]:
+            del self._sessions[request_sid]
+
+    def _worker_func(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._next_request() is not None)
+                request_sid = self._next_request()
+                text, query_id = self._pending.pop(request_sid)
+                token = weightdamleven.CancelToken()
+                self._running[request_sid] = token
+                now = time.monotonic()
+                self._sweep_sessions(now)
+                # one SearchSession per client, so the next keystroke can reuse the previous results
+                session = self._sessions.setdefault(request_sid, [weightdamleven.SearchSession(), now])
+                session[1] = now
+            superseded = False
+            try:
+                self._search(request_sid, text, query_id, session[0], token)
+                finished = True
+            except weightdamleven.SearchCancelled:
+                finished = False
+            except Exception as e:
+                print(f"'query_update' failed: {e}")
+                finished = False
+            finally:
+                with self._condition:
+                    del self._running[request_sid]
+                    if finished:
+                        self._completed += 1
+                    elif token.is_cancelled():
+                        self._cancelled += 1
+                        superseded = request_sid in self._pending  # rather than cancelled by a disconnect
+                    if request_sid in self._pending:
+                        self._condition.notify()
+            if superseded:
+                self._emit_superseded(request_sid, text, query_id)
+
+    @classmethod
+    def _emit_superseded(cls, request_sid: str, text: str, query_id: object) -> None:
+        """ Tell a client that numbers its queries that one of them won't be answered. """
+        if query_id is not None:
+            socketio.emit('on_query_update_superseded', {'query': text, 'id': query_id}, to=request_sid)
+
+    @classmethod
+    def _search(cls, request_sid: str, text: str, query_id: object, session: weightdamleven.SearchSession,
+                token: weightdamleven.CancelToken) -> None:
+        global latin_global
+        global query_cache_global
+        global wdl_global
+
+        # the query the suggestions are for, as the client's newer keystrokes may have replaced it meanwhile
+        done = {'query': text} if query_id is None else {'query': text, 'id': query_id}
+        if not text:
+            socketio.emit('on_query_update_done', {'suggestions': [], **done}, to=request_sid)
+            return
+        search_word = latin_global.convert_to_search_word(text)
+        cache_key = QueryCache.make_key('suggestions', search_word, QUERY_UPDATE_RESULTS)
+        suggestions, cache_generation = query_cache_global.get(cache_key)
+        if suggestions is None:
+            # one thread per search: the workers score different clients' queries side by side
+            latin_words_scores = []
+            if QUERY_UPDATE_MAX_COST is not None:
+                latin_words_scores = wdl_global.weighted_damerau_levenshtein_words_within(
+                    search_word, QUERY_UPDATE_MAX_COST, QUERY_UPDATE_RESULTS, profile='suggestions', cancel=token)
+            if not latin_words_scores:
+                latin_words_scores = wdl_global.weighted_damerau_levenshtein_words(
+                    search_word, QUERY_UPDATE_RESULTS, session, profile='suggestions', cancel=token)
+            suggestions = [[word, latin_global.create_url(word)] for word, _score in latin_words_scores]
+            query_cache_global.put(cache_key, suggestions, cache_generation)
+        socketio.emit('on_query_update_done', {'suggestions': suggestions, **done}, to=request_sid)
+
+
+# several server processes behind a load balancer: each maps the snapshot generation that was published last
+# and reaches the other workers' clients through WorkerMessages
+MULTI_WORKER = os.environ.get('WIKTIONARY_LATIN_MULTI_WORKER', '') == '1'
+SNAPSHOT_POLL_SECONDS = 2.0  # how often a worker looks for a newer generation and refreshes its heartbeat
+latin_global = Latin(attach_published=MULTI_WORKER)
 links_dict_global = latin_global.load_links()
 images_total_global = {}
 images_remaining_global = {}
 searches_so_far_global = {}
-query_update_lock_global = threading.Lock()
-query_update_global = {}
+SESSION_IDLE_SECONDS = 600
+QUERY_UPDATE_RESULTS = 10
+QUERY_UPDATE_WORKERS = os.cpu_count() or 1
+# the searches below first look for words within these costs only and fall back to the plain top-k search
+# when there are none, None always searches top-k
+QUERY_UPDATE_MAX_COST = None  # e.g. 6.0: fewer but closer suggestions, without reusing the client's SearchSession
+SENTIO_FELIX_MAX_COST = 12.0  # e.g. four missing letters, the top-k fallback finds the same nearest word beyond it
+INCREMENTAL_RELOAD_LIMIT = 10000  # word list diffs up to this size are applied to the running engine instead of rebuilding it
+query_cache_global = QueryCache(max_size=10000, ttl_seconds=3600.0)  # perquire, query_update and sentio_felix results
 reload_state_global = ReloadState.IDLE
-query_update_thread = threading.Thread(target=query_update_thread_func)
-query_update_thread.start()
+query_dispatcher_global = QueryDispatcher(QUERY_UPDATE_WORKERS)
 
 is_cost_matrix = True
 replace_cost = 10.0
@@ -314,30 +572,145 @@ insert_cost = 3.0
 append_cost = 0.1
 delete_cost = 3.0
 transpose_cost = 2.0
-wdl_global = weightdamleven.WeightDamLeven(
-    latin_global.get_latin_words_encoded(),
-    latin_global.get_cost_matrix(),
-    is_cost_matrix,
-    replace_cost,
-    insert_cost,
-    insert_cost,
-    delete_cost,
-    transpose_cost)
-wdl_suggestions_global = weightdamleven.WeightDamLeven(
-    latin_global.get_latin_words_encoded(),
-    latin_global.get_cost_matrix(),
-    is_cost_matrix,
-    replace_cost,
-    insert_cost,
-    append_cost,
-    delete_cost,
-    transpose_cost)
+thread_count = 0  # worker threads per engine, 0 = std::thread::hardware_concurrency()
+search_mode = weightdamleven.SearchMode.SCAN  # SearchMode.TRIE walks a prefix trie instead, same results
+kernel_mode = weightdamleven.KernelMode.SIMD  # scan kernel, every KernelMode gives the same results
+# words within two mistyped keys of the query are found from the deletion index without a scan, when that's provable
+deletion_index_max_radius = 2
+deletion_index_max_bytes = 256 * 2**20  # the radius is lowered until the index fits
+deletion_index_fold_cost = 0.5  # case changes (0.1) aren't counted as edits, the nearest keys (1.0) are
+# search_shards > 0 splits the corpus across that many worker processes, a crashed one is restarted on the next search
+search_shards = 0  # 0 searches in this process
+search_shard_addresses = []  # or (host, port) of 'python search_shards.py <host> <port>' servers, one per shard
+# the servers' shared secret, required with search_shard_addresses, local shards get their own
+search_shard_authkey = os.environ.get('SEARCH_SHARD_AUTHKEY', '').encode()
+search_shard_timeout_seconds = 30.0  # a search fails rather than return without a shard's words
+# name -> (replace_cost, insert_cost, append_cost, delete_cost, transpose_cost), one engine serves every profile
+cost_profiles = {
+    'perquire': (replace_cost, insert_cost, insert_cost, delete_cost, transpose_cost),
+    'suggestions': (replace_cost, insert_cost, append_cost, delete_cost, transpose_cost),  # cheap appends for prefixes
+    'sentio_felix': (replace_cost, insert_cost, insert_cost, delete_cost, transpose_cost),  # the one best word
+}
+
+
+def create_wdl(latin: Latin) -> weightdamleven.WeightDamLeven:
+    """ One engine over one shared corpus and cost table, searched with a cost profile per call. """
+    corpus = weightdamleven.Corpus(
+        latin.get_latin_words_codes(),
+        latin.get_latin_words_offsets(),
+        words_utf8=latin.get_latin_words_utf8())
+    cost_table = weightdamleven.CostTable(latin.get_cost_matrix())
+    wdl = weightdamleven.WeightDamLeven(corpus, thread_count)
+    for name, costs in cost_profiles.items():
+        wdl.set_cost_profile(name, cost_table, is_cost_matrix, *costs)
+    wdl.set_char_table(latin.get_char_table())
+    wdl.set_search_mode(search_mode)
+    wdl.set_kernel_mode(kernel_mode)
+    load_deletion_index(wdl, latin)
+    return wdl
+
+
+def load_deletion_index(wdl: weightdamleven.WeightDamLeven, latin: Latin) -> None:
+    """ Attach the deletion index saved next to the snapshot, building and saving it first on the first start. """
+    settings = (deletion_index_max_radius, deletion_index_max_bytes, deletion_index_fold_cost)
+    path = LatinSnapshot.get_deletion_index_path(latin.get_snapshot_path(), settings)
+    data = LatinSnapshot.load_deletion_index(path)
+    if data is not None:
+        try:
+            wdl.set_deletion_index(weightdamleven.DeletionIndex(data))
+            return
+        except ValueError:  # saved by another weightdamleven version
+            data = None  # unmap it before it's replaced
+    deletion_index = wdl.build_deletion_index(*settings, profile='perquire')
+    LatinSnapshot.write_deletion_index(path, deletion_index.to_bytes())
+
+
+def create_search(latin: Latin) -> weightdamleven.WeightDamLeven | ShardedSearch:
+    """ The engine of create_wdl(), or the front end of search shards with the same search methods. """
+    if search_shards <= 0 and not search_shard_addresses:
+        return create_wdl(latin)
+    config = make_shard_config(
+        latin.get_snapshot_path(), latin.get_source_key(), latin.LONG_VOWELS, cost_profiles, is_cost_matrix,
+        # local shards share this machine's cores
+        thread_count or (0 if search_shard_addresses else max(1, (os.cpu_count() or 1) // search_shards)),
+        search_mode, kernel_mode,
+        (deletion_index_max_radius, deletion_index_max_bytes, deletion_index_fold_cost), 'perquire',
+        SESSION_IDLE_SECONDS)
+    return ShardedSearch(config, search_shards, search_shard_addresses, search_shard_authkey,
+                         search_shard_timeout_seconds)
+
+
+wdl_global = create_search(latin_global)
+latin_global.publish_snapshot()  # after create_search(), so the deletion index is saved before other workers look for it
+worker_messages_global = WorkerMessages(
+    os.path.join(Latin.DIRECTORY, "database", "workers"), 5 * SNAPSHOT_POLL_SECONDS) if MULTI_WORKER else None
 
 app = Flask(__name__)
 app.config["UPLOAD_FOLDER"] = os.path.join("static", "IMG")
 socketio = SocketIO(app)
 
 
+def set_search_state(latin: Latin, wdl: weightdamleven.WeightDamLeven | ShardedSearch) -> None:
+    """ Replace the word list and the engine built from it together, pass it to query_cache_global.clear(). """
+    global latin_global
+    global wdl_global
+
+    latin_global = latin
+    wdl_global = wdl
+
+
+def broadcast(event: str, data: dict) -> None:
+    """ socketio.emit() to every client, including the other server workers' clients. """
+    socketio.emit(event, data)
+    publish_to_workers(event, data)
+
+
+def publish_to_workers(event: str, data: dict) -> None:
+    """ WorkerMessages.publish(), a message too long for it only reaches this worker's clients. """
+    if worker_messages_global is None:
+        return
+    try:
+        worker_messages_global.publish(event, data)
+    except ValueError as e:
+        print(f"not sent to the other server workers: {e}")
+
+
+def watch_snapshot_generation() -> None:
+    """
+    Keep this server worker's heartbeat and switch it to the newest published snapshot generation,
+    e.g. the one another worker built when it reloaded the word list.
+    """
+    global latin_global
+    global wdl_global
+    global query_cache_global
+
+    while True:
+        time.sleep(SNAPSHOT_POLL_SECONDS)
+        worker_messages_global.heartbeat()
+        generation = LatinSnapshot.read_generation(Latin.LATIN_WORDS)
+        if (reload_state_global != ReloadState.IDLE or generation is None
+                or generation[1:] == (latin_global.get_snapshot_path(), latin_global.get_source_key())):
+            continue
+        try:
+            latin = Latin(attach_published=True)
+            wdl = create_search(latin)
+        except Exception as e:
+            print(f"attaching snapshot generation {generation[0]} failed: {e}")
+            continue
+        # searches already running finish on the previous engine
+        previous_wdl = wdl_global
+        query_cache_global.clear(functools.partial(set_search_state, latin, wdl))
+        if isinstance(previous_wdl, ShardedSearch):
+            previous_wdl.close()
+
+
+if worker_messages_global is not None:
+    worker_messages_global.subscribe('add_query', lambda data: remember_query(data['query']))
+    for worker_event in ('on_reload_word_list_progress', 'on_reload_word_list_done'):
+        worker_messages_global.subscribe(worker_event, functools.partial(socketio.emit, worker_event))
+    threading.Thread(target=watch_snapshot_generation, daemon=True).start()
+
+
 def random_image() -> str:
     global latin_global
     global images_total_global
@@ -381,6 +754,12 @@ def get_query_or_random_word() -> str:
 
 
 def add_query_to_set(text: str) -> str:
+    remember_query(text)
+    publish_to_workers('add_query', {'query': text})
+
+
+def remember_query(text: str) -> None:
+    """ Add a query to this worker's searches so far and send them to its clients. """
     global searches_so_far_global
     searches_so_far_global[text] = None
     socketio.emit('searches_so_far', {'searches': list(searches_so_far_global.keys())})
@@ -412,19 +791,40 @@ def perquire() -> Response:
 @app.route('/sentio_felix')
 def sentio_felix() -> Response:
     global latin_global
-    global int_char_dict_global
+    global query_cache_global
     global wdl_global
 
     text = get_query_or_random_word()
     print(f"'sentio_felix': {text}")
     add_query_to_set(text)
-    text_ints = latin_global.convert_to_search_ints(text)
-    latin_word, score = wdl_global.weighted_damerau_levenshtein_single_multithread(text_ints)
-    latin_word = ''.join([int_char_dict_global[ival] for ival in latin_word])
-    url = latin_global.create_url(latin_word)
+    search_word = latin_global.convert_to_search_word(text)
+    cache_key = QueryCache.make_key('sentio_felix', search_word, 1)
+    url, cache_generation = query_cache_global.get(cache_key)
+    if url is None:
+        latin_words_scores = []
+        if SENTIO_FELIX_MAX_COST is not None:
+            latin_words_scores = wdl_global.weighted_damerau_levenshtein_words_within_multithread(
+                search_word, SENTIO_FELIX_MAX_COST, 1, profile='sentio_felix')
+        if not latin_words_scores:
+            latin_words_scores = wdl_global.weighted_damerau_levenshtein_words_multithread(search_word, 1, profile='sentio_felix')
+        latin_word, score = latin_words_scores[0]
+        url = latin_global.create_url(latin_word)
+        query_cache_global.put(cache_key, url, cache_generation)
     return redirect(url)
 
 
+@app.route('/cache_stats')
+def cache_stats() -> Response:
+    global query_cache_global
+    return jsonify(query_cache_global.get_stats())
+
+
+@app.route('/query_stats')
+def query_stats() -> Response:
+    global query_dispatcher_global
+    return jsonify(query_dispatcher_global.get_stats())
+
+
 @socketio.on('domus')
 def on_domus(_data):
     global searches_so_far_global
@@ -435,35 +835,38 @@ def on_domus(_data):
 @socketio.on('perquire')
 def on_perquire(data):
     global latin_global
-    global int_char_dict_global
     global searches_so_far_global
+    global query_cache_global
     global wdl_global
 
     text = data['query']
     print(f"'perquire': {text}")
     add_query_to_set(text)
-    text_ints = latin_global.convert_to_search_ints(text)
-    latin_words_scores = wdl_global.weighted_damerau_levenshtein_multithread(text_ints, latin_global.MAX_RESULTS)
-    latin_words = defaultdict(lambda: [])
-    for i, (ints, score) in enumerate(latin_words_scores):
-        latin_words[score].append(''.join([int_char_dict_global[ival] for ival in ints]))
-
-    suggestions = []
-    for score in latin_words:
-        suggestions += sorted(latin_words[score])
-
-    titles_urls = []
-    for i, word in enumerate(suggestions):
-        titles_urls.append([i, latin_global.int_to_roman_numeral(i + 1), word, latin_global.create_url(word)])
+    search_word = latin_global.convert_to_search_word(text)
+    cache_key = QueryCache.make_key('perquire', search_word, latin_global.MAX_RESULTS)
+    titles_urls, cache_generation = query_cache_global.get(cache_key)
+    if titles_urls is None:
+        latin_words_scores = wdl_global.weighted_damerau_levenshtein_words_multithread(
+            search_word, latin_global.MAX_RESULTS, profile='perquire')
+        suggestions = [word for word, _score in latin_words_scores]
+
+        titles_urls = []
+        for i, word in enumerate(suggestions):
+            titles_urls.append([i, latin_global.int_to_roman_numeral(i + 1), word, latin_global.create_url(word)])
+        query_cache_global.put(cache_key, titles_urls, cache_generation)
     socketio.emit('on_perquire_done', {'table': titles_urls, 'searches': list(searches_so_far_global.keys())}, to=request.sid)
 
 
 @socketio.on('query_update')
 def on_query_update(data):
-    global query_update_lock_global
-    global query_update_global
-    with query_update_lock_global:
-        query_update_global[request.sid] = data['query']
+    global query_dispatcher_global
+    query_dispatcher_global.submit(request.sid, data['query'], data.get('id'))
+
+
+@socketio.on('disconnect')
+def on_disconnect(*_args):
+    global query_dispatcher_global
+    query_dispatcher_global.discard(request.sid)
 
 
 def on_add_delete_link_done():
@@ -528,12 +931,12 @@ def on_delete_image(data):
 def on_reload_word_list(_data):
     global reload_state_global
     if reload_state_global == ReloadState.DOWNLOAD:
-        socketio.emit('on_reload_word_list_progress', {'status': 'downloading'})
+        broadcast('on_reload_word_list_progress', {'status': 'downloading'})
         #socketio.emit('on_reload_word_list_done', {'status': 'busy'}, to=request.sid)
         return
     
     if reload_state_global == ReloadState.RELOAD:
-        socketio.emit('on_reload_word_list_progress', {'status': 'reloading'})
+        broadcast('on_reload_word_list_progress', {'status': 'reloading'})
         #socketio.emit('on_reload_word_list_done', {'status': 'busy'}, to=request.sid)
         return
 
@@ -542,43 +945,57 @@ def on_reload_word_list(_data):
     def do_reload():
         global latin_global
         global wdl_global
-        global wdl_suggestions_global
+        global query_cache_global
         global reload_state_global
 
         try:
-            socketio.emit('on_reload_word_list_progress', {'status': 'downloading'})
-            WiktextractParser.parse_latin_word_list_from_url()
+            broadcast('on_reload_word_list_progress', {'status': 'downloading'})
+            # no parser processes: they would import this file again, and with it a whole second server
+            word_list_diff = WiktextractParser.refresh_latin_word_list(
+                processes=1, loaded_words=latin_global.get_latin_words())
+            if word_list_diff is None:  # the dump hasn't changed since the words in use were parsed from it
+                broadcast('on_reload_word_list_done', {
+                    'status': 'done', 'count': len(latin_global.get_latin_words()), 'added': 0, 'removed': 0})
+                return
+            added_words, removed_words, fetch_metadata = word_list_diff
             reload_state_global = ReloadState.RELOAD
-            socketio.emit('on_reload_word_list_progress', {'status': 'reloading'})
-            latin_global.reload_latin_words()
-            wdl_global = weightdamleven.WeightDamLeven(
-                latin_global.get_latin_words_encoded(),
-                latin_global.get_cost_matrix(),
-                is_cost_matrix,
-                replace_cost,
-                insert_cost,
-                insert_cost,
-                delete_cost,
-                transpose_cost)
-            wdl_suggestions_global = weightdamleven.WeightDamLeven(
-                latin_global.get_latin_words_encoded(),
-                latin_global.get_cost_matrix(),
-                is_cost_matrix,
-                replace_cost,
-                insert_cost,
-                append_cost,
-                delete_cost,
-                transpose_cost)
-            socketio.emit('on_reload_word_list_done', {'status': 'done', 'count': len(latin_global._latin_words)})
+            broadcast('on_reload_word_list_progress', {'status': 'reloading'})
+            # other server workers only ever switch to a published generation, so they need the full reload
+            is_incremental = (not MULTI_WORKER and len(added_words) + len(removed_words) <= INCREMENTAL_RELOAD_LIMIT
+                              and all(latin_global.is_encodable(word) for word in added_words))
+            if is_incremental:
+                # the corpus publishes a new version, searches already running finish on the old one,
+                # and the results cached from the old one are dropped with the word list swap right after
+                added_words_encoded = [latin_global.encode_word(word) for word in added_words]
+                latin_words = latin_global.calc_updated_latin_words(added_words, removed_words)
+                try:
+                    wdl_global.update_words(added_words_encoded, added_words, removed_words)
+                    query_cache_global.clear(functools.partial(latin_global.set_latin_words, latin_words))
+                except ShardError as e:
+                    print(f"incremental reload failed, rebuilding the search shards: {e}")
+                    is_incremental = False  # only some shards have the diff, they're all replaced
+            if not is_incremental:
+                # built next to the ones in use, which keep answering until both are replaced at once
+                latin = Latin()
+                wdl = create_search(latin)
+                latin.publish_snapshot()
+                previous_wdl = wdl_global
+                query_cache_global.clear(functools.partial(set_search_state, latin, wdl))
+                if isinstance(previous_wdl, ShardedSearch):
+                    previous_wdl.close()  # after its searches in flight
+            WiktextractParser.save_fetch_metadata(fetch_metadata)  # only now that the words are in use
+            broadcast('on_reload_word_list_done', {
+                'status': 'done', 'count': len(latin_global.get_latin_words()),
+                'added': len(added_words), 'removed': len(removed_words)})
         except Exception as e:
-            socketio.emit('on_reload_word_list_done', {'status': 'error', 'message': str(e)})
+            # short enough for WorkerMessages, so every worker's clients learn the reload is over
+            broadcast('on_reload_word_list_done', {'status': 'error', 'message': str(e)[:1000]})
         finally:
             reload_state_global = ReloadState.IDLE
 
     threading.Thread(target=do_reload, daemon=True).start()
 
 
-
 if __name__ == "__main__":
     if len(sys.argv) > 1:
         print("Starting command thread.")
@@ -587,6 +1004,6 @@ if __name__ == "__main__":
         timer_thread.start()
 
     #socketio.run(app, debug=True)
-    HOST = '0.0.0.0' # localhost
-    PORT = 5000
+    HOST = os.environ.get('WIKTIONARY_LATIN_HOST', '0.0.0.0') # localhost
+    PORT = int(os.environ.get('WIKTIONARY_LATIN_PORT', 5000))
     socketio.run(app, debug=False, host=HOST, port=PORT)
@@ -0,0 +1,117 @@
+import os
+import glob
+import hmac
+import json
+import time
+import socket
+import hashlib
+import secrets
+import threading
+from typing import Callable
+
+
+class WorkerMessages:
+    """
+    A local message queue between the server workers on one machine, for what one worker has to tell every client:
+    a message is sent to each other worker as one JSON datagram on the loopback interface.
+    The workers find each other through a directory with one empty file per worker named by its port,
+    a file that hasn't been touched by heartbeat() for stale_seconds belongs to a worker that's gone.
+    Any local process can send to the port, so every datagram carries an HMAC of its JSON keyed with a secret
+    that only the workers can read, kept in the same directory, and the ones without a valid HMAC are dropped.
+    """
+    MAX_MESSAGE_BYTES = 60000  # one UDP datagram
+    DIGEST_SIZE = hashlib.sha256().digest_size
+
+    def __init__(self, directory: str, stale_seconds: float):
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        os.chmod(directory, 0o700)  # also if it was made before the secret was
+        self._directory = directory
+        self._secret = self.load_secret(directory)
+        self._stale_seconds = stale_seconds
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind(('127.0.0.1', 0))
+        self._port: int = self._socket.getsockname()[1]
+        self._path = os.path.join(directory, f"{self._port}.worker")
+        self._handlers: dict[str, Callable[[dict], None]] = {}  # event -> handler(data)
+        self._lock = threading.Lock()
+        self.heartbeat()
+        threading.Thread(target=self._receive_func, daemon=True).start()
+
+    def subscribe(self, event: str, handler: Callable[[dict], None]) -> None:
+        """ handler(data) runs on the receiving thread for every event another worker publishes. """
+        with self._lock:
+            self._handlers[event] = handler
+
+    def publish(self, event: str, data: dict) -> None:
+        """ Send to every other live worker, without waiting for any of them. """
+        message = json.dumps({'event': event, 'data': data}).encode('utf-8')
+        if len(message) > self.MAX_MESSAGE_BYTES:
+            raise ValueError(f"'{event}': messages are limited to {self.MAX_MESSAGE_BYTES} bytes")
+        message = self._sign(message) + message
+        for port in self._get_peer_ports():
+            try:
+                self._socket.sendto(message, ('127.0.0.1', port))
+            except OSError:
+                pass
+
+    def heartbeat(self) -> None:
+        """ Call it more often than stale_seconds, it also removes the files of workers that are gone. """
+        with open(self._path, 'a'):
+            os.utime(self._path)
+        now = time.time()
+        for path in glob.glob(os.path.join(glob.escape(self._directory), "*.worker")):
+            try:
+                if now - os.path.getmtime(path) > self._stale_seconds:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    @classmethod
+    def load_secret(cls, directory: str) -> bytes:
+        """ The secret shared by the workers using directory, the first one to start makes it. """
+        path = os.path.join(directory, "secret")
+        if not os.path.exists(path):
+            # written in full under another name and then linked, so no worker ever reads half a secret
+            temp_path = os.path.join(directory, f"secret.{os.getpid()}.tmp")
+            fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(secrets.token_bytes(32))
+                os.link(temp_path, path)
+            except FileExistsError:
+                pass  # another worker was first
+            finally:
+                os.remove(temp_path)
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def _sign(self, message: bytes) -> bytes:
+        return hmac.new(self._secret, message, hashlib.sha256).digest()
+
+    def _get_peer_ports(self) -> list[int]:
+        now = time.time()
+        ports = []
+        for path in glob.glob(os.path.join(glob.escape(self._directory), "*.worker")):
+            try:
+                port = int(os.path.basename(path).split('.')[0])
+                if port != self._port and now - os.path.getmtime(path) <= self._stale_seconds:
+                    ports.append(port)
+            except (OSError, ValueError):
+                pass
+        return ports
+
+    def _receive_func(self) -> None:
+        while True:
+            message, _address = self._socket.recvfrom(65536)
+            digest, message = message[:self.DIGEST_SIZE], message[self.DIGEST_SIZE:]
+            if not hmac.compare_digest(digest, self._sign(message)):
+                print("worker message dropped: not signed with the workers' secret")
+                continue
+            try:
+                message = json.loads(message.decode('utf-8'))
+                with self._lock:
+                    handler = self._handlers.get(message['event'])
+                if handler is not None:
+                    handler(message['data'])
+            except Exception as e:
+                print(f"worker message failed: {e}")